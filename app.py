@@ -1,50 +1,58 @@
-from datetime import timedelta
+import time
+from datetime import datetime, timedelta
+from contextlib import asynccontextmanager
 
 from typing import Annotated
 from pydantic import UUID4
 
 from controller.auth import Auth as auth, ACCESS_TOKEN_EXPIRE_MINUTES, is_owner_of_recipe
 from controller.recipe import Recipe
+from controller import importer
 from modals import Token, UserInDB, Recipie as RecipieModal, UpdateRecipie as UpdateRecipieModal
+from modals import RecipeResponse, RecipePage, SearchResultResponse, SearchResultPage, Message
+from modals import RecipeBatchRequest, RecipeBatchResponse, IngredientMatchResponse, UserRecipePage, RecipeChangePage
+from database.engine import get_session, check_schema, warm_up_pool, dispose_engines, read_router
+from database.writer import database_writer, writer_enabled
+from database.cache import recipe_cache, search_cache
+from database.changes import change_feed
+from database.jobs import job_queue
+from controller.auth import principal_cache, password_pool
+import metrics
+import ratelimit
+from compression import CompressionMiddleware
+from idempotency import IdempotencyMiddleware, idempotency_store
 
 from fastapi import FastAPI
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, Request, status
+from fastapi.responses import StreamingResponse, ORJSONResponse, PlainTextResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 
-from config import FastAPIConfig
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import FastAPIConfig, ImportConfig, IngredientConfig, MetricsConfig, CompressionConfig, ChangeFeedConfig, JobConfig, IdempotencyConfig
 
 oauth2_schema = OAuth2PasswordBearer(tokenUrl="token")
+DBSession = Annotated[AsyncSession, Depends(get_session)]
 
-description = """
-### Recipe API (database: SQLite, ORM: SQLAlchemy, framework: FastAPI)
-<hr /> 
-
-**This project is a simple recipe API that allows users to create, read, update, and delete recipes. So, 
-I kindly request you to take care of it. It is not the very best api's out there.**
-<br />
-The database used in this project is SQLite, and the ORM used is SQLAlchemy.
-
-* This is a fast api project that allows users to create, read, update, and delete recipes.
-* The API supports user registration and authentication using JWT tokens.
-* This API supports pagination for the recipes endpoint.
-* The API supports searching for recipes by name, ingredients, or instructions.
-
-### Endpoints
-<hr />
-
-* **GET** `/` - Welcome message
-* **POST** `/register` - Register a new user
-* **POST** `/token` - Get access token
-* **POST** `/recipe` - Add a new recipe
-* **GET** `/recipes` - Get all recipes
-* **GET** `/recipe/{recipe_id}` - Get a recipe by id
-* **PATCH** `/recipe/{recipe_id}` - Update a recipe by id
-* **DELETE** `/recipe/{recipe_id}` - Delete a recipe by id
-* **GET** `/recipie/search` - Search for recipes
-"""
-
-print(FastAPIConfig.app_description)
-print(description == FastAPIConfig.app_description)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    ''' 
+    Check the schema is migrated (once in the launcher's master process when it preloads the app),
+    warm up the connection pool and start the writer queue (and the job queue) on startup,
+    flush the queues and close the connection pool on shutdown 
+    '''
+    if not app.state.schema_checked:
+        await check_schema()
+    await warm_up_pool()
+    if writer_enabled():
+        await database_writer.start()
+    if JobConfig.in_process:
+        await job_queue.start()
+    yield
+    await change_feed.stop()
+    await job_queue.stop()
+    await database_writer.stop()
+    await dispose_engines()
 
 app = FastAPI(    
     title=FastAPIConfig.app_title,
@@ -53,8 +61,42 @@ app = FastAPI(
     license_info=FastAPIConfig.app_license_info,
     contact=FastAPIConfig.app_contact_info,
     description=FastAPIConfig.app_description,
-    openapi_tags=FastAPIConfig.app_tags_metadata
+    openapi_tags=FastAPIConfig.app_tags_metadata,
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
+    # rate limits and load shedding of the expensive routes, see `ratelimit.py`
+    dependencies=[Depends(ratelimit.guard)],
 )
+app.state.schema_checked = False
+# inside the compression, a response is kept uncompressed, see `idempotency.py`
+if IdempotencyConfig.enabled:
+    app.add_middleware(IdempotencyMiddleware)
+if CompressionConfig.enabled:
+    app.add_middleware(CompressionMiddleware)
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    '''
+    Time every request and count the SQL it runs, labelled with the route template
+    (see `metrics.py`), the timing stops when the response headers are ready
+    '''
+    if not MetricsConfig.enabled:
+        return await call_next(request)
+    stats = metrics.RequestStats()
+    token = metrics.current_request.set(stats)
+    started = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        metrics.record_request(
+            request.method, route.path if route else "unmatched", status_code, time.perf_counter() - started, stats
+        )
+        metrics.current_request.reset(token)
+
 
 @app.get("/", tags=["* Welcome"])
 def Welcome():
@@ -70,9 +112,10 @@ def Welcome():
 @app.post("/token", tags=["User Authentication"])
 async def login_for_access_token(
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
+    session: DBSession,
 ) -> Token:
     ''' This function is used to get the access token for the user '''
-    user = auth.authenticate_user(form_data.username, form_data.password)
+    user = await auth.authenticate_user(session, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -86,7 +129,7 @@ async def login_for_access_token(
     return Token(access_token=access_token, token_type="bearer")
 
 @app.post("/register", tags=["User Authentication"])
-async def register_user(user: UserInDB):
+async def register_user(user: UserInDB, session: DBSession):
     ''' 
         ### This function is used to register a new user
         The body of the request should be in the following format:
@@ -97,8 +140,7 @@ async def register_user(user: UserInDB):
             "password": "password"
         }
     '''
-    register = auth.register_user(user)
-    auth_user = auth.authenticate_user(user.email, user.password)
+    register = await auth.register_user(session, user)
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = auth.create_access_token(
         data={"sub": user.email}, expires_delta=access_token_expires
@@ -112,8 +154,8 @@ async def register_user(user: UserInDB):
 #########################################################################################################################
 
 
-@app.post("/recipe", tags=["Recipe"])
-async def add_recipe(recipe: RecipieModal, Token: Annotated[str, Depends(oauth2_schema)]):
+@app.post("/recipe", tags=["Recipe"], response_model=RecipeResponse)
+async def add_recipe(recipe: RecipieModal, Token: Annotated[str, Depends(oauth2_schema)], session: DBSession):
     '''
         ### This function is used to add a new recipe
         - It requires a token to be passed in the header
@@ -155,36 +197,262 @@ async def add_recipe(recipe: RecipieModal, Token: Annotated[str, Depends(oauth2_
                 "instructions": "Instructions",
             }
         ```
+        The response is the created recipe, with its `ETag` and `Last-Modified`.
+        A retry sent with the same `Idempotency-Key` header gets the first response back
+        (` Idempotent-Replayed: true `) instead of adding the recipe twice.
     '''
-    user = auth.get_current_user(Token)
+    user = await auth.get_current_user(session, Token)
     recipe.owner_id = user.id
     
-    created_recipe = Recipe.create_recipe(recipe)
+    created_recipe = await Recipe.create_recipe(session, recipe)
     return created_recipe
 
 
-@app.get("/recipes", tags=["Recipe"])
-async def get_all_recipes(page: int = 1, limit: int = 10):
+@app.post("/recipes/import", tags=["Recipe"])
+async def import_recipes(
+    request: Request,
+    Token: Annotated[str, Depends(oauth2_schema)],
+    session: DBSession,
+    format: str | None = None,
+    batch_size: Annotated[int, Query(ge=1, le=ImportConfig.max_batch_size)] = ImportConfig.batch_size,
+):
+    '''
+        ### This function is used to import many recipes at once
+        - It requires a token to be passed in the header, all recipes are owned by that user
+        ```json
+        Authorization: Bearer <token>
+        ```
+        The body is streamed, either NDJSON (one recipe object per line, ` Content-Type: application/x-ndjson `)
+        ```json
+        {"name": "Recipe Name", "ingredients": "Ingredients", "instructions": "Instructions"}
+        ```
+        or CSV with a header row (` Content-Type: text/csv ` or ` ?format=csv `)
+        ```
+        name,ingredients,instructions
+        Recipe Name,Ingredients,Instructions
+        ```
+        Rows are written and committed ` ?batch_size= ` at a time, invalid rows are skipped.
+        The response reports the imported and failed counts, the first errors and the throughput
+    '''
+    user = await auth.get_current_user(session, Token)
+    if format is None:
+        format = "csv" if "csv" in request.headers.get("content-type", "") else "ndjson"
+    if format not in importer.FORMATS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"format must be one of {', '.join(importer.FORMATS)}",
+        )
+    return await importer.import_recipes(session, request.stream(), format, user.id, batch_size)
+
+@app.post("/recipes/batch", tags=["Recipe"], response_model=RecipeBatchResponse)
+async def get_recipes_batch(batch: RecipeBatchRequest, session: DBSession):
+    '''
+        ### This function is used to get many recipes by id in one request
+        The body lists the ids (at most ` RECIPE_BATCH_MAX_IDS `, 100 by default)
+        ```json
+        {
+            "ids": ["3fa85f64-5717-4562-b3fc-2c963f66afa6", "9c1e5a2e-7d3b-4f7e-9a55-0b8f2d6c4e11"]
+        }
+        ```
+        The recipes come back in the order they were asked for, ids that do not exist are listed in `missing`
+        ```json
+        {
+            "items": [{"id": "3fa85f64-5717-4562-b3fc-2c963f66afa6", "name": "Recipe Name", ...}],
+            "missing": ["9c1e5a2e-7d3b-4f7e-9a55-0b8f2d6c4e11"]
+        }
+        ```
+    '''
+    recipes = await Recipe.get_recipes_by_ids(session, batch.ids)
+    return recipes
+
+IngredientNames = Annotated[list[str], Query(max_length=IngredientConfig.max_terms)]
+
+@app.get("/recipes/by-ingredients", tags=["Recipe"], response_model=list[IngredientMatchResponse] | Message)
+async def get_recipes_by_ingredients(
+    session: DBSession,
+    include_all: IngredientNames = [],
+    include_any: IngredientNames = [],
+    exclude: IngredientNames = [],
+    page: Annotated[int, Query(ge=1)] = 1,
+    limit: Annotated[int, Query(ge=1, le=100)] = 10,
+):
+    '''
+        ### This function is used to find recipes by their ingredients
+        Each parameter can be repeated, at least one ingredient has to be included
+        ` /recipes/by-ingredients?include_all=garlic&include_all=tomato&include_any=basil&include_any=oregano&exclude=chilli `
+        - `include_all`: the recipe has every one of these
+        - `include_any`: the recipe has at least one of these
+        - `exclude`: the recipe has none of these
+        Names are matched like they are stored: lower case, without quantities or units
+        (` 2 cloves Garlic ` is ` garlic `). Recipes are ranked by how many of the included
+        ingredients they have, given as `matches`, and paged with ` ?page=1&limit=10 `
+    '''
+    recipes = await Recipe.get_recipes_by_ingredients(session, include_all, include_any, exclude, page, limit)
+    return recipes
+
+@app.get("/recipes/changes", tags=["Recipe"], response_model=RecipeChangePage)
+async def get_recipe_changes(
+    session: DBSession,
+    since: Annotated[int, Query(ge=0)] = 0,
+    limit: Annotated[int, Query(ge=1, le=ChangeFeedConfig.page_max)] = 100,
+):
+    '''
+        ### This function is used to sync recipes incrementally
+        Every create, update and delete of a recipe is logged with a growing `seq`, this returns
+        the changes after ` since `, oldest first, each with the recipe as it is now (null once deleted)
+        ` /recipes/changes?since=0&limit=100 `
+        Pass `last_seq` back as ` since ` for the next changes, while `has_more` is true there are more
+        right away. ` since=0 ` starts from the oldest change still kept.
+        A ` 410 Gone ` means the changes after ` since ` were pruned, resync from ` /recipes `.
+    '''
+    return await Recipe.get_changes(session, since, limit)
+
+@app.get("/recipes/changes/stream", tags=["Recipe"])
+async def stream_recipe_changes(
+    session: DBSession,
+    since: Annotated[int | None, Query(ge=0)] = None,
+    last_event_id: Annotated[str | None, Header()] = None,
+):
+    '''
+        ### This function is used to follow the recipe changes live
+        A Server-Sent Events stream (` text/event-stream `) of the changes ` /recipes/changes ` lists,
+        one ` change ` event per change with its `seq` as the event id, from ` since ` on (from now
+        on without it). ` Last-Event-ID ` (sent by `EventSource` when it reconnects) wins over ` since `.
+        ```
+        id: 42
+        event: change
+        data: {"seq": 42, "op": "update", "recipe_id": "...", "version": 3, "changed_at": "...", "recipe": {...}}
+        ```
+        The stream ends after a few minutes, reconnect with the last event id to continue.
+    '''
+    if last_event_id:
+        if not last_event_id.isdigit():
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Last-Event-ID must be a change seq")
+        since = int(last_event_id)
+    await Recipe.open_change_stream(session, since)
+    return StreamingResponse(
+        Recipe.stream_changes(since),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/recipes/export", tags=["Recipe"])
+async def export_recipes(
+    owner_id: UUID4 | None = None,
+    created_from: datetime | None = None,
+    created_to: datetime | None = None,
+):
+    '''
+        ### This function is used to export the whole recipe catalogue in one pass
+        The response is streamed as NDJSON (one recipe object per line), oldest recipe first
+        ` /recipes/export `
+        It can be narrowed to one owner and / or a ` created_at ` window (from inclusive, to exclusive)
+        ` /recipes/export?owner_id=<uuid>&created_from=2024-01-01T00:00:00Z&created_to=2024-02-01T00:00:00Z `
+    '''
+    return StreamingResponse(
+        Recipe.export_recipes(owner_id, created_from, created_to),
+        media_type="application/x-ndjson",
+    )
+
+@app.get("/recipes", tags=["Recipe"], response_model=list[RecipeResponse] | RecipePage | Message)
+async def get_all_recipes(
+    session: DBSession,
+    page: int = 1,
+    limit: int = 10,
+    cursor: str | None = None,
+    fields: str | None = None,
+    if_none_match: Annotated[str | None, Header()] = None,
+):
     '''
         ### This function is used to get all recipes
         It supports pagination using query parameters
         ` ?page=1&limit=10 `
+        For large catalogues use the cursor pagination instead, start with an empty cursor
+        ` ?cursor=&limit=10 `
+        and pass the returned `next_cursor` to get the next page while `has_more` is true
+        ```json
+        {
+            "items": [...],
+            "next_cursor": "WyIyMDI0LTExLTE1IDEwOjAwOjAwIiwiLi4uIl0",
+            "has_more": true
+        }
+        ```
+        Only the fields listed in ` fields ` are read from the database and returned
+        ` ?fields=id,name&limit=50 `
+        Every page has an `ETag`, send it back as ` If-None-Match ` to get a ` 304 Not Modified `
+        while none of the recipes on the page changed
+    '''
+    recipes = await Recipe.get_all_recipes(session, page, limit, cursor, if_none_match, fields)
+    return recipes
+
+@app.get("/users/{user_id}/recipes", tags=["Recipe"], response_model=UserRecipePage)
+async def get_user_recipes(
+    user_id: UUID4,
+    session: DBSession,
+    cursor: str = "",
+    limit: Annotated[int, Query(ge=1, le=100)] = 10,
+):
+    '''
+        ### This function is used to get the recipes of one user, oldest first
+        It uses the cursor pagination of ` /recipes `, pass the returned `next_cursor` to get the next page
+        ` /users/{user_id}/recipes?limit=10 `
+        The owner is given once for the page
+        ```json
+        {
+            "owner": {"id": "3fa85f64-5717-4562-b3fc-2c963f66afa6", "name": "John Doe"},
+            "items": [...],
+            "next_cursor": "WyIyMDI0LTExLTE1IDEwOjAwOjAwIiwiLi4uIl0",
+            "has_more": true
+        }
+        ```
+    '''
+    recipes = await Recipe.get_user_recipes(session, user_id, cursor, limit)
+    return recipes
+
+@app.get("/me/recipes", tags=["Recipe"], response_model=UserRecipePage)
+async def get_my_recipes(
+    Token: Annotated[str, Depends(oauth2_schema)],
+    session: DBSession,
+    cursor: str = "",
+    limit: Annotated[int, Query(ge=1, le=100)] = 10,
+):
+    '''
+        ### This function is used to get the recipes of the current user
+        Same as ` /users/{user_id}/recipes ` for the user of the token
+        It requires a token to be passed in the header
+        ```json
+        Authorization: Bearer <token>
+        ```
     '''
-    recipes = Recipe.get_all_recipes(page, limit)
+    user = await auth.get_current_user(session, Token)
+    recipes = await Recipe.get_owner_recipes(session, user, cursor, limit)
     return recipes
 
-@app.get("/recipe/{recipe_id}", tags=["Recipe"])
-async def get_recipe(recipe_id: UUID4):
+@app.get("/recipe/{recipe_id}", tags=["Recipe"], response_model=RecipeResponse | Message)
+async def get_recipe(
+    recipe_id: UUID4,
+    session: DBSession,
+    if_none_match: Annotated[str | None, Header()] = None,
+    if_modified_since: Annotated[str | None, Header()] = None,
+):
     '''
         ### This function is used to get a recipe by id
         It requires the recipe id to be passed in the path
         ` /recipe/{recipe_id} `
+        The response carries an `ETag` and a `Last-Modified` header, send them back as
+        ` If-None-Match ` / ` If-Modified-Since ` to get a ` 304 Not Modified ` while the recipe is unchanged
     '''
-    recipe = Recipe.get_recipe_by_id(recipe_id)
+    recipe = await Recipe.get_recipe_by_id(session, recipe_id, if_none_match, if_modified_since)
     return recipe
 
 @app.patch("/recipe/{recipe_id}", tags=["Recipe"])
-async def update_recipe(recipe_id: UUID4, recipe: UpdateRecipieModal, Token: Annotated[str, Depends(oauth2_schema)]):
+async def update_recipe(
+    recipe_id: UUID4,
+    recipe: UpdateRecipieModal,
+    Token: Annotated[str, Depends(oauth2_schema)],
+    session: DBSession,
+    if_match: Annotated[str | None, Header()] = None,
+):
     '''
         ### This function is used to update a recipe by id
         It requires the recipe id to be passed in the path
@@ -228,14 +496,19 @@ async def update_recipe(recipe_id: UUID4, recipe: UpdateRecipieModal, Token: Ann
             "instructions": "Instructions",
         }
         ```
+        To not overwrite someone else's edit send the recipe's `ETag` as ` If-Match `, the update
+        is then refused with ` 412 Precondition Failed ` if the recipe changed in the meantime.
+        The response carries the new `ETag`
         <hr />
         <strong><em>Nobody can update a recipe that they do not own</em></strong>
     '''
-    updated_recipe = Recipe.update_recipe(recipe_id=recipe_id, recipe=recipe, Token=Token)
+    updated_recipe = await Recipe.update_recipe(
+        session=session, recipe_id=recipe_id, recipe=recipe, Token=Token, if_match=if_match
+    )
     return updated_recipe
 
 @app.delete("/recipe/{recipe_id}", tags=["Recipe"])
-async def delete_recipe(recipe_id: UUID4, Token: Annotated[str, Depends(oauth2_schema)]):
+async def delete_recipe(recipe_id: UUID4, Token: Annotated[str, Depends(oauth2_schema)], session: DBSession):
     '''
         ### This function is used to delete a recipe by id
         It requires the recipe id to be passed in the path
@@ -247,19 +520,71 @@ async def delete_recipe(recipe_id: UUID4, Token: Annotated[str, Depends(oauth2_s
         <hr />
         <strong><em>Nobody can delete a recipe that they do not own</em></strong>
     '''
-    deleted_recipe = Recipe.delete_recipe(recipe_id=recipe_id, Token=Token)
+    deleted_recipe = await Recipe.delete_recipe(session=session, recipe_id=recipe_id, Token=Token)
     return deleted_recipe
 
-@app.get("/recipie/search", tags=["Recipe"])
-async def search_recipie(query: str = '',page: int = 1, limit: int = 10):
+@app.get("/recipie/search", tags=["Recipe"], response_model=list[SearchResultResponse] | SearchResultPage | list[RecipeResponse] | Message)
+async def search_recipie(
+    session: DBSession, query: str = '',page: int = 1, limit: int = 10, cursor: str | None = None, fields: str | None = None
+):
     '''
         ### This function is used to search for recipes
         It supports pagination using query parameters
         ` ?page=1&limit=10 `
         The query parameter is used to search for recipes by name, ingredients, or instructions
         ` /recipie/search?query=chicken `
+        Every word is matched as a prefix (` chick ` finds chicken), case, word order and plural
+        endings do not matter, results are ranked by relevance and carry a `snippet` with the
+        matched words highlighted. ` X-Total-Count ` tells how many recipes match in all
         All together it looks like this
         ` /recipie/search?query=chicken&page=1&limit=10 `
+        Cursor pagination works the same way as on ` /recipes `, the matches are then
+        returned oldest first instead of by relevance
+        ` /recipie/search?query=chicken&cursor=&limit=10 `
+        ` fields ` narrows the results to the listed fields, the snippet is only built when asked for
+        ` /recipie/search?query=chicken&fields=id,name,snippet `
+    '''
+    recipes = await Recipe.search_recipies(session, query, page, limit, cursor, fields)
+    return recipes
+
+
+#########################################################################################################################
+# -------------------------------------------------MONITORING-----------------------------------------------------------
+#########################################################################################################################
+
+
+@app.get("/cache/stats", tags=["Monitoring"])
+async def cache_stats():
+    '''
+        ### This function is used to size the in-process caches
+        Returns the hit, miss, eviction, expiration and invalidation counters of
+        - `recipes`: the cache in front of ` /recipe/{recipe_id} ` and ` /recipes `
+        - `principals`: the verified token to principal cache of the authenticated endpoints
+        - `searches`: the search result cache of ` /recipie/search ` (hits, misses and `stale` entries)
+    '''
+    return {"recipes": recipe_cache.stats(), "principals": principal_cache.stats(), "searches": search_cache.stats()}
+
+
+metrics.register_stats("recipe_cache", recipe_cache.stats)
+metrics.register_stats("principal_cache", principal_cache.stats)
+metrics.register_stats("search_cache", search_cache.stats)
+metrics.register_stats("database_writer", database_writer.stats)
+metrics.register_stats("read_router", read_router.stats)
+metrics.register_stats("change_feed", change_feed.stats)
+metrics.register_stats("job_queue", job_queue.stats)
+metrics.register_stats("idempotency", idempotency_store.stats)
+metrics.register_stats("password_hash_pool", password_pool.stats)
+metrics.register_stats("rate_limiter", ratelimit.rate_limiter.stats)
+metrics.register_stats("load_shedder", ratelimit.concurrency_limiter.stats)
+
+@app.get("/metrics", tags=["Monitoring"], response_class=PlainTextResponse)
+async def get_metrics():
+    '''
+        ### This function is used to scrape the metrics in the Prometheus text format
+        - `http_request_duration_seconds`, `http_requests_total`: latency and count per route
+        - `http_request_db_queries`, `http_request_db_seconds`: SQL statements and SQL time per request
+        - `http_request_repeated_queries_total`: requests running one statement over and over (N+1 suspects)
+        - `db_queries_total`, `db_query_duration_seconds`, `db_slow_queries_total`: per SQL operation
+        - `recipe_cache_*`, `principal_cache_*`, `database_writer_*`, `password_hash_pool_*`: component counters
     '''
-    recipes = Recipe.search_recipies(query, page, limit)
-    return recipes
\ No newline at end of file
+    return PlainTextResponse(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
\ No newline at end of file
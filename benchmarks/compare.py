@@ -0,0 +1,59 @@
+'''
+Put two benchmark runs side by side
+```bash
+python -m benchmarks.compare benchmarks/results/functions-10000-<before>.json benchmarks/results/functions-10000-<after>.json
+```
+For every case both runs have, prints the p50 / p95 / p99 latency (and throughput when there is one)
+of the baseline and the candidate and the relative change, negative is faster.
+'''
+
+import json
+import argparse
+from pathlib import Path
+
+METRICS = ("p50_ms", "p95_ms", "p99_ms", "rps")
+
+
+def load(path: str):
+    return json.loads(Path(path).read_text())
+
+
+def change(before, after):
+    if not before or after is None:
+        return None
+    return (after - before) / before * 100
+
+
+def compare(baseline: dict, candidate: dict):
+    ''' case -> metric -> (baseline, candidate, change in percent) '''
+    rows = {}
+    for case, before in baseline["cases"].items():
+        after = candidate["cases"].get(case)
+        if after is None:
+            continue
+        rows[case] = {
+            metric: (before.get(metric), after.get(metric), change(before.get(metric), after.get(metric)))
+            for metric in METRICS if before.get(metric) is not None
+        }
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    args = parser.parse_args()
+
+    baseline, candidate = load(args.baseline), load(args.candidate)
+    for run, label in ((baseline, "baseline"), (candidate, "candidate")):
+        print(f"{label:<10} {run['name']} {run['created_at']} commit {run['environment'].get('commit')}")
+    print()
+    print(f"{'case':<34} {'metric':<7} {'baseline':>10} {'candidate':>10} {'change':>8}")
+    for case, metrics in compare(baseline, candidate).items():
+        for metric, (before, after, percent) in metrics.items():
+            shown = "-" if percent is None else f"{percent:+.1f}%"
+            print(f"{case:<34} {metric:<7} {before:>10} {after:>10} {shown:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+'''
+Synthetic, reproducible benchmark databases
+```bash
+python -m benchmarks.dataset --rows 10000 1000000 10000000
+```
+`benchmarks/data/recipes-<rows>.db` gets `rows` recipes spread over `rows / RECIPES_PER_USER` users.
+The schema comes from the regular migrations. The recipes are loaded right after the initial
+migration, so the search index and lookup indexes are built once over the whole table by the
+later migrations instead of row by row.
+A database that already exists is reused after applying any migration it is missing,
+the same `--seed` always gives the same data.
+
+Every user is `user<n>@example.com` with the password `BENCHMARK_PASSWORD`.
+'''
+
+import time
+import uuid
+import random
+import argparse
+from pathlib import Path
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import create_engine, insert, select, func, literal_column, table, column
+
+from controller.auth import pwd_context
+from database.migrations import upgrade
+from modals import DBRecipeModal, DBUserModal
+
+DATA_DIR = Path(__file__).resolve().parent / "data"
+DEFAULT_SIZES = (10_000, 1_000_000, 10_000_000)
+RECIPES_PER_USER = 100
+INSERT_BATCH = 20_000
+BENCHMARK_PASSWORD = "benchmark-password"
+
+recipie = DBRecipeModal.__table__
+rowid = literal_column("recipie.rowid")
+user_account = DBUserModal.__table__
+# the tables as the initial migration creates them, the model's later columns (and their
+# defaults, `version`) do not exist yet when the rows are loaded
+initial_recipie = table("recipie", *map(column, ("id", "name", "ingredients", "instructions", "owner_id", "created_at")))
+initial_user_account = table("user_account", *map(column, ("id", "name", "email", "password", "created_at")))
+
+# a few very common words and a long tail, so searches can hit many or few recipes
+COMMON_WORDS = ["chicken", "tomato", "garlic", "onion", "rice", "butter", "salt", "pepper"]
+RARE_WORDS = [f"{stem}{number}" for stem in ("saffron", "sumac", "yuzu", "kombu") for number in range(250)]
+DISHES = ["curry", "stew", "soup", "salad", "pie", "roast", "risotto", "tart", "bake", "stir fry"]
+STEPS = ["chop", "fry", "simmer", "stir", "season", "bake", "rest", "serve", "whisk", "boil"]
+
+EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def dataset_path(rows: int):
+    return DATA_DIR / f"recipes-{rows}.db"
+
+
+def database_url(path: Path, driver: str = "aiosqlite"):
+    ''' Async URL the application and the data functions use for a dataset '''
+    return f"sqlite+{driver}:///{path}"
+
+
+def user_email(number: int):
+    return f"user{number}@example.com"
+
+
+def user_count(rows: int):
+    return max(1, rows // RECIPES_PER_USER)
+
+
+def make_uuid(rng: random.Random):
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def user_rows(count: int, rng: random.Random):
+    # one hash for everybody, hashing millions of passwords would take longer than the load
+    password = pwd_context.hash(BENCHMARK_PASSWORD)
+    return [{
+        "id": make_uuid(rng),
+        "name": f"User {number}",
+        "email": user_email(number),
+        "password": password,
+        "created_at": str(EPOCH),
+    } for number in range(count)]
+
+
+def recipe_rows(rows: int, owner_ids: list[str], rng: random.Random):
+    ''' Batches of recipes in `created_at` order, one second apart, owners taken round robin '''
+    batch = []
+    for number in range(rows):
+        words = rng.sample(COMMON_WORDS, 3) + [rng.choice(RARE_WORDS)]
+        batch.append({
+            "id": make_uuid(rng),
+            "name": f"{words[0].title()} {rng.choice(DISHES)} {number}",
+            "ingredients": ", ".join(words),
+            "instructions": ". ".join(f"{rng.choice(STEPS)} the {word}" for word in words),
+            "owner_id": owner_ids[number % len(owner_ids)],
+            "created_at": str(EPOCH + timedelta(seconds=number)),
+        })
+        if len(batch) == INSERT_BATCH:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def build(rows: int, seed: int = 0, force: bool = False):
+    ''' Create the dataset of `rows` recipes unless it exists, returns its path '''
+    path = dataset_path(rows)
+    if path.exists() and not force:
+        engine = create_engine(database_url(path, "pysqlite"))
+        with engine.connect() as conn:
+            upgrade(conn)
+        engine.dispose()
+        return path
+    DATA_DIR.mkdir(exist_ok=True)
+    path.unlink(missing_ok=True)
+
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    engine = create_engine(database_url(path, "pysqlite"))
+    with engine.connect() as conn:
+        conn.exec_driver_sql("PRAGMA journal_mode = WAL")
+        conn.exec_driver_sql("PRAGMA synchronous = OFF")
+        conn.commit()
+        upgrade(conn, target=1)
+
+        users = user_rows(user_count(rows), rng)
+        with conn.begin():
+            conn.execute(insert(initial_user_account), users)
+            owner_ids = [user["id"] for user in users]
+            for batch in recipe_rows(rows, owner_ids, rng):
+                conn.execute(insert(initial_recipie), batch)
+
+        upgrade(conn)
+        conn.exec_driver_sql("ANALYZE")
+        conn.commit()
+    engine.dispose()
+    print(f"built {path.name}: {rows} recipes, {len(owner_ids)} users in {time.perf_counter() - started:.1f}s")
+    return path
+
+
+def sample_ids(path: Path, count: int, seed: int = 0):
+    ''' `count` recipe ids spread over the whole table, for lookups that should miss the cache '''
+    engine = create_engine(database_url(path, "pysqlite"))
+    with engine.connect() as conn:
+        total = conn.execute(select(func.max(rowid)).select_from(recipie)).scalar()
+        rowids = random.Random(seed).sample(range(1, total + 1), min(count, total))
+        ids = conn.execute(select(recipie.c.id).where(rowid.in_(rowids))).scalars().all()
+    engine.dispose()
+    return ids
+
+
+def owned_recipe_id(path: Path, email: str):
+    ''' Id of one recipe owned by the user with `email` '''
+    engine = create_engine(database_url(path, "pysqlite"))
+    with engine.connect() as conn:
+        owner_id = select(user_account.c.id).where(user_account.c.email == email).scalar_subquery()
+        recipe_id = conn.execute(select(recipie.c.id).where(recipie.c.owner_id == owner_id).limit(1)).scalar()
+    engine.dispose()
+    return recipe_id
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the synthetic benchmark databases")
+    parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--force", action="store_true", help="rebuild databases that already exist")
+    args = parser.parse_args()
+    for rows in args.rows:
+        print(build(rows, args.seed, args.force))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+'''
+In-process micro-benchmarks of the data functions
+```bash
+python -m benchmarks.functions --rows 10000 1000000 10000000 --iterations 200
+```
+Each case calls one `RecipiessFunction` / `UserFunction` coroutine on a session of the dataset's
+database (see `benchmarks/dataset.py`, missing datasets are built first) and records the latency
+of every call. `recipe_cache` and `search_cache` are cleared before each timed call unless the
+case is about the cache, so the numbers are those of the database path. Write cases restore what
+they change, the background jobs they queue are dropped afterwards instead of run.
+One result file is saved per dataset size.
+'''
+
+import time
+import random
+import asyncio
+import argparse
+
+from sqlalchemy import delete
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from database.cache import recipe_cache, search_cache
+from database.engine import use_sqlite_profile
+from database.recipe import RecipiessFunction
+from database.users import UserFunction
+from database.utils import encode_cursor
+from modals import Recipie, UpdateRecipie, job
+
+from benchmarks import dataset
+from benchmarks.results import summarize, save_results, print_cases
+
+PAGE_SIZE = 10
+
+
+class Fixture:
+    ''' Ids, emails and cursors picked from the dataset before timing starts '''
+    def __init__(self, rows: int, seed: int):
+        path = dataset.build(rows, seed)
+        self.rows = rows
+        self.url = dataset.database_url(path)
+        self.recipe_ids = dataset.sample_ids(path, 1000, seed)
+        self.rng = random.Random(seed)
+
+    async def load(self, session):
+        users = dataset.user_count(self.rows)
+        self.emails = [dataset.user_email(self.rng.randrange(users)) for _ in range(1000)]
+        self.user_ids = [(await UserFunction.get_user_by_email(session, email)).id for email in self.emails[:100]]
+        self.middle_page = max(1, self.rows // PAGE_SIZE // 2)
+        middle = await RecipiessFunction.get_all_recipes(session, self.middle_page, 1)
+        self.middle_cursor = encode_cursor(middle[0])
+        self.owned = await RecipiessFunction.get_recipe_by_id(session, self.recipe_ids[0])
+
+    def pick(self, values):
+        return self.rng.choice(values)
+
+
+def cases(fixture: Fixture):
+    '''
+    name -> (coroutine function taking a session, whether the cache is cleared before each call)
+    '''
+    recipes = RecipiessFunction
+    users = UserFunction
+    rare_word = dataset.RARE_WORDS[0]
+
+    async def update_recipe(session):
+        recipe = fixture.owned
+        await recipes.update_recipe(session, recipe.id, UpdateRecipie(name=recipe.name), owner_id=recipe.owner_id)
+
+    async def create_and_delete(session):
+        created = Recipie(name="Benchmark recipe", ingredients="salt", instructions="stir")
+        # assigned like ` POST /recipe ` does, the column takes the id as text
+        created.owner_id = fixture.owned.owner_id
+        await recipes.create_recipe(session, created)
+        await recipes.delete_recipe(session, created.id, owner_id=created.owner_id)
+
+    return {
+        "get_all_recipes.first_page": (lambda session: recipes.get_all_recipes(session, 1, PAGE_SIZE), True),
+        "get_all_recipes.middle_page_offset": (lambda session: recipes.get_all_recipes(session, fixture.middle_page, PAGE_SIZE), True),
+        "get_all_recipes.first_page_cursor": (lambda session: recipes.get_all_recipes(session, 1, PAGE_SIZE, ""), True),
+        "get_all_recipes.middle_page_cursor": (lambda session: recipes.get_all_recipes(session, 1, PAGE_SIZE, fixture.middle_cursor), True),
+        "get_all_recipes.first_page_fields": (lambda session: recipes.get_all_recipes(session, 1, PAGE_SIZE, None, ("id", "name")), True),
+        "get_all_recipes.cached": (lambda session: recipes.get_all_recipes(session, 1, PAGE_SIZE), False),
+        "get_recipes_by_owner.first_page": (lambda session: recipes.get_recipes_by_owner(session, fixture.owned.owner_id, "", PAGE_SIZE), True),
+        "get_recipe_by_id": (lambda session: recipes.get_recipe_by_id(session, fixture.pick(fixture.recipe_ids)), True),
+        "get_recipe_by_id.cached": (lambda session: recipes.get_recipe_by_id(session, fixture.recipe_ids[0]), False),
+        "search_recipies.common_word": (lambda session: recipes.search_recipies(session, "chicken", 1, PAGE_SIZE), True),
+        "search_recipies.rare_word": (lambda session: recipes.search_recipies(session, rare_word, 1, PAGE_SIZE), True),
+        "search_recipies.prefix": (lambda session: recipes.search_recipies(session, "chick garl", 1, PAGE_SIZE), True),
+        "search_recipies.cursor": (lambda session: recipes.search_recipies(session, "chicken", 1, PAGE_SIZE, ""), True),
+        "search_recipies.fields_no_snippet": (lambda session: recipes.search_recipies(session, "chicken", 1, PAGE_SIZE, None, ("id", "name")), True),
+        "search_recipies.deep_page": (lambda session: recipes.search_recipies(session, "chicken", 150, PAGE_SIZE), True),
+        "search_recipies.cached": (lambda session: recipes.search_recipies(session, "Chickens", 1, PAGE_SIZE), False),
+        "search_recipies.cached_no_snippet": (lambda session: recipes.search_recipies(session, "chicken", 2, PAGE_SIZE, None, ("id", "name")), False),
+        "count_search_matches.common_word": (lambda session: recipes.count_search_matches(session, "chicken"), True),
+        "get_recipes_by_ids.100": (lambda session: recipes.get_recipes_by_ids(session, fixture.recipe_ids[:100]), True),
+        "get_recipes_by_ingredients.all_common": (lambda session: recipes.get_recipes_by_ingredients(session, ["chicken", "garlic"], [], [], 1, PAGE_SIZE), True),
+        "get_recipes_by_ingredients.any_rare_exclude": (lambda session: recipes.get_recipes_by_ingredients(session, [], dataset.RARE_WORDS[:2], ["chicken"], 1, PAGE_SIZE), True),
+        "get_changes.first_page": (lambda session: recipes.get_changes(session, 0, PAGE_SIZE), True),
+        "existing_recipe_ids.1000": (lambda session: recipes.existing_recipe_ids(session, fixture.recipe_ids), True),
+        "get_user_by_email": (lambda session: users.get_user_by_email(session, fixture.pick(fixture.emails)), True),
+        "get_user_by_id": (lambda session: users.get_user_by_id(session, fixture.pick(fixture.user_ids)), True),
+        "update_recipe": (update_recipe, True),
+        "create_recipe+delete_recipe": (create_and_delete, True),
+    }
+
+
+async def run_case(name: str, sessionmaker, function, clear_cache: bool, iterations: int, warmup: int):
+    '''
+    Time `iterations` calls of `function` after `warmup` untimed ones. Failed calls are counted,
+    the first failure is kept in the results as `first_error`, and a case whose every call
+    failed stops the run rather than reporting an empty timing.
+    '''
+    latencies = []
+    errors = 0
+    first_error = None
+    async with sessionmaker() as session:
+        for iteration in range(warmup + iterations):
+            if clear_cache:
+                recipe_cache.clear()
+                search_cache.clear()
+            start = time.perf_counter()
+            try:
+                await function(session)
+            except Exception as error:
+                errors += 1
+                first_error = first_error or error
+                await session.rollback()
+                continue
+            elapsed = time.perf_counter() - start
+            # end the read transaction so every call starts from a fresh snapshot, as a request does
+            await session.commit()
+            if iteration >= warmup:
+                latencies.append(elapsed)
+    if iterations and not latencies:
+        raise RuntimeError(f"{name}: every timed call failed ({errors} errors), the first with {first_error!r}") from first_error
+    summary = summarize(latencies, errors=errors)
+    if first_error is not None:
+        summary["first_error"] = repr(first_error)
+    return summary
+
+
+async def run(rows: int, iterations: int, warmup: int, seed: int, only: list[str] | None):
+    fixture = Fixture(rows, seed)
+    engine = create_async_engine(fixture.url)
+    use_sqlite_profile(engine)
+    sessionmaker = async_sessionmaker(engine, expire_on_commit=False)
+
+    async with sessionmaker() as session:
+        await fixture.load(session)
+
+    results = {}
+    for name, (function, clear_cache) in cases(fixture).items():
+        if only and not any(name.startswith(prefix) for prefix in only):
+            continue
+        results[name] = await run_case(name, sessionmaker, function, clear_cache, iterations, warmup)
+    async with sessionmaker() as session:
+        await session.execute(delete(job))
+        await session.commit()
+    await engine.dispose()
+    recipe_cache.clear()
+    search_cache.clear()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks of the data functions")
+    parser.add_argument("--rows", type=int, nargs="+", default=dataset.DEFAULT_SIZES)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", nargs="+", help="run only the cases starting with these names")
+    args = parser.parse_args()
+
+    for rows in args.rows:
+        results = asyncio.run(run(rows, args.iterations, args.warmup, args.seed, args.only))
+        print(f"\n{rows} recipes")
+        print_cases(results)
+        parameters = {"rows": rows, "iterations": args.iterations, "warmup": args.warmup, "seed": args.seed}
+        print(save_results(f"functions-{rows}", parameters, results))
+
+
+if __name__ == "__main__":
+    main()
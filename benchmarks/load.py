@@ -0,0 +1,189 @@
+'''
+HTTP load scenario against a local server
+```bash
+python -m benchmarks.load --rows 1000000 --duration 60 --concurrency 64
+```
+Starts `python manage.py serve` on a copy of the dataset's database (see `benchmarks/dataset.py`),
+logs a few users in, then runs `--concurrency` clients for `--duration` seconds. Every client
+picks its next request at random from `SCENARIO` by weight (reads, writes and logins) and sends
+it as soon as the previous one answered. Latency percentiles and requests per second are
+reported per request kind and overall, and saved as JSON.
+A 503 from the password hashing pool is counted as an error of the login it answered.
+'''
+
+import os
+import sys
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+
+import httpx
+
+from benchmarks import dataset
+from benchmarks.results import summarize, save_results, print_cases
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+
+# request kind -> weight
+SCENARIO = {
+    "list_recipes": 25,
+    "list_recipes_cursor": 10,
+    "get_recipe": 30,
+    "search": 15,
+    "create_recipe": 8,
+    "update_recipe": 7,
+    "login": 5,
+}
+LOGGED_IN_USERS = 20
+
+
+class Workload:
+    ''' What the requests are made of, prepared before the clock starts '''
+    def __init__(self, path: Path, rows: int, seed: int):
+        self.rng = random.Random(seed)
+        self.recipe_ids = dataset.sample_ids(path, 1000, seed)
+        users = dataset.user_count(rows)
+        self.emails = [dataset.user_email(number) for number in self.rng.sample(range(users), min(LOGGED_IN_USERS, users))]
+        # the recipe each user updates during the run
+        self.owned = [dataset.owned_recipe_id(path, email) for email in self.emails]
+        self.tokens = []
+        self.search_words = dataset.COMMON_WORDS + dataset.RARE_WORDS[:20]
+
+    async def login(self, client: httpx.AsyncClient):
+        for email in self.emails:
+            response = await client.post("/token", data={"username": email, "password": dataset.BENCHMARK_PASSWORD})
+            response.raise_for_status()
+            self.tokens.append(response.json()["access_token"])
+
+    def request(self, kind: str):
+        ''' (method, url, keyword arguments of `httpx.AsyncClient.request`) of one request '''
+        rng = self.rng
+        if kind == "list_recipes":
+            return "GET", "/recipes", {"params": {"page": rng.randint(1, 100), "limit": 10}}
+        if kind == "list_recipes_cursor":
+            return "GET", "/recipes", {"params": {"cursor": "", "limit": 10}}
+        if kind == "get_recipe":
+            return "GET", f"/recipe/{rng.choice(self.recipe_ids)}", {}
+        if kind == "search":
+            return "GET", "/recipie/search", {"params": {"query": rng.choice(self.search_words), "limit": 10}}
+        user = rng.randrange(len(self.tokens))
+        headers = {"Authorization": f"Bearer {self.tokens[user]}"}
+        if kind == "create_recipe":
+            body = {"name": f"Load test {rng.random()}", "ingredients": "salt", "instructions": "stir"}
+            return "POST", "/recipe", {"json": body, "headers": headers}
+        if kind == "update_recipe":
+            body = {"name": f"Load test recipe {rng.random()}"}
+            return "PATCH", f"/recipe/{self.owned[user]}", {"json": body, "headers": headers}
+        if kind == "login":
+            form = {"username": self.emails[user], "password": dataset.BENCHMARK_PASSWORD}
+            return "POST", "/token", {"data": form}
+        raise ValueError(f"Unknown request kind {kind}")
+
+
+async def client_loop(client, workload: Workload, deadline: float, samples: dict, errors: dict):
+    kinds = list(SCENARIO)
+    weights = list(SCENARIO.values())
+    while time.perf_counter() < deadline:
+        kind = workload.rng.choices(kinds, weights)[0]
+        method, url, options = workload.request(kind)
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, **options)
+            failed = response.status_code >= 400
+        except httpx.HTTPError:
+            failed = True
+        elapsed = time.perf_counter() - start
+        if failed:
+            errors[kind] = errors.get(kind, 0) + 1
+        else:
+            samples.setdefault(kind, []).append(elapsed)
+
+
+def start_server(database: Path, port: int, workers: int):
+    environment = {
+        **os.environ,
+        "DATABASE_URL": dataset.database_url(database),
+        "DATABASE_ECHO": "false",
+        "SERVER_ACCESS_LOG": "false",
+        # the workers' caches have to see each other's writes, as in production
+        "RECIPE_CACHE_BACKEND": "shared",
+        "RECIPE_CACHE_SHARED_PATH": str(database.with_suffix(".invalidations")),
+        # every client comes from 127.0.0.1, per client rate limits would measure the limiter
+        "RATE_LIMITS": "",
+    }
+    return subprocess.Popen(
+        [sys.executable, "manage.py", "serve", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=ROOT_DIR, env=environment, stdout=subprocess.DEVNULL,
+    )
+
+
+async def wait_until_ready(client: httpx.AsyncClient, timeout: float = 30):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            if (await client.get("/")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("the server did not come up")
+
+
+async def run(args):
+    source = dataset.build(args.rows, args.seed)
+    workload = Workload(source, args.rows, args.seed)
+
+    with tempfile.TemporaryDirectory() as directory:
+        # the writes of the run must not leak into the next one
+        database = Path(directory) / source.name
+        shutil.copyfile(source, database)
+        server = start_server(database, args.port, args.workers)
+        try:
+            limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", limits=limits, timeout=60) as client:
+                await wait_until_ready(client)
+                await workload.login(client)
+
+                samples, errors = {}, {}
+                started = time.perf_counter()
+                deadline = started + args.duration
+                await asyncio.gather(*(
+                    client_loop(client, workload, deadline, samples, errors) for _ in range(args.concurrency)
+                ))
+                elapsed = time.perf_counter() - started
+        finally:
+            server.terminate()
+            server.wait()
+
+    cases = {"all": summarize(
+        [latency for latencies in samples.values() for latency in latencies], elapsed, sum(errors.values())
+    )}
+    for kind in SCENARIO:
+        cases[kind] = summarize(samples.get(kind, []), elapsed, errors.get(kind, 0))
+    return cases
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mixed read/write/login load against a local server")
+    parser.add_argument("--rows", type=int, default=dataset.DEFAULT_SIZES[0])
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=1, help="worker processes")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    cases = asyncio.run(run(args))
+    print_cases(cases)
+    parameters = {**vars(args), "scenario": SCENARIO}
+    print(save_results(f"load-{args.rows}", parameters, cases))
+
+
+if __name__ == "__main__":
+    main()
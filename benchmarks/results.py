@@ -0,0 +1,97 @@
+'''
+Shared pieces of the benchmark suite: latency summaries and the JSON result files.
+
+Every run is written to `benchmarks/results/<name>-<UTC timestamp>.json` as
+```json
+{"name": "...", "environment": {...}, "parameters": {...}, "cases": {"<case>": {"p50_ms": ..., ...}}}
+```
+so any two runs can be put side by side with `python -m benchmarks.compare`.
+'''
+
+import json
+import math
+import sqlite3
+import platform
+import subprocess
+from pathlib import Path
+from datetime import datetime, timezone
+
+BENCHMARKS_DIR = Path(__file__).resolve().parent
+RESULTS_DIR = BENCHMARKS_DIR / "results"
+
+
+def percentile(sorted_values, fraction: float):
+    ''' Nearest-rank percentile of already sorted values '''
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies, elapsed: float | None = None, errors: int = 0):
+    '''
+    Latency statistics in milliseconds for a list of durations in seconds.
+    With `elapsed` (wall clock seconds of the run) the throughput is reported as well.
+    '''
+    values = sorted(latencies)
+    to_ms = lambda seconds: None if seconds is None else round(seconds * 1000, 3)
+    summary = {
+        "count": len(values),
+        "errors": errors,
+        "mean_ms": to_ms(sum(values) / len(values)) if values else None,
+        "min_ms": to_ms(values[0]) if values else None,
+        "p50_ms": to_ms(percentile(values, 0.50)),
+        "p95_ms": to_ms(percentile(values, 0.95)),
+        "p99_ms": to_ms(percentile(values, 0.99)),
+        "max_ms": to_ms(values[-1]) if values else None,
+    }
+    if elapsed:
+        summary["rps"] = round(len(values) / elapsed, 1)
+    return summary
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BENCHMARKS_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    ''' What the numbers depend on besides the code '''
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "sqlite": sqlite3.sqlite_version,
+    }
+
+
+def save_results(name: str, parameters: dict, cases: dict, output: str | None = None):
+    ''' Write one run to `output` (default: a new file in `benchmarks/results`), returns the path '''
+    started = datetime.now(timezone.utc)
+    if output is None:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        output = RESULTS_DIR / f"{name}-{started:%Y%m%dT%H%M%SZ}.json"
+    path = Path(output)
+    path.write_text(json.dumps({
+        "name": name,
+        "created_at": started.isoformat(),
+        "environment": environment(),
+        "parameters": parameters,
+        "cases": cases,
+    }, indent=2))
+    return path
+
+
+def print_cases(cases: dict):
+    ''' The cases of a run as a table '''
+    print(f"{'case':<34} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'rps':>9} {'errors':>7}")
+    for case, summary in cases.items():
+        cells = [summary.get(key) for key in ("p50_ms", "p95_ms", "p99_ms", "rps")]
+        cells = [f"{cell:>9.3f}" if isinstance(cell, float) else f"{'-' if cell is None else cell:>9}" for cell in cells]
+        print(f"{case:<34} {summary['count']:>7} {' '.join(cells)} {summary['errors']:>7}")
@@ -0,0 +1,125 @@
+'''
+Benchmark of the recipe response serialization, per page size
+```bash
+python -m benchmarks.serialization
+python -m benchmarks.serialization --sizes 10 100 1000 10000 --repeat 20
+```
+Compares the path the routes used to take (hand built dicts, `jsonable_encoder`, `json.dumps`)
+with `controller/serializers.py` (rows encoded straight to bytes with orjson), over rows read
+from an in-memory copy of the `recipie` table. `orjson_by_name` is the serializer as it was
+before it read the rows' values by position, getting them by attribute name.
+Times are per response over `--repeat` runs.
+Also times a ` ?fields=id,name ` projection and compressing the full body as `compression.py` does.
+'''
+
+import json
+import time
+import uuid
+import argparse
+from operator import attrgetter
+from datetime import datetime, timezone
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import create_engine, insert, select
+
+from modals import DBBaseModel, DBRecipeModal
+from controller.serializers import dumps_recipes, RECIPE_FIELDS
+from compression import compressor
+
+from benchmarks.results import summarize, save_results, print_cases
+
+recipie = DBRecipeModal.__table__
+
+DEFAULT_SIZES = (10, 100, 1000, 10000)
+
+
+def legacy_dumps(rows):
+    ''' The response body as it was produced before: one dict per row, then FastAPI's encoding '''
+    recipes = [{
+        "id": recipe.id,
+        "name": recipe.name,
+        "ingredients": recipe.ingredients,
+        "instructions": recipe.instructions,
+        "owner_id": recipe.owner_id,
+        "created_at": recipe.created_at,
+        "updated_at": recipe.updated_at,
+        "version": recipe.version,
+    } for recipe in rows]
+    return json.dumps(jsonable_encoder(recipes)).encode()
+
+
+def by_name_dumps(rows, fields=RECIPE_FIELDS):
+    ''' The orjson body with the values looked up on each `Row` by attribute name '''
+    getter = attrgetter(*fields)
+    return orjson.dumps([dict(zip(fields, getter(row))) for row in rows])
+
+
+def load_rows(count: int):
+    ''' `count` recipes of a realistic size, fetched back as rows the way the data functions read them '''
+    engine = create_engine("sqlite://")
+    DBBaseModel.metadata.create_all(engine)
+    owner_id = str(uuid.uuid4())
+    with engine.begin() as conn:
+        conn.execute(insert(recipie), [{
+            "id": str(uuid.uuid4()),
+            "name": f"Recipe {number}",
+            "ingredients": "flour, water, salt, yeast, olive oil, " * 4,
+            "instructions": "Mix, knead, rest and bake until golden. " * 20,
+            "owner_id": owner_id,
+            "created_at": str(datetime.now(timezone.utc)),
+            "updated_at": str(datetime.now(timezone.utc)),
+        } for number in range(count)])
+    with engine.connect() as conn:
+        rows = conn.execute(select(recipie)).fetchall()
+    engine.dispose()
+    return rows
+
+
+def compress_body(encoding: str, body: bytes):
+    compress, _, finish = compressor(encoding)
+    return compress(body) + finish()
+
+
+def timings(function, rows, repeat: int):
+    ''' Duration of each of `repeat` runs, in seconds '''
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(rows)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def run(sizes, repeat: int):
+    cases = {}
+    for size in sizes:
+        rows = load_rows(size)
+        assert json.loads(legacy_dumps(rows)) == json.loads(dumps_recipes(rows))
+        assert by_name_dumps(rows) == dumps_recipes(rows)
+        cases[f"page_{size}.legacy"] = summarize(timings(legacy_dumps, rows, repeat))
+        cases[f"page_{size}.orjson_by_name"] = summarize(timings(by_name_dumps, rows, repeat))
+        cases[f"page_{size}.orjson"] = summarize(timings(dumps_recipes, rows, repeat))
+        cases[f"page_{size}.orjson_by_name_fields"] = summarize(
+            timings(lambda rows: by_name_dumps(rows, ("id", "name")), rows, repeat)
+        )
+        cases[f"page_{size}.orjson_fields"] = summarize(timings(lambda rows: dumps_recipes(rows, ("id", "name")), rows, repeat))
+        body = dumps_recipes(rows)
+        for encoding in ("gzip", "br"):
+            cases[f"page_{size}.{encoding}"] = summarize(timings(lambda body: compress_body(encoding, body), body, repeat))
+    return cases
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recipe response serialization per page size")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    cases = run(args.sizes, args.repeat)
+    print_cases(cases)
+    print(save_results("serialization", {"sizes": args.sizes, "repeat": args.repeat}, cases))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+'''
+Who a request comes from, as the rate limiter (`ratelimit.py`), the idempotency keys
+(`idempotency.py`) and the replica stickiness (`database/routing.py`) tell clients apart.
+'''
+
+from starlette.requests import Request
+
+from config import ClientConfig
+
+
+def client_id(request: Request):
+    ''' The peer address, or the first forwarded one behind a trusted proxy (`ClientConfig.trust_forwarded`) '''
+    if ClientConfig.trust_forwarded:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",", 1)[0].strip()
+    return request.client.host if request.client else "unknown"
@@ -0,0 +1,181 @@
+'''
+Negotiated response compression.
+
+Recipe pages and exports are verbose JSON, they shrink to a fraction of their size. Responses
+with a compressible `Content-Type` and a body of at least `CompressionConfig.minimum_size` bytes
+are compressed with the best encoding the client accepts: brotli (`br`), then `gzip`.
+Streamed bodies (` /recipes/export `) are compressed chunk by chunk, each chunk flushed so the
+stream is not held back. Those responses carry `Vary: Accept-Encoding`.
+
+A compressed response is another representation of the resource, so its ETag gets the encoding
+appended (` "abc" ` -> ` "abc-br" `). The suffix is removed from ` If-None-Match ` / ` If-Match `
+before the routes see them, they keep comparing the ETags they made. A 304 answers with the
+ETag the client sent.
+'''
+
+import zlib
+
+import brotli
+from starlette.datastructures import Headers, MutableHeaders
+
+from config import CompressionConfig
+
+ENCODINGS = ("br", "gzip")
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/x-ndjson", "application/problem+json")
+# events have to reach the client as they are sent, not once a compressor gives them up
+UNCOMPRESSED_TYPES = ("text/event-stream",)
+CONDITIONAL_HEADERS = (b"if-none-match", b"if-match")
+NO_BODY_STATUSES = (204, 304)
+
+
+def negotiate(accept_encoding: str):
+    '''
+    The encoding of `ENCODINGS` the ` Accept-Encoding ` header prefers, None for identity.
+    ` gzip;q=0.8, br ` -> ` br `, ` * ` stands for every encoding not listed, q=0 refuses one.
+    '''
+    weights = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        weight = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[coding] = weight
+
+    best, best_weight = None, 0.0
+    for encoding in ENCODINGS:
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+def add_suffix(etag: str, encoding: str):
+    ''' ` "abc" ` -> ` "abc-br" `, ` W/"abc" ` -> ` W/"abc-br" ` '''
+    if not etag.endswith('"'):
+        return etag
+    return f'{etag[:-1]}-{encoding}"'
+
+
+def strip_suffixes(header: str):
+    '''
+    ` If-None-Match ` / ` If-Match ` with the encoding suffixes taken off its ETags,
+    and the suffix that was taken off (the last one), None when there was none
+    '''
+    tags, stripped = [], None
+    for tag in header.split(","):
+        tag = tag.strip()
+        for encoding in ENCODINGS:
+            suffix = f'-{encoding}"'
+            if tag.endswith(suffix):
+                tag = tag[:-len(suffix)] + '"'
+                stripped = encoding
+                break
+        tags.append(tag)
+    return ", ".join(tags), stripped
+
+
+def compressor(encoding: str):
+    ''' `(compress, flush, finish)` of a new stream in `encoding` '''
+    if encoding == "br":
+        stream = brotli.Compressor(quality=CompressionConfig.brotli_quality)
+        return stream.process, stream.flush, stream.finish
+    stream = zlib.compressobj(CompressionConfig.gzip_level, zlib.DEFLATED, 31)
+    return stream.compress, lambda: stream.flush(zlib.Z_SYNC_FLUSH), stream.flush
+
+
+def compressible(headers: MutableHeaders):
+    content_type = headers.get("content-type", "")
+    return (
+        "content-encoding" not in headers
+        and content_type.startswith(COMPRESSIBLE_TYPES)
+        and not content_type.startswith(UNCOMPRESSED_TYPES)
+    )
+
+
+class CompressionMiddleware:
+    ''' ASGI middleware compressing the responses of `app`, see the module docstring '''
+    def __init__(self, app, minimum_size: int = CompressionConfig.minimum_size):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        sent_suffix = self._strip_conditional_headers(scope)
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding", ""))
+        start = None
+        stream = None
+
+        async def send_compressed(message):
+            nonlocal start, stream
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                if message["status"] in NO_BODY_STATUSES or not compressible(headers):
+                    if message["status"] == 304 and sent_suffix and "etag" in headers:
+                        headers["ETag"] = add_suffix(headers["ETag"], sent_suffix)
+                    await send(message)
+                    return
+                headers.add_vary_header("Accept-Encoding")
+                if encoding is None:
+                    await send(message)
+                    return
+                # held back until the first body chunk tells whether it is worth compressing
+                start = message
+                return
+
+            if message["type"] != "http.response.body" or start is None and stream is None:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if stream is None:
+                headers = MutableHeaders(scope=start)
+                if not more_body and len(body) < self.minimum_size:
+                    await send(start)
+                    start = None
+                    await send(message)
+                    return
+                stream = compressor(encoding)
+                headers["Content-Encoding"] = encoding
+                if "etag" in headers:
+                    headers["ETag"] = add_suffix(headers["ETag"], encoding)
+                del headers["content-length"]
+
+            compress, flush, finish = stream
+            if more_body:
+                chunk = compress(body) + flush()
+            else:
+                chunk = compress(body) + finish()
+            if start is not None:
+                if not more_body:
+                    MutableHeaders(scope=start)["Content-Length"] = str(len(chunk))
+                await send(start)
+                start = None
+            await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
+
+    def _strip_conditional_headers(self, scope):
+        ''' Take the encoding suffixes off the request's ETags, returns the one the client sent '''
+        sent_suffix = None
+        headers = []
+        for name, value in scope["headers"]:
+            if name in CONDITIONAL_HEADERS:
+                stripped, suffix = strip_suffixes(value.decode("latin-1"))
+                value = stripped.encode("latin-1")
+                if name == b"if-none-match" and suffix:
+                    sent_suffix = suffix
+            headers.append((name, value))
+        scope["headers"] = headers
+        return sent_suffix
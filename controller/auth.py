@@ -1,5 +1,6 @@
 import uuid
-from typing import Annotated
+import time
+from typing import Annotated, NamedTuple
 from datetime import datetime, timedelta, timezone
 
 import jwt
@@ -12,9 +13,15 @@ from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import AuthConfig
 from modals import User, UserInDB, TokenData
 from database.users import UserFunction
 from database.recipe import RecipiessFunction as Recipe
+from database.cache import TTLCache
+from controller.hashing import HashingPool
+from controller.conditional import recipe_headers
 
 
 SECRET_KEY = "thisisasecretkey"
@@ -22,16 +29,46 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# min and max pinned to the configured cost so any other cost is flagged for a rehash
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=AuthConfig.bcrypt_rounds,
+    bcrypt__min_rounds=AuthConfig.bcrypt_rounds,
+    bcrypt__max_rounds=AuthConfig.bcrypt_rounds,
+)
+password_pool = HashingPool(
+    AuthConfig.password_hash_workers,
+    AuthConfig.password_hash_queue,
+    AuthConfig.password_hash_retry_after,
+)
+
+# token -> `Principal` of a token that was already verified, tagged with the user's id
+principal_cache = TTLCache(AuthConfig.principal_cache_max_entries, AuthConfig.principal_cache_ttl)
+
+
+class Principal(NamedTuple):
+    ''' Who a verified token stands for, what `principal_cache` keeps (never the password hash) '''
+    id: str
+    email: str
+    name: str
+
 
 class Auth:
-    def verify_password(plain_password, hashed_password):
-        ''' Verify the password '''
-        return pwd_context.verify(plain_password, hashed_password)
+    async def verify_password(plain_password, hashed_password):
+        ''' Verify the password (on the hashing pool) '''
+        return await password_pool.run(pwd_context.verify, plain_password, hashed_password)
     
-    def hash_password(password):
-        ''' Hash the password '''
-        return pwd_context.hash(password)
+    async def verify_and_update_password(plain_password, hashed_password):
+        ''' 
+        Verify the password (on the hashing pool) 
+        Returns `(valid, new_hash)`, `new_hash` is set when the stored hash uses another bcrypt cost
+        '''
+        return await password_pool.run(pwd_context.verify_and_update, plain_password, hashed_password)
+    
+    async def hash_password(password):
+        ''' Hash the password (on the hashing pool) '''
+        return await password_pool.run(pwd_context.hash, password)
     
     def get_user(db, username):
         ''' Get user by email '''
@@ -40,12 +77,12 @@ class Auth:
                 return user
         return None
     
-    def get_usr_by_id(user_id: UUID4):
+    async def get_usr_by_id(session: AsyncSession, user_id: UUID4):
         ''' Get user by id '''
-        user = UserFunction.get_user_by_id(user_id)
+        user = await UserFunction.get_user_by_id(session, user_id)
         return user
     
-    def register_user(user: User):
+    async def register_user(session: AsyncSession, user: User):
         ''' 
         Register user | Create new user 
         ```json
@@ -57,20 +94,28 @@ class Auth:
         ```
         '''
         user = UserInDB(**user.dict())
-        user.password = Auth.hash_password(user.password)
-        created_user = UserFunction.create_user(user)
+        user.password = await Auth.hash_password(user.password)
+        created_user = await UserFunction.create_user(session, user)
         return created_user
     
-    def authenticate_user(username: str, password: str):
-        ''' Authenticate user '''
-        user = UserFunction.get_user_by_email(email=username)
+    async def authenticate_user(session: AsyncSession, username: str, password: str):
+        ''' Authenticate user, rehashing the password when the bcrypt cost was changed '''
+        user = await UserFunction.get_user_by_email(session, email=username)
         
         if not user:
             return False
-        if not Auth.verify_password(password, user.password):
+        valid, new_hash = await Auth.verify_and_update_password(password, user.password)
+        if not valid:
             return False
+        if new_hash:
+            await Auth.update_password(session, user.id, new_hash)
         return user
 
+    async def update_password(session: AsyncSession, user_id: UUID4, new_hash: str):
+        ''' Replace the password hash of a user, the tokens verified with the old one are verified again '''
+        await UserFunction.update_password(session, user_id, new_hash)
+        principal_cache.invalidate_tag(str(user_id))
+
     def create_access_token(data: dict, expires_delta: timedelta | None = None):
         ''' Create access token for user when they login '''
         to_encode = data.copy()
@@ -83,8 +128,16 @@ class Auth:
         return encoded_jwt
     
 
-    def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
-        ''' Get current user object '''
+    async def get_current_user(session: AsyncSession, token: Annotated[str, Depends(oauth2_scheme)]):
+        ''' 
+        Get the current user's `Principal`
+        Tokens that were verified recently are answered from `principal_cache`
+        without decoding the JWT or looking the user up again
+        '''
+        user = principal_cache.get(token)
+        if user is not None:
+            return user
+
         credentials_exception = HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Could not validate credentials",
@@ -102,25 +155,52 @@ class Auth:
         except InvalidTokenError:
             raise credentials_exception
         
-        user = UserFunction.get_user_by_email(email=token_data.username)
+        user = await UserFunction.get_user_by_email(session, email=token_data.username)
         
         if user is None:
             raise credentials_exception
-        return user
+        principal = Principal(str(user.id), user.email, user.name)
+        # not beyond the token's expiry, a token without one is kept for the cache's own TTL
+        expires_at = payload.get("exp")
+        ttl = None if expires_at is None else expires_at - time.time()
+        principal_cache.set(token, principal, tags=(principal.id,), ttl=ttl)
+        return principal
 
 
 def is_owner_of_recipe(function):
-    ''' Decorator to check if user is owner of recipe '''
-    def wrapper(*args, **kwargs):
-        user = Auth.get_current_user(kwargs["Token"])
-        recipe = Recipe.get_recipe_by_id(kwargs["recipe_id"])
-        
-        if recipe["owner_id"] != user.id:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="You are not authorized to perform this action",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
-
-        return function(*args, **kwargs)
-    return wrapper
\ No newline at end of file
+    ''' 
+    Decorator to check if user is owner of recipe 
+    The wrapped function gets the current user's id as `owner_id` and has to make its write
+    conditional on it (` WHERE id = ? AND owner_id = ? `), so the check costs no extra query.
+    When that write touches nothing the function calls `reject_recipe_write` to find out why.
+    '''
+    async def wrapper(*args, **kwargs):
+        user = await Auth.get_current_user(kwargs["session"], kwargs["Token"])
+        return await function(*args, owner_id=user.id, **kwargs)
+    return wrapper
+
+
+async def reject_recipe_write(
+    session: AsyncSession, recipe_id: UUID4, owner_id: UUID4 | None = None, precondition: bool = False
+):
+    '''
+    Raise 404 when the recipe does not exist, 401 when it belongs to someone else,
+    412 when it is the caller's but the write was conditional (` If-Match `) and the version moved on
+    '''
+    recipe = await Recipe.get_recipe_by_id(session, recipe_id)
+    if isinstance(recipe, dict):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Recipe not found",
+        )
+    if precondition and recipe.owner_id == str(owner_id):
+        raise HTTPException(
+            status_code=status.HTTP_412_PRECONDITION_FAILED,
+            detail="The recipe was modified, fetch it again for its current ETag",
+            headers=recipe_headers(recipe),
+        )
+    raise HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="You are not authorized to perform this action",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
\ No newline at end of file
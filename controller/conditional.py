@@ -0,0 +1,110 @@
+'''
+HTTP conditional requests for recipes (RFC 9110 section 13).
+
+A recipe's ETag is strong and made of its `version` and `updated_at`, both maintained by
+`RecipiessFunction.update_recipe`. Its `Last-Modified` is `updated_at`.
+A page of ` /recipes ` gets a strong ETag hashed from the `(id, version)` of the recipes on it
+(and whether more follow), so it changes when any of them is edited, added or removed.
+Each ` ?fields= ` projection of a page is a representation of its own, with its own ETag.
+Pages carry no `Last-Modified`: a deletion changes a page without making anything on it newer.
+'''
+
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+from fastapi import Response, status
+
+
+def parse_timestamp(value: str):
+    ''' A stored `updated_at` as an aware datetime, naive values are UTC '''
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment
+
+
+def recipe_etag(validator):
+    ''' Strong ETag of a recipe row (or of its `(version, updated_at)`) '''
+    micros = int(parse_timestamp(validator.updated_at).timestamp() * 1_000_000)
+    return f'"{validator.version}-{micros:x}"'
+
+
+def page_etag(result, fields: tuple[str, ...] | None = None):
+    ''' Strong ETag of what `get_all_recipes` / `get_page_versions` returned for a page, as `fields` '''
+    has_more = None
+    if isinstance(result, dict):
+        has_more = result.get("has_more")
+        rows = result.get("items", [])
+    else:
+        rows = result
+    digest = hashlib.blake2b(digest_size=16)
+    for row in rows:
+        digest.update(f"{row.id}:{row.version};".encode())
+    digest.update(f"{has_more}".encode())
+    if fields is not None:
+        digest.update(f"|{','.join(fields)}".encode())
+    return f'"{digest.hexdigest()}"'
+
+
+def last_modified(validator):
+    ''' `Last-Modified` value of a recipe, HTTP dates have whole seconds '''
+    return format_datetime(parse_timestamp(validator.updated_at).astimezone(timezone.utc), usegmt=True)
+
+
+def recipe_headers(validator):
+    return {"ETag": recipe_etag(validator), "Last-Modified": last_modified(validator)}
+
+
+def split_etags(header: str):
+    return [tag.strip() for tag in header.split(",") if tag.strip()]
+
+
+def none_match(if_none_match: str, etag: str):
+    ''' Whether ` If-None-Match ` matches `etag`, compared weakly as the RFC asks for '''
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.removeprefix("W/") == opaque for tag in split_etags(if_none_match))
+
+
+def not_modified_since(if_modified_since: str, validator):
+    ''' Whether the recipe is unchanged since the ` If-Modified-Since ` date, False for an invalid date '''
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return parse_timestamp(validator.updated_at).replace(microsecond=0) <= since
+
+
+def recipe_not_modified(validator, if_none_match: str | None, if_modified_since: str | None):
+    ''' ` If-None-Match ` wins over ` If-Modified-Since ` when both are sent '''
+    if if_none_match:
+        return none_match(if_none_match, recipe_etag(validator))
+    if if_modified_since:
+        return not_modified_since(if_modified_since, validator)
+    return False
+
+
+def if_match_versions(if_match: str):
+    '''
+    Versions a recipe may be at for an ` If-Match ` to pass, None for ` * ` (any existing recipe).
+    Only strong ETags count, an empty list can never match.
+    '''
+    if if_match.strip() == "*":
+        return None
+    versions = []
+    for tag in split_etags(if_match):
+        if tag.startswith("W/") or len(tag) < 2 or tag[0] != '"' or tag[-1] != '"':
+            continue
+        version = tag[1:-1].split("-", 1)[0]
+        if version.isdigit():
+            versions.append(int(version))
+    return versions
+
+
+def not_modified(headers: dict):
+    ''' 304 with the validators the full response would have carried '''
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
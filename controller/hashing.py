@@ -0,0 +1,76 @@
+'''
+Bounded worker pool for password hashing.
+
+bcrypt is deliberately slow, running it inside a request handler blocks the event loop for every
+other request on the worker. The hashing is handed to a small dedicated thread pool instead
+(bcrypt releases the GIL while it works). Once the pool and its queue are full new calls are
+rejected straight away with a 503 and a `Retry-After`, so a login burst can not queue up
+unbounded work and memory.
+
+A slot is held until the hashing itself is done, not until its caller stops waiting: a request
+that is cancelled mid-login leaves its bcrypt job running on the pool, and it still counts.
+'''
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException, status
+
+
+class HashingPool:
+    def __init__(self, workers: int, queue_size: int, retry_after: int):
+        self.workers = workers
+        self.limit = workers + queue_size
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+
+    async def run(self, function, *args):
+        ''' Run `function(*args)` on the pool, 503 when the pool is saturated '''
+        with self._lock:
+            saturated = self.in_flight >= self.limit
+            if saturated:
+                self.rejected += 1
+            else:
+                self.in_flight += 1
+        if saturated:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many logins in progress, please retry shortly",
+                headers={"Retry-After": str(self.retry_after)},
+            )
+
+        try:
+            future = self._executor.submit(function, *args)
+        except BaseException:
+            self._release(None)
+            raise
+        # released by the job itself, on the pool's thread, however the caller stops waiting
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    def _release(self, future):
+        with self._lock:
+            self.in_flight -= 1
+            if future is None or future.cancelled() or future.exception() is not None:
+                self.failed += 1
+            else:
+                self.completed += 1
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
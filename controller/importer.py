@@ -0,0 +1,185 @@
+'''
+Bulk recipe import from NDJSON or CSV.
+
+The input is read as a stream of byte chunks, split into records and validated one by one with
+the `Recipie` model, so memory does not grow with the size of the file. Valid rows are written
+with one `executemany` per batch, each batch committed through the writer queue once it has been
+read, so the write lock is never held while the client sends the rest. An import that stops half
+way keeps the batches written before, sending it again with its `id`s reports those as existing.
+Rows that fail validation (or reuse an existing id) are reported with their line number and skipped.
+
+NDJSON: one JSON object per line
+```json
+{"name": "Recipe Name", "ingredients": "Ingredients", "instructions": "Instructions"}
+```
+CSV: a header row naming the columns (`name`, `ingredients`, `instructions`)
+
+`id` and `created_at` may be given to keep them when migrating from another store,
+otherwise they are generated like for ` POST /recipe `. `created_at` is converted to UTC,
+one without a UTC offset is taken as UTC.
+'''
+
+import csv
+import json
+import time
+import uuid
+from datetime import datetime, timezone
+
+from pydantic import ValidationError
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import ImportConfig
+from modals import Recipie
+from database.recipe import RecipiessFunction
+from database.utils import to_db_timestamp
+
+FORMATS = ("ndjson", "csv")
+
+
+async def iter_lines(chunks):
+    ''' Split an async stream of byte chunks into decoded lines (without line endings) '''
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line.rstrip(b"\r").decode("utf-8")
+    if buffer:
+        yield buffer.rstrip(b"\r").decode("utf-8")
+
+
+async def iter_ndjson(lines):
+    ''' Yields `(line_number, object or error message)` '''
+    line_number = 0
+    async for line in lines:
+        line_number += 1
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as error:
+            yield line_number, f"Invalid JSON: {error}"
+            continue
+        if not isinstance(record, dict):
+            yield line_number, "Expected a JSON object"
+            continue
+        yield line_number, record
+
+
+async def iter_csv(lines):
+    '''
+    Yields `(line_number, row dict or error message)`, `line_number` is where the record starts
+    A quoted field may span several lines, lines are joined until their quotes balance
+    '''
+    header = None
+    line_number = 0
+    record, record_start = [], 0
+    async for line in lines:
+        line_number += 1
+        if not record:
+            record_start = line_number
+        record.append(line)
+        text = "\n".join(record)
+        if text.count('"') % 2:
+            continue
+        record = []
+        if not text.strip():
+            continue
+
+        values = next(csv.reader([text]))
+        if header is None:
+            header = [column.strip() for column in values]
+            continue
+        if len(values) != len(header):
+            yield record_start, f"Expected {len(header)} columns, got {len(values)}"
+            continue
+        # empty cells are missing values, not empty strings
+        yield record_start, {column: value or None for column, value in zip(header, values)}
+
+    if record:
+        yield record_start, "Unterminated quoted field"
+
+
+def to_row(record: dict, owner_id: str):
+    ''' Validate one record with the `Recipie` model and turn it into a `recipie` row '''
+    recipe = Recipie(**record)
+    # stored in UTC like every other timestamp, they are compared as strings
+    created_at = to_db_timestamp(recipe.created_at or datetime.now(timezone.utc))
+    return {
+        "id": str(recipe.id or uuid.uuid4()),
+        "created_at": created_at,
+        "updated_at": created_at,
+        "name": recipe.name,
+        "ingredients": recipe.ingredients,
+        "instructions": recipe.instructions,
+        "owner_id": str(owner_id),
+    }
+
+
+class ImportReport:
+    def __init__(self):
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+        self.started = time.perf_counter()
+
+    def error(self, line_number: int, message: str):
+        self.failed += 1
+        if len(self.errors) < ImportConfig.max_reported_errors:
+            self.errors.append({"line": line_number, "error": message})
+
+    def to_json(self):
+        seconds = time.perf_counter() - self.started
+        return {
+            "imported": self.imported,
+            "failed": self.failed,
+            "errors": self.errors,
+            "seconds": round(seconds, 3),
+            "rows_per_second": round(self.imported / seconds, 1) if seconds else None,
+        }
+
+
+async def write_batch(session: AsyncSession, batch: list, report: ImportReport):
+    '''
+    Write and commit a batch. Rows carrying an `id` that already exists
+    (in the table or earlier in the batch) are reported and skipped.
+    '''
+    rows = [row for _, row, _ in batch]
+    given_ids = {row["id"] for _, row, has_id in batch if has_id}
+    skipped = await RecipiessFunction.insert_recipe_batch(session, rows, given_ids)
+    for index in skipped:
+        line_number, row, _ = batch[index]
+        report.error(line_number, f"Recipe {row['id']} already exists")
+    report.imported += len(rows) - len(skipped)
+
+
+async def import_recipes(session: AsyncSession, chunks, format: str, owner_id: str, batch_size: int):
+    '''
+    Import recipes owned by `owner_id` from an async stream of byte chunks
+    Returns the report: imported and failed counts, the first errors and the throughput
+    '''
+    records = iter_csv(iter_lines(chunks)) if format == "csv" else iter_ndjson(iter_lines(chunks))
+    report = ImportReport()
+    batch = []
+
+    try:
+        async for line_number, record in records:
+            if isinstance(record, str):
+                report.error(line_number, record)
+                continue
+            try:
+                batch.append((line_number, to_row(record, owner_id), record.get("id") is not None))
+            except (ValidationError, TypeError) as error:
+                report.error(line_number, str(error))
+                continue
+            if len(batch) >= batch_size:
+                await write_batch(session, batch, report)
+                batch = []
+        if batch:
+            await write_batch(session, batch, report)
+    except (UnicodeDecodeError, DBAPIError) as error:
+        # the batches committed before are kept, the one being read or written is not
+        await session.rollback()
+        report.error(0, f"Import stopped after {report.imported} recipes: {error}")
+    return report.to_json()
@@ -1,49 +1,245 @@
 from typing import Annotated
+from datetime import datetime
 import uuid
+import time
+import asyncio
 
 from pydantic import UUID4
 
-from fastapi import Depends
+from fastapi import Depends, HTTPException, status
+from fastapi.responses import ORJSONResponse
 
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import ExportConfig, ChangeFeedConfig
 from modals import Recipie, UpdateRecipie
+from database.engine import SessionLocal
 from database.recipe import RecipiessFunction
+from database.users import UserFunction
+from database.changes import change_feed, ChangeLogTruncated
 
-from controller.auth import is_owner_of_recipe
+from controller.auth import is_owner_of_recipe, reject_recipe_write
+from controller.serializers import (
+    recipe_response, ranked_response, ndjson_lines, parse_fields, changes_response, sse_events,
+    RECIPE_FIELDS, SEARCH_RESULT_FIELDS,
+)
+from controller import conditional
 
 class Recipe:
     
-    def create_recipe(recipe: Recipie):   
-        ''' Create new recipe '''     
-        created_recipe = RecipiessFunction.create_recipe(recipe)
-        return created_recipe
+    async def create_recipe(session: AsyncSession, recipe: Recipie):   
+        ''' Create new recipe, the response is the created recipe with its `ETag` '''     
+        created_recipe = await RecipiessFunction.create_recipe(session, recipe)
+        response = recipe_response(created_recipe)
+        response.headers.update(conditional.recipe_headers(created_recipe))
+        return response
     
-    def get_all_recipes(page: int, limit: int):
+    async def get_all_recipes(
+        session: AsyncSession,
+        page: int,
+        limit: int,
+        cursor: str | None = None,
+        if_none_match: str | None = None,
+        fields: str | None = None,
+    ):
         ''' 
             Get all recipes 
             supports pagination as url query parameters
-            ` ?page=1&limit=10 `
+            ` ?page=1&limit=10 ` or ` ?cursor=&limit=10 `
+            ` ?fields=id,name ` reads and returns only those fields
+            A matching ` If-None-Match ` gets a 304, worked out from the page's versions only
         '''
-        recipies = RecipiessFunction.get_all_recipes(page, limit)
-        return recipies
+        try:
+            projection = parse_fields(fields)
+            if if_none_match:
+                versions = await RecipiessFunction.get_page_versions(session, page, limit, cursor, projection)
+                etag = conditional.page_etag(versions, projection)
+                if conditional.none_match(if_none_match, etag):
+                    return conditional.not_modified({"ETag": etag})
+            recipies = await RecipiessFunction.get_all_recipes(session, page, limit, cursor, projection)
+        except ValueError as error:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(error))
+        response = recipe_response(recipies, projection or RECIPE_FIELDS)
+        response.headers["ETag"] = conditional.page_etag(recipies, projection)
+        return response
         
-    def get_recipe_by_id(recipe_id: UUID4):
-        ''' Get recipe by id '''
-        recipe = RecipiessFunction.get_recipe_by_id(recipe_id)
-        return recipe
+    async def get_owner_recipes(session: AsyncSession, owner, cursor: str, limit: int):
+        '''
+            One page of `owner`'s recipes (`owner` is their user row), keyset paginated.
+            The owner is embedded once for the whole page, not looked up per recipe, so a page
+            costs one query whatever its size
+        '''
+        try:
+            recipies = await RecipiessFunction.get_recipes_by_owner(session, owner.id, cursor, limit)
+        except ValueError as error:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(error))
+        return recipe_response({**recipies, "owner": {"id": owner.id, "name": owner.name}})
+
+    async def get_user_recipes(session: AsyncSession, user_id: UUID4, cursor: str, limit: int):
+        ''' One page of a user's recipes, 404 when there is no such user '''
+        user = await UserFunction.get_user_by_id(session, user_id)
+        if user is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+        return await Recipe.get_owner_recipes(session, user, cursor, limit)
+
+    async def get_recipe_by_id(
+        session: AsyncSession, recipe_id: UUID4, if_none_match: str | None = None, if_modified_since: str | None = None
+    ):
+        '''
+            Get recipe by id
+            A matching ` If-None-Match ` / ` If-Modified-Since ` gets a 304 without the row being loaded
+        '''
+        if if_none_match or if_modified_since:
+            current = await RecipiessFunction.get_recipe_version(session, recipe_id)
+            if current is not None and conditional.recipe_not_modified(current, if_none_match, if_modified_since):
+                return conditional.not_modified(conditional.recipe_headers(current))
+        recipe = await RecipiessFunction.get_recipe_by_id(session, recipe_id)
+        response = recipe_response(recipe)
+        if not isinstance(recipe, dict):
+            response.headers.update(conditional.recipe_headers(recipe))
+        return response
     
+    async def get_recipes_by_ids(session: AsyncSession, recipe_ids: list[UUID4]):
+        ''' Get many recipes by id in one query, same cache and serializer as `get_recipe_by_id` '''
+        recipes = await RecipiessFunction.get_recipes_by_ids(session, recipe_ids)
+        return recipe_response(recipes)
+
     @is_owner_of_recipe
-    def update_recipe(recipe_id: UUID4, recipe: UpdateRecipie, Token: Annotated[str, Depends]):        
-        ''' Update recipe by id '''
-        updated_recipe = RecipiessFunction.update_recipe(recipe_id, recipe)
-        return updated_recipe
+    async def update_recipe(
+        session: AsyncSession,
+        recipe_id: UUID4,
+        recipe: UpdateRecipie,
+        Token: Annotated[str, Depends],
+        owner_id: UUID4,
+        if_match: str | None = None,
+    ):        
+        '''
+            Update recipe by id
+            With ` If-Match ` the update only goes through while the recipe is still at that version
+        '''
+        expected_versions = conditional.if_match_versions(if_match) if if_match else None
+        updated_recipe = await RecipiessFunction.update_recipe(
+            session, recipe_id, recipe, owner_id=owner_id, expected_versions=expected_versions
+        )
+        if updated_recipe is None:
+            await reject_recipe_write(session, recipe_id, owner_id=owner_id, precondition=if_match is not None)
+        return ORJSONResponse({"success": True}, headers=conditional.recipe_headers(updated_recipe))
     
     @is_owner_of_recipe
-    def delete_recipe(recipe_id: UUID4, Token: Annotated[str, Depends]):
+    async def delete_recipe(session: AsyncSession, recipe_id: UUID4, Token: Annotated[str, Depends], owner_id: UUID4):
         ''' Delete recipe by id '''
-        deleted_recipe = RecipiessFunction.delete_recipe(recipe_id)
+        deleted_recipe = await RecipiessFunction.delete_recipe(session, recipe_id, owner_id=owner_id)
+        if not deleted_recipe["success"]:
+            await reject_recipe_write(session, recipe_id)
         return deleted_recipe
     
-    def search_recipies(query: str, page: int, limit: int):
-        ''' Search recipes in the database (name, ingredients, instructions) '''
-        recipies = RecipiessFunction.search_recipies(query, page, limit)
-        return recipies
\ No newline at end of file
+    async def search_recipies(
+        session: AsyncSession, query: str, page: int, limit: int, cursor: str | None = None, fields: str | None = None
+    ):
+        '''
+            Search recipes in the database (name, ingredients, instructions)
+            ` ?fields=id,name,snippet ` reads and returns only those fields
+            ` X-Total-Count ` tells how many recipes the search finds in all
+        '''
+        try:
+            projection = parse_fields(fields, SEARCH_RESULT_FIELDS)
+            recipies = await RecipiessFunction.search_recipies(session, query, page, limit, cursor, projection)
+            total = await RecipiessFunction.count_search_matches(session, query)
+        except ValueError as error:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(error))
+        fields = projection or SEARCH_RESULT_FIELDS
+        if total is None:
+            # a query with nothing searchable in it lists all recipes, those carry no snippet
+            fields = tuple(field for field in fields if field != "snippet")
+        response = recipe_response(recipies, fields)
+        if total is not None:
+            response.headers["X-Total-Count"] = str(total)
+        return response
+    
+    async def get_recipes_by_ingredients(
+        session: AsyncSession, include_all: list[str], include_any: list[str], exclude: list[str], page: int, limit: int
+    ):
+        ''' Recipes having all / any / none of the given ingredients, each with its number of `matches` '''
+        try:
+            recipies = await RecipiessFunction.get_recipes_by_ingredients(
+                session, include_all, include_any, exclude, page, limit
+            )
+        except ValueError as error:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(error))
+        return ranked_response(recipies, "matches")
+    
+    async def export_recipes(owner_id: UUID4 | None, created_from: datetime | None, created_to: datetime | None):
+        '''
+            Export recipes as NDJSON, one line per recipe
+            The stream outlives the request's session dependency, so it opens its own
+        '''
+        async with SessionLocal() as session:
+            partitions = RecipiessFunction.stream_recipes(
+                session, ExportConfig.yield_per, owner_id, created_from, created_to
+            )
+            async for rows in partitions:
+                yield ndjson_lines(rows)
+
+    async def get_changes(session: AsyncSession, since: int, limit: int):
+        ''' The recipe changes after `since`, 410 when they are no longer kept '''
+        try:
+            page = await RecipiessFunction.get_changes(session, since, limit)
+        except ChangeLogTruncated as error:
+            raise HTTPException(status_code=status.HTTP_410_GONE, detail=str(error))
+        return changes_response(page)
+
+    async def open_change_stream(session: AsyncSession, since: int | None):
+        '''
+            Check that a change stream can start: 503 when the worker has as many streams as it
+            takes, 410 when the changes after `since` are no longer kept
+        '''
+        if change_feed.full:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many change streams, please retry shortly",
+                headers={"Retry-After": str(int(ChangeFeedConfig.poll_interval) + 1)},
+            )
+        if since is not None:
+            await Recipe.get_changes(session, since, 0)
+
+    async def stream_changes(since: int | None):
+        '''
+            Server-Sent Events of the recipe changes after `since` (from now on when None).
+            The backlog is read from the table, then the stream follows the worker's shared tail of
+            the log (`change_feed`). It ends after `ChangeFeedConfig.stream_seconds`, or when it
+            was dropped for falling behind, and the client reconnects with its `Last-Event-ID`.
+        '''
+        deadline = time.monotonic() + ChangeFeedConfig.stream_seconds
+        async with change_feed.subscribe() as subscription:
+            if since is None:
+                since = change_feed.last_seq
+            yield b"retry: %d\n\n" % int(ChangeFeedConfig.poll_interval * 1000)
+            # the backlog, its session is closed before the stream goes live
+            async with SessionLocal() as session:
+                has_more = True
+                while has_more:
+                    try:
+                        page = await RecipiessFunction.get_changes(session, since, ChangeFeedConfig.batch_size)
+                    except ChangeLogTruncated as error:
+                        yield b"event: truncated\ndata: %s\n\n" % str(error).encode()
+                        return
+                    if page["items"]:
+                        yield sse_events(page["items"])
+                    since, has_more = page["last_seq"], page["has_more"]
+
+            while not (subscription.dropped and subscription.queue.empty()):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                try:
+                    rows = await asyncio.wait_for(
+                        subscription.queue.get(), min(ChangeFeedConfig.heartbeat_seconds, remaining)
+                    )
+                except asyncio.TimeoutError:
+                    yield b": keep-alive\n\n"
+                    continue
+                # the tail may hand over changes the backlog already had
+                rows = [row for row in rows if row.seq > since]
+                if rows:
+                    yield sse_events(rows)
+                    since = rows[-1].seq
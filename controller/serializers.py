@@ -0,0 +1,144 @@
+'''
+Response serialization for recipes.
+
+The data functions hand back SQLAlchemy rows. Those are encoded here straight to JSON bytes
+with orjson and sent as a plain `Response`, so FastAPI's `jsonable_encoder` and response model
+validation never walk the payload. The `response_model`s declared on the routes describe the
+same shape for the docs, see `RecipeResponse` and friends in `modals.py`.
+
+The values are taken from the rows by position (`_values`): a `Row` attribute lookup goes through
+SQLAlchemy's key map in Python and costs more than building the mapping and encoding it together.
+'''
+
+from operator import attrgetter, itemgetter
+
+import orjson
+from fastapi import Response
+
+RECIPE_FIELDS = ("id", "name", "ingredients", "instructions", "owner_id", "created_at", "updated_at", "version")
+SEARCH_RESULT_FIELDS = RECIPE_FIELDS + ("snippet",)
+CHANGE_FIELDS = ("seq", "op", "recipe_id", "version", "changed_at")
+# the recipe columns of a change row, see `database/changes.changes_statement`
+CHANGE_RECIPE_FIELDS = tuple(f"recipe__{field}" for field in RECIPE_FIELDS)
+
+_getters = {}
+
+
+def parse_fields(spec: str | None, allowed: tuple[str, ...] = RECIPE_FIELDS):
+    '''
+    The ` ?fields=name,id ` projection as a tuple of `allowed` fields, in `allowed` order.
+    None when the parameter is missing or empty (every field), ValueError for an unknown field.
+    '''
+    if not spec or not spec.strip():
+        return None
+    wanted = {field.strip() for field in spec.split(",") if field.strip()}
+    unknown = wanted.difference(allowed)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}. Choose from: {', '.join(allowed)}")
+    return tuple(field for field in allowed if field in wanted)
+
+
+def _values(fields: tuple[str, ...], row):
+    '''
+    A C-level getter of `fields` for rows shaped like `row`, reads all of them in a single call:
+    an `itemgetter` of their positions for SQLAlchemy rows (and named tuples), an `attrgetter` otherwise.
+    The rows encoded together come from one statement, the getter of the first one reads them all.
+    '''
+    row_fields = getattr(row, "_fields", None)
+    key = (fields, row_fields)
+    getter = _getters.get(key)
+    if getter is None:
+        if row_fields is None:
+            getter = attrgetter(*fields)
+        else:
+            getter = itemgetter(*(row_fields.index(field) for field in fields))
+        if len(fields) == 1:
+            # a single-field getter returns the value itself, not a 1-tuple
+            single = getter
+            getter = lambda row: (single(row),)
+        _getters[key] = getter
+    return getter
+
+
+def rows_to_mappings(rows, fields: tuple[str, ...] = RECIPE_FIELDS):
+    ''' The field -> value mapping orjson encodes for each row, nothing else is copied '''
+    if not rows:
+        return []
+    getter = _values(fields, rows[0])
+    return [dict(zip(fields, getter(row))) for row in rows]
+
+
+def dumps_recipes(result, fields: tuple[str, ...] = RECIPE_FIELDS) -> bytes:
+    '''
+    JSON bytes for whatever a recipe data function returned
+    - a single row -> object
+    - a list of rows -> array
+    - a keyset page `{"items": rows, "next_cursor": ..., "has_more": ...}` -> the same with items encoded
+    - a `{"message": ...}` dict -> unchanged
+    '''
+    if isinstance(result, dict):
+        if "items" in result:
+            result = {**result, "items": rows_to_mappings(result["items"], fields)}
+        return orjson.dumps(result)
+    if isinstance(result, list):
+        return orjson.dumps(rows_to_mappings(result, fields))
+    return orjson.dumps(dict(zip(fields, _values(fields, result)(result))))
+
+
+def recipe_response(result, fields: tuple[str, ...] = RECIPE_FIELDS) -> Response:
+    ''' `dumps_recipes` wrapped in a response the route can return as is '''
+    return Response(content=dumps_recipes(result, fields), media_type="application/json")
+
+
+def ranked_response(result, score: str, fields: tuple[str, ...] = RECIPE_FIELDS) -> Response:
+    ''' `(row, score)` pairs as an array of recipes carrying their score under `score`, a `{"message": ...}` dict unchanged '''
+    if isinstance(result, dict):
+        return recipe_response(result, fields)
+    getter = _values(fields, result[0][0]) if result else None
+    items = []
+    for row, value in result:
+        item = dict(zip(fields, getter(row)))
+        item[score] = value
+        items.append(item)
+    return Response(content=orjson.dumps(items), media_type="application/json")
+
+
+def ndjson_lines(rows, fields: tuple[str, ...] = RECIPE_FIELDS) -> bytes:
+    ''' One JSON object per row, newline terminated '''
+    if not rows:
+        return b""
+    getter = _values(fields, rows[0])
+    return b"".join(
+        orjson.dumps(dict(zip(fields, getter(row))), option=orjson.OPT_APPEND_NEWLINE)
+        for row in rows
+    )
+
+
+def change_mappings(rows):
+    ''' Each change as `{"seq", "op", "recipe_id", "version", "changed_at", "recipe"}`, `recipe` None once deleted '''
+    if not rows:
+        return []
+    change, recipe = _values(CHANGE_FIELDS, rows[0]), _values(CHANGE_RECIPE_FIELDS, rows[0])
+    items = []
+    for row in rows:
+        item = dict(zip(CHANGE_FIELDS, change(row)))
+        values = recipe(row)
+        item["recipe"] = dict(zip(RECIPE_FIELDS, values)) if values[0] is not None else None
+        items.append(item)
+    return items
+
+
+def changes_response(page) -> Response:
+    ''' A page of `get_changes` with its change rows encoded '''
+    return Response(
+        content=orjson.dumps({**page, "items": change_mappings(page["items"])}),
+        media_type="application/json",
+    )
+
+
+def sse_events(rows) -> bytes:
+    ''' One Server-Sent Event per change row, its `seq` as the event id '''
+    return b"".join(
+        b"id: %d\nevent: change\ndata: %s\n\n" % (item["seq"], orjson.dumps(item))
+        for item in change_mappings(rows)
+    )
@@ -0,0 +1,387 @@
+'''
+Bounded in-process TTL/LRU cache used in front of the recipe reads.
+
+Entries can be tagged, invalidating a tag drops every entry carrying it. The recipe list pages
+are tagged with `LIST_TAG` and with the id of every recipe on them, so a write only throws away
+what it can actually have changed.
+
+Every worker process has its own cache. With `RECIPE_CACHE_BACKEND=shared` the invalidated tags are
+also published to a `SharedInvalidations` log in a memory-mapped file that all workers on the host
+open. Before each lookup a cache drops what the other workers invalidated since, so a write made
+through one worker is never served stale by another (POSIX only, the log is locked with `flock`).
+
+A read that missed takes `current()` before it queries and passes it to `set`. A write that
+commits and invalidates while the query runs moves that counter on, and the value read (possibly
+from a snapshot older than the write) is not cached.
+
+`SearchCache` keeps the results of the searches instead: for each normalized query the ids of its
+best matches and how many there are. Rather than tags it checks a generation counter that every
+recipe write bumps (any write can change what a search finds), shared by the workers in the same
+memory-mapped way with the `shared` backend.
+'''
+
+import os
+import mmap
+import time
+import fcntl
+import struct
+from collections import OrderedDict
+
+from config import CacheConfig, SearchConfig
+
+LIST_TAG = "recipes"
+
+
+def open_shared_map(path: str, size: int):
+    ''' `(fd, mmap)` of a file shared between processes, grown to `size` bytes (zeros) if it is smaller '''
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    try:
+        if os.fstat(fd).st_size < size:
+            os.ftruncate(fd, size)
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    return fd, mmap.mmap(fd, size)
+
+
+class SharedInvalidations:
+    '''
+    Ring log of invalidated tags shared by processes through a memory-mapped file.
+    The header holds the number of tags ever published, followed by `slots` fixed size slots,
+    tag `n` is in slot `n % slots`. A reader that fell more than `slots` tags behind can not tell
+    what it missed and is told to drop everything.
+    The file is opened lazily in each process, a forked worker does not share its parent's lock.
+    '''
+    HEADER = struct.Struct("<Q")
+    SLOT_SIZE = 64
+
+    def __init__(self, path: str, slots: int):
+        self.path = path
+        self.slots = slots
+        self.size = self.HEADER.size + slots * self.SLOT_SIZE
+        self.received = 0
+        self.resyncs = 0
+        self._pid = None
+
+    def _open(self):
+        if self._pid == os.getpid():
+            return
+        self._fd, self._map = open_shared_map(self.path, self.size)
+        self._pid = os.getpid()
+        # what was invalidated before this process started concerns no entry of its cache
+        self.seen = self._published()
+
+    def _published(self):
+        return self.HEADER.unpack_from(self._map, 0)[0]
+
+    def _slot(self, number: int):
+        return self.HEADER.size + (number % self.slots) * self.SLOT_SIZE
+
+    def publish(self, tag: str):
+        ''' Append `tag` for the other processes, a tag too long for a slot is published as "drop everything" '''
+        self._open()
+        data = tag.encode()
+        if len(data) >= self.SLOT_SIZE:
+            data = b""
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            published = self._published()
+            offset = self._slot(published)
+            self._map[offset] = len(data)
+            self._map[offset + 1:offset + 1 + len(data)] = data
+            self.HEADER.pack_into(self._map, 0, published + 1)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        if published == self.seen:
+            # nobody else published in between, no need to read our own tag back
+            self.seen = published + 1
+
+    def pending(self):
+        '''
+        Tags the other processes published since the last call, None when there were too many
+        to tell (the caller has to drop everything)
+        '''
+        self._open()
+        published = self._published()
+        if published == self.seen:
+            return []
+        tags = None
+        if published - self.seen <= self.slots:
+            tags = []
+            for number in range(self.seen, published):
+                offset = self._slot(number)
+                length = self._map[offset]
+                tags.append(self._map[offset + 1:offset + 1 + length].decode(errors="replace") if length else None)
+            # slots can be overwritten while they are read, and an empty one means "drop everything"
+            if self._published() - self.seen > self.slots or None in tags:
+                tags = None
+        self.seen = published
+        if tags is None:
+            self.resyncs += 1
+            return None
+        self.received += len(tags)
+        return tags
+
+
+class TTLCache:
+    def __init__(self, max_entries: int, ttl: float, shared: SharedInvalidations | None = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.shared = shared
+        self._entries = OrderedDict()  # key -> (expires_at, value, tags)
+        self._tags = {}  # tag -> set of keys
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.stale_fills = 0
+        # bumped by every invalidated tag, local or shared, see `current`
+        self._generation = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0 and self.ttl > 0
+
+    def current(self):
+        ''' Taken before reading a value to cache, `set` drops the value when a tag was invalidated since '''
+        if self.shared is not None:
+            self._apply_shared()
+        return self._generation
+
+    def get(self, key):
+        ''' Cached value for `key` or None, marks the entry as recently used '''
+        if self.shared is not None:
+            self._apply_shared()
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value, _ = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, tags=(), ttl: float | None = None, generation: int | None = None):
+        '''
+        Store `value`, evicting the least recently used entries beyond `max_entries`
+        `ttl` can shorten (never extend) the lifetime of this one entry
+        `generation` is `current()` from before `value` was read, it is not stored when a tag
+        was invalidated in between
+        '''
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if not self.enabled or ttl <= 0:
+            return
+        if self.shared is not None:
+            # also opens the log before anything is cached, nothing published later can be missed
+            self._apply_shared()
+        if generation is not None and generation != self._generation:
+            self.stale_fills += 1
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + ttl, value, tuple(tags))
+        for tag in tags:
+            self._tags.setdefault(tag, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        ''' Drop a single entry '''
+        if key in self._entries:
+            self._remove(key)
+            self.invalidations += 1
+
+    def invalidate_tag(self, tag):
+        ''' Drop every entry tagged with `tag`, in every worker when the invalidations are shared '''
+        self._drop_tag(tag)
+        if self.shared is not None and self.enabled:
+            self.shared.publish(tag)
+
+    def _drop_tag(self, tag):
+        self._generation += 1
+        for key in list(self._tags.get(tag, ())):
+            self.invalidate(key)
+
+    def _apply_shared(self):
+        ''' Drop what the other workers invalidated since the last lookup '''
+        tags = self.shared.pending()
+        if tags is None:
+            self._generation += 1
+            self.invalidations += len(self._entries)
+            self.clear()
+            return
+        for tag in tags:
+            self._drop_tag(tag)
+
+    def clear(self):
+        self._entries.clear()
+        self._tags.clear()
+
+    def stats(self):
+        ''' Counters to size the cache with '''
+        lookups = self.hits + self.misses
+        shared = {}
+        if self.shared is not None:
+            shared = {"shared_received": self.shared.received, "shared_resyncs": self.shared.resyncs}
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+            "stale_fills": self.stale_fills,
+            **shared,
+        }
+
+    def _remove(self, key):
+        _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+class Generation:
+    ''' Counter of the recipe writes made by this worker '''
+    def __init__(self):
+        self._value = 0
+
+    def value(self):
+        return self._value
+
+    def bump(self):
+        self._value += 1
+
+
+class SharedGeneration:
+    ''' Counter of the recipe writes made by every worker on the host, in a memory-mapped file '''
+    COUNTER = struct.Struct("<Q")
+
+    def __init__(self, path: str):
+        self.path = path
+        self._pid = None
+
+    def _open(self):
+        if self._pid != os.getpid():
+            self._fd, self._map = open_shared_map(self.path, self.COUNTER.size)
+            self._pid = os.getpid()
+
+    def value(self):
+        self._open()
+        return self.COUNTER.unpack_from(self._map, 0)[0]
+
+    def bump(self):
+        self._open()
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            self.COUNTER.pack_into(self._map, 0, self.COUNTER.unpack_from(self._map, 0)[0] + 1)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+
+class SearchCache:
+    '''
+    LRU of search results, keyed by normalized query: `(ids, total)`, the ids of the best
+    `max_ids` matches in rank order and the number of matches. An entry is only good for the
+    generation it was read in, `bump` on a write makes everything cached before it stale.
+    '''
+    def __init__(self, max_entries: int, max_ids: int, generation):
+        self.max_entries = max_entries
+        self.max_ids = max_ids
+        self.generation = generation
+        self._entries = OrderedDict()  # key -> (generation, ids, total)
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0 and self.max_ids > 0
+
+    def current(self):
+        ''' The generation to store the results read from now on with '''
+        return self.generation.value()
+
+    def get(self, key):
+        ''' `(ids, total)` cached for `key` in the current generation or None '''
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        generation, ids, total = entry
+        if generation != self.current():
+            del self._entries[key]
+            self.stale += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return ids, total
+
+    def set(self, key, generation: int, ids: tuple, total: int):
+        ''' Store results read in `generation` (taken before reading them, a write in between makes them stale) '''
+        if not self.enabled:
+            return
+        self._entries.pop(key, None)
+        self._entries[key] = (generation, ids, total)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def bump(self):
+        ''' A recipe was written, what any search found may have changed '''
+        self.generation.bump()
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "max_ids": self.max_ids,
+            "generation": self.current(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "stale": self.stale,
+            "evictions": self.evictions,
+        }
+
+
+def shared_invalidations():
+    ''' The invalidation log of the configured backend, None for a cache local to the process '''
+    if CacheConfig.backend == "shared":
+        return SharedInvalidations(CacheConfig.shared_path, CacheConfig.shared_slots)
+    if CacheConfig.backend != "local":
+        raise ValueError(f"Unknown RECIPE_CACHE_BACKEND {CacheConfig.backend!r}, use local or shared")
+    return None
+
+
+recipe_cache = TTLCache(CacheConfig.max_entries, CacheConfig.ttl, shared=shared_invalidations())
+
+
+def search_generation():
+    ''' The write counter of the configured backend '''
+    if CacheConfig.backend == "shared":
+        return SharedGeneration(SearchConfig.shared_generation_path)
+    return Generation()
+
+
+search_cache = SearchCache(SearchConfig.cache_max_entries, SearchConfig.cache_max_ids, search_generation())
@@ -0,0 +1,198 @@
+'''
+Change log of the recipes, the feed behind ` /recipes/changes `.
+
+Every insert, update and delete of a `recipie` row appends a `recipe_change` row, written by
+triggers in the same transaction as the change itself (like the search index), so no write path
+can miss one and a rolled back write leaves none. `seq` is an `AUTOINCREMENT` key, it only ever
+grows. SQLite has one writer at a time, so changes commit in `seq` order and a reader that has
+seen `seq` N has seen every change before it: ` ?since=N ` is all a client has to remember.
+The table and triggers are the `m0007_recipe_changes` migration's.
+
+`ChangeFeed` serves the Server-Sent Events streams of a worker. One task tails the log for all
+of them: it reads each new batch of changes (with the recipes they touched) once and hands it
+to every subscriber's queue. It is woken by the writes of its own worker (`notify`) and polls
+every `ChangeFeedConfig.poll_interval` for those of the others. A subscriber that does not keep
+up is dropped, it reconnects from the last change it got.
+'''
+
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+from sqlalchemy import delete, func, select
+
+from config import ChangeFeedConfig
+from modals import DBRecipeModal, recipe_change
+from database.engine import engine
+
+log = logging.getLogger("recipe_api.changes")
+
+recipie = DBRecipeModal.__table__
+
+OPERATIONS = ("create", "update", "delete")
+RECIPE_PREFIX = "recipe__"
+
+class ChangeLogTruncated(ValueError):
+    ''' The changes after the asked-for `since` were pruned, the client has to resync from ` /recipes ` '''
+
+
+def changes_statement(since: int, limit: int):
+    '''
+    The changes after `since`, oldest first, each with the current state of its recipe
+    (columns prefixed `recipe__`, all None once the recipe is deleted)
+    '''
+    current = [column.label(f"{RECIPE_PREFIX}{column.name}") for column in recipie.c]
+    return (
+        select(recipe_change, *current)
+        .outerjoin(recipie, recipie.c.id == recipe_change.c.recipe_id)
+        .where(recipe_change.c.seq > since)
+        .order_by(recipe_change.c.seq)
+        .limit(limit)
+    )
+
+
+def oldest_seq_statement():
+    return select(func.min(recipe_change.c.seq))
+
+
+def latest_seq_statement():
+    return select(func.coalesce(func.max(recipe_change.c.seq), 0))
+
+
+def prune_statement(before: str):
+    '''
+    Drop the changes up to the last one older than `before` (a stored timestamp). Only ever a
+    prefix of the log goes, and never its latest change, so the oldest `seq` left tells how far
+    back the log reaches
+    '''
+    cutoff = select(func.max(recipe_change.c.seq)).where(recipe_change.c.changed_at < before)
+    latest = select(func.max(recipe_change.c.seq))
+    return delete(recipe_change).where(
+        recipe_change.c.seq <= cutoff.scalar_subquery(),
+        recipe_change.c.seq < latest.scalar_subquery(),
+    )
+
+
+class Subscription:
+    def __init__(self, queue_size: int):
+        self.queue = asyncio.Queue(queue_size)
+        self.dropped = False
+
+
+class ChangeFeed:
+    def __init__(self, poll_interval: float, batch_size: int, queue_size: int, max_subscribers: int):
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self.subscribers = set()
+        self.last_seq = 0
+        self.batches = 0
+        self.changes = 0
+        self.dropped = 0
+        self._task = None
+        self._wake = None
+        self._lock = None
+
+    @property
+    def full(self):
+        return len(self.subscribers) >= self.max_subscribers
+
+    def notify(self):
+        ''' A change was committed by this worker, read it now rather than on the next poll '''
+        if self._wake is not None:
+            self._wake.set()
+
+    @asynccontextmanager
+    async def subscribe(self):
+        '''
+        A `Subscription` receiving every batch of changes after `last_seq` as it is when this
+        returns, the caller catches up on the older ones from the table itself
+        '''
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+            self._wake = asyncio.Event()
+        subscription = Subscription(self.queue_size)
+        async with self._lock:
+            if self._task is None or self._task.done():
+                # the tail starts where the log is now, before the subscriber reads its backlog
+                self.last_seq = await self._read(latest_seq_statement(), scalar=True)
+                self.subscribers.add(subscription)
+                self._task = asyncio.create_task(self._tail(), name="change-feed")
+            else:
+                self.subscribers.add(subscription)
+        try:
+            yield subscription
+        finally:
+            self.subscribers.discard(subscription)
+
+    async def stop(self):
+        ''' Stop the tail, the subscribers' streams end once they drained their queues '''
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for subscription in list(self.subscribers):
+            self._drop(subscription)
+        # bound to the event loop that is going away
+        self._lock = None
+        self._wake = None
+
+    async def _read(self, statement, scalar: bool = False):
+        # the primary, a replica might not have the changes yet
+        async with engine.connect() as conn:
+            result = await conn.execute(statement)
+            return result.scalar_one() if scalar else result.fetchall()
+
+    async def _tail(self):
+        while self.subscribers:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                while True:
+                    rows = await self._read(changes_statement(self.last_seq, self.batch_size))
+                    if not rows:
+                        break
+                    self.last_seq = rows[-1].seq
+                    self._publish(rows)
+                    if len(rows) < self.batch_size:
+                        break
+            except Exception:
+                log.exception("reading the change log failed, retrying")
+
+    def _publish(self, rows):
+        self.batches += 1
+        self.changes += len(rows)
+        for subscription in list(self.subscribers):
+            try:
+                subscription.queue.put_nowait(rows)
+            except asyncio.QueueFull:
+                self._drop(subscription)
+
+    def _drop(self, subscription: Subscription):
+        subscription.dropped = True
+        self.subscribers.discard(subscription)
+        self.dropped += 1
+
+    def stats(self):
+        return {
+            "subscribers": len(self.subscribers),
+            "last_seq": self.last_seq,
+            "batches": self.batches,
+            "changes": self.changes,
+            "dropped": self.dropped,
+        }
+
+
+change_feed = ChangeFeed(
+    ChangeFeedConfig.poll_interval,
+    ChangeFeedConfig.batch_size,
+    ChangeFeedConfig.queue_size,
+    ChangeFeedConfig.max_subscribers,
+)
@@ -1,9 +1,188 @@
 '''
-This file is used to create the database engine and create the tables in the database.
+This file is used to create the async database engine and the per-request session.
+The schema is not created here, see `database/migrations`.
+
+The engine is configured from `config.DatabaseConfig`, locally it is SQLite through aiosqlite,
+any other async SQLAlchemy URL can be plugged in with `DATABASE_URL`.
+
+SQLite connections get the `config.SQLiteConfig` pragmas when they are opened. The driver's own
+transaction handling is switched off and SQLAlchemy emits `BEGIN` itself (the recipe from the
+SQLAlchemy SQLite docs), so savepoints and DDL behave transactionally. A connection opened with
+the `sqlite_begin="IMMEDIATE"` execution option takes the write lock as soon as it begins.
+
+Every engine counts and times its statements for `metrics.py`, `echo` stays off unless
+`DATABASE_ECHO` is set.
+
+With `DATABASE_REPLICA_URLS` there is one more (read only) engine per replica, and the sessions
+are `RoutingSession`s sending their reads to them, see `database/routing.py`.
 '''
 
-from sqlalchemy import create_engine
-from modals import DBBaseModel
+import re
+import time
+from contextlib import AsyncExitStack
+
+from fastapi import Request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+import metrics
+from config import DatabaseConfig, SQLiteConfig, MetricsConfig, ReplicaConfig
+from database.migrations import pending_migrations
+from database.routing import ReadRouter, pins_backend, request_keys
+
+
+def engine_options():
+    ''' Keyword arguments for `create_async_engine` built from the config '''
+    options = {"echo": DatabaseConfig.echo, "pool_pre_ping": DatabaseConfig.pool_pre_ping}
+    # in-memory SQLite runs on a single static connection, there is no pool to size
+    if ":memory:" not in DatabaseConfig.url:
+        # set explicitly, the aiosqlite dialect would otherwise open a new connection per checkout
+        options.update(
+            poolclass=AsyncAdaptedQueuePool,
+            pool_size=DatabaseConfig.pool_size,
+            max_overflow=DatabaseConfig.max_overflow,
+            pool_timeout=DatabaseConfig.pool_timeout,
+            pool_recycle=DatabaseConfig.pool_recycle,
+        )
+    return options
+
+
+def sqlite_pragmas(url: str = DatabaseConfig.url, read_only: bool = False):
+    ''' PRAGMA statements of the SQLite profile, a `read_only` connection refuses to write '''
+    pragmas = {
+        "journal_mode": SQLiteConfig.journal_mode,
+        "synchronous": SQLiteConfig.synchronous,
+        "mmap_size": int(SQLiteConfig.mmap_size),
+        "cache_size": int(SQLiteConfig.cache_size),
+        "busy_timeout": int(SQLiteConfig.busy_timeout),
+    }
+    # an in-memory database has no journal file to put in WAL mode, a replica keeps the one it was given
+    if ":memory:" in url or read_only:
+        del pragmas["journal_mode"]
+    if read_only:
+        pragmas["query_only"] = "ON"
+    for name, value in pragmas.items():
+        if not re.fullmatch(r"-?\w+", str(value)):
+            raise ValueError(f"Invalid value for PRAGMA {name}: {value!r}")
+    return [f"PRAGMA {name} = {value}" for name, value in pragmas.items()]
+
+
+def use_sqlite_profile(engine, read_only: bool = False):
+    ''' Apply the pragmas on connect and take over transaction begins from the driver '''
+    pragmas = sqlite_pragmas(engine.url.render_as_string(hide_password=False), read_only)
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+    @event.listens_for(engine.sync_engine, "begin")
+    def on_begin(conn):
+        mode = conn.get_execution_options().get("sqlite_begin", "DEFERRED")
+        conn.exec_driver_sql(f"BEGIN {mode}")
+
+
+def use_query_metrics(engine):
+    ''' Time every statement the engine runs and hand it to `metrics.record_query` '''
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def after_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        metrics.record_query(statement, time.perf_counter() - started)
+
+    @event.listens_for(engine.sync_engine, "handle_error")
+    def on_error(exception_context):
+        # a failed statement never reaches after_cursor_execute
+        started = exception_context.connection.info.get("query_started") if exception_context.connection else None
+        if started:
+            started.pop()
+
+
+def build_engine(url: str = DatabaseConfig.url, read_only: bool = False, **overrides):
+    '''
+    A new engine on `url` (`DATABASE_URL`), `overrides` replace the configured `create_async_engine`
+    options. SQLite connections of a `read_only` engine (a replica) refuse to write.
+    '''
+    new_engine = create_async_engine(url, **{**engine_options(), **overrides})
+    if new_engine.dialect.name == "sqlite":
+        use_sqlite_profile(new_engine, read_only)
+    if MetricsConfig.enabled:
+        use_query_metrics(new_engine)
+    return new_engine
+
+
+engine = build_engine()
+replica_engines = [build_engine(url, read_only=True) for url in ReplicaConfig.urls]
+read_router = ReadRouter(replica_engines, pins_backend(), ReplicaConfig.sticky_seconds)
+
+
+class RoutingSession(Session):
+    '''
+    Session reading from the replicas when there are any (see `database/routing.py`).
+    `SELECT`s go to the replica `read_router` picks, anything else (DML, transaction control,
+    `session.connection()`) to the primary. A DML statement marks the session as having written.
+    '''
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if not read_router.enabled:
+            return engine.sync_engine
+        if clause is not None and clause.is_select:
+            replica = read_router.read_engine(self.info)
+            if replica is not None:
+                return replica.sync_engine
+        elif clause is not None and clause.is_dml:
+            read_router.wrote(self.info)
+        return engine.sync_engine
+
+
+SessionLocal = async_sessionmaker(engine, expire_on_commit=False, sync_session_class=RoutingSession)
+
+
+async def get_session(request: Request):
+    ''' FastAPI dependency: one `AsyncSession` per request, returned to the pool afterwards '''
+    async with SessionLocal() as session:
+        if read_router.enabled:
+            read_router.open_session(session.info, request_keys(request))
+        yield session
+
+
+async def warm_up_pool(connections: int = DatabaseConfig.pool_warmup):
+    '''
+    Open `connections` pooled connections of every engine on startup and hand them back to the
+    pools, so the first requests do not pay for the connect (and the SQLite pragmas) themselves
+    '''
+    async with AsyncExitStack() as stack:
+        for target in (engine, *replica_engines):
+            if ":memory:" in target.url.render_as_string():
+                continue
+            for _ in range(min(connections, DatabaseConfig.pool_size)):
+                conn = await stack.enter_async_context(target.connect())
+                await conn.exec_driver_sql("SELECT 1")
+
+
+async def check_schema():
+    '''
+    Refuse to start on a database (or a replica) that is missing migrations, without changing anything
+    '''
+    for target in (engine, *replica_engines):
+        async with target.connect() as conn:
+            pending = await conn.run_sync(pending_migrations)
+        if pending:
+            versions = ", ".join(f"{migration.version:04d}_{migration.name}" for migration in pending)
+            database = "database" if target is engine else f"replica {target.url.render_as_string()}"
+            raise RuntimeError(
+                f"The {database} schema is not up to date (pending: {versions}), run `python manage.py migrate`"
+            )
+
 
-engine = create_engine("sqlite+pysqlite:///databse.db", echo=True)
-DBBaseModel.metadata.create_all(engine)
\ No newline at end of file
+async def dispose_engines():
+    ''' Close the connections of every engine '''
+    for target in (engine, *replica_engines):
+        await target.dispose()
@@ -0,0 +1,141 @@
+'''
+Normalized ingredient index for recipes.
+
+`recipie.ingredients` stays free text. After every write of it the text is parsed into normalized
+names (`parse_ingredients`): ` 2 cups Plain Flour (sifted), 3 eggs ` -> ` plain flour `, ` eggs `,
+by the `index_ingredients` background job the write queues (`database/jobs.py`). A bulk import
+indexes each batch of rows in the transaction writing it.
+Each name gets one `ingredient` row, and every recipe one `recipe_ingredient` row per name.
+Its primary key `(ingredient_id, recipe_id)` holds the postings of each ingredient, and
+`ix_recipe_ingredient_recipe_id` the ingredients of each recipe.
+
+`by_ingredients_statement` answers "recipes with all of these, any of those and none of them"
+from the postings alone. The recipes come back ranked by how many of the asked-for ingredients
+they have. Deleting a recipe drops its postings through the `recipe_ingredient_ad` trigger.
+The tables, the trigger and the backfill are the `m0005_ingredients` migration's (with a copy of
+the parser as it was then).
+'''
+
+import re
+
+from sqlalchemy import and_, bindparam, case, delete, exists, func, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from modals import ingredient, recipe_ingredient
+
+# names kept per recipe, also keeps every statement below SQLite's bound parameter limit
+MAX_INGREDIENTS = 200
+MAX_NAME_LENGTH = 100
+
+# quantities and units in front of a name are not part of it
+UNITS = frozenset((
+    "g", "gram", "grams", "kg", "kilogram", "kilograms", "mg", "oz", "ounce", "ounces",
+    "lb", "lbs", "pound", "pounds", "ml", "millilitre", "milliliter", "millilitres", "milliliters",
+    "l", "litre", "liter", "litres", "liters", "dl", "cl",
+    "tsp", "teaspoon", "teaspoons", "tbsp", "tbs", "tablespoon", "tablespoons", "cup", "cups",
+    "pinch", "pinches", "dash", "dashes", "handful", "handfuls", "clove", "cloves", "can", "cans",
+    "slice", "slices", "piece", "pieces", "bunch", "bunches", "sprig", "sprigs", "stick", "sticks",
+    "x", "of", "a", "an",
+))
+
+_SEPARATORS = re.compile(r"[,;\n\r]+")
+_PARENTHESES = re.compile(r"\([^)]*\)|\[[^\]]*\]")
+_WORD = re.compile(r"[^\W_]+(?:['./-][^\W_]+)*")
+# ` 2 `, ` 1/2 `, ` ½ `, ` 1.5 ` or a quantity with its unit attached, ` 250g `
+_QUANTITY = re.compile(r"[\d½¼¾⅓⅔⅛][\d½¼¾⅓⅔⅛./-]*(?P<unit>[^\W\d_]*)")
+
+
+def _is_measure(word: str):
+    quantity = _QUANTITY.fullmatch(word)
+    if quantity is not None:
+        return not quantity.group("unit") or quantity.group("unit") in UNITS
+    return word in UNITS
+
+
+def normalize_ingredient(text: str):
+    '''
+    The normalized name of one ingredient, None when nothing is left of it.
+    Lower case, words only, leading quantities and units dropped, asides in brackets dropped
+    ` 250 g Dark Chocolate (70%) ` -> ` dark chocolate `
+    '''
+    words = _WORD.findall(_PARENTHESES.sub(" ", text.lower()))
+    start = 0
+    while start < len(words) and _is_measure(words[start]):
+        start += 1
+    name = " ".join(words[start:])[:MAX_NAME_LENGTH].strip()
+    return name or None
+
+
+def parse_ingredients(text: str | None):
+    ''' Normalized names of a free-text ingredient list (comma, semicolon or line separated), each once '''
+    names = dict.fromkeys(
+        name for name in map(normalize_ingredient, _SEPARATORS.split(text or "")) if name is not None
+    )
+    return list(names)[:MAX_INGREDIENTS]
+
+
+def link_parameters(rows):
+    '''
+    What `link_ingredients` writes for `rows` of `(recipe_id, ingredients text)`:
+    the distinct names, and one `{"recipe_id", "name"}` per posting
+    '''
+    names, postings = {}, []
+    for recipe_id, text in rows:
+        for name in parse_ingredients(text):
+            names[name] = None
+            postings.append({"recipe_id": recipe_id, "name": name})
+    return [{"name": name} for name in names], postings
+
+
+ADD_NAMES = sqlite_insert(ingredient).on_conflict_do_nothing(index_elements=["name"])
+ADD_POSTING = sqlite_insert(recipe_ingredient).from_select(
+    ["ingredient_id", "recipe_id"],
+    select(ingredient.c.id, bindparam("recipe_id")).where(ingredient.c.name == bindparam("name")),
+).on_conflict_do_nothing()
+
+
+async def link_ingredients(conn, rows, replace: bool = False):
+    '''
+    Index the ingredients of `rows` of `(recipe_id, ingredients text)`, executed on `conn`
+    (a connection or session, inside the caller's transaction). With `replace` the recipes'
+    previous postings are removed first.
+    '''
+    if replace:
+        recipe_ids = [recipe_id for recipe_id, _ in rows]
+        await conn.execute(delete(recipe_ingredient).where(recipe_ingredient.c.recipe_id.in_(recipe_ids)))
+    names, postings = link_parameters(rows)
+    if postings:
+        await conn.execute(ADD_NAMES, names)
+        await conn.execute(ADD_POSTING, postings)
+
+
+def ingredient_ids_statement(names: list[str]):
+    return select(ingredient.c.name, ingredient.c.id).where(ingredient.c.name.in_(names))
+
+
+def by_ingredients_statement(include_all: list[int], include_any: list[int], exclude: list[int]):
+    '''
+    `(recipe_id, matches)` of the recipes having every ingredient id of `include_all`, at least one
+    of `include_any` (when given) and none of `exclude`, best match first. Only the postings of the
+    included ingredients are read, grouped by recipe. The excluded ones are probed per candidate.
+    '''
+    wanted = list(dict.fromkeys(include_all + include_any))
+    matches = func.count().label("matches")
+    query = (
+        select(recipe_ingredient.c.recipe_id, matches)
+        .where(recipe_ingredient.c.ingredient_id.in_(wanted))
+        .group_by(recipe_ingredient.c.recipe_id)
+    )
+    if include_all:
+        has_all = func.sum(case((recipe_ingredient.c.ingredient_id.in_(include_all), 1), else_=0))
+        query = query.having(has_all == len(set(include_all)))
+    if include_any:
+        has_any = func.sum(case((recipe_ingredient.c.ingredient_id.in_(include_any), 1), else_=0))
+        query = query.having(has_any > 0)
+    if exclude:
+        excluded = recipe_ingredient.alias("excluded")
+        query = query.where(~exists().where(and_(
+            excluded.c.recipe_id == recipe_ingredient.c.recipe_id,
+            excluded.c.ingredient_id.in_(exclude),
+        )))
+    return query.order_by(matches.desc(), recipe_ingredient.c.recipe_id)
@@ -0,0 +1,237 @@
+'''
+Background jobs: the work that follows a write without holding up its response.
+
+A write enqueues that work (`enqueue`) as a `job` row inside its own transaction, so a committed
+write always has its jobs and a rolled back one has none, and a job outlives a crash or a restart
+until it ran. Today that is the ingredient index of a recipe (`index_ingredients`): parsing the
+ingredient list and rewriting its postings no longer adds to ` POST /recipe ` and
+` PATCH /recipe/{recipe_id} `, ` /recipes/by-ingredients ` finds a recipe once its job ran
+(normally a few milliseconds later). The full-text index stays in the write's transaction
+(triggers), search finds a recipe as soon as it is written.
+
+`JobQueue` runs the jobs. It claims the due ones by pushing their `run_after` a lease ahead, so
+no other runner takes them and a job whose runner died is run again once the lease is over. Each
+job runs through the writer queue (`database/writer.py`), deleted in the same transaction as
+its work, so the jobs of a batch are committed together. A failing job is retried after
+`JobConfig.retry_base_seconds`, doubling every attempt, and kept as failed (`failed_at`,
+`last_error`) once it failed `JobConfig.max_attempts` times. Handlers get what the job is about,
+not a snapshot: they read the current state, and running one twice does no harm.
+
+Every API worker runs a queue, woken by its own writes (`notify`) and polling every
+`JobConfig.poll_interval` for the others'. With `JOBS_RUN_IN_PROCESS=false` the jobs are left to
+separate processes:
+```bash
+python manage.py worker
+```
+'''
+
+import time
+import asyncio
+import logging
+
+import orjson
+from sqlalchemy import delete, func, insert, select, update
+
+import metrics
+from config import JobConfig
+from modals import DBRecipeModal, job
+from database.engine import engine
+from database.ingredients import link_ingredients
+from database.writer import commit_write
+
+log = logging.getLogger("recipe_api.jobs")
+
+recipie = DBRecipeModal.__table__
+
+INDEX_INGREDIENTS = "index_ingredients"
+MAX_ERROR_LENGTH = 1000
+
+
+async def index_ingredients(conn, payload: dict):
+    ''' Rewrite the ingredient postings of a recipe from its current ingredient list '''
+    result = await conn.execute(select(recipie.c.ingredients).where(recipie.c.id == payload["recipe_id"]))
+    row = result.first()
+    if row is None:
+        # deleted since, the delete trigger dropped its postings
+        return
+    await link_ingredients(conn, [(payload["recipe_id"], row.ingredients)], replace=True)
+
+
+HANDLERS = {
+    INDEX_INGREDIENTS: index_ingredients,
+}
+
+
+async def enqueue(conn, kind: str, payload: dict, delay: float = 0.0):
+    ''' Queue a job on `conn`, inside the caller's transaction: it exists once that commits '''
+    now = time.time()
+    await conn.execute(insert(job).values(
+        kind=kind, payload=orjson.dumps(payload).decode(), attempts=0, run_after=now + delay, enqueued_at=now,
+    ))
+
+
+def claim_statement(now: float, limit: int, lease: float):
+    ''' Take up to `limit` due jobs, oldest due first, for `lease` seconds and count the attempt '''
+    due = (
+        select(job.c.id)
+        .where(job.c.failed_at.is_(None), job.c.run_after <= now)
+        .order_by(job.c.run_after)
+        .limit(limit)
+    )
+    return (
+        update(job)
+        .where(job.c.id.in_(due.scalar_subquery()))
+        .values(run_after=now + lease, attempts=job.c.attempts + 1)
+        .returning(job.c.id, job.c.kind, job.c.payload, job.c.attempts, job.c.enqueued_at)
+    )
+
+
+def depth_statement():
+    ''' Jobs waiting or running, and jobs that failed for good '''
+    return select(
+        func.count().filter(job.c.failed_at.is_(None)),
+        func.count().filter(job.c.failed_at.is_not(None)),
+    )
+
+
+def requeue_failed_statement():
+    ''' Give the jobs that failed for good a new set of attempts '''
+    return (
+        update(job)
+        .where(job.c.failed_at.is_not(None))
+        .values(failed_at=None, attempts=0, run_after=time.time())
+    )
+
+
+class JobQueue:
+    def __init__(self, poll_interval: float, batch_size: int, lease_seconds: float, max_attempts: int, retry_base_seconds: float):
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_base_seconds = retry_base_seconds
+        self.depth = 0
+        self.failed_jobs = 0
+        self.running_jobs = 0
+        self.done = 0
+        self.retried = 0
+        self.failed = 0
+        self._task = None
+        self._wake = None
+        self._stopping = False
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def notify(self):
+        ''' A job was enqueued by this process, look for it now rather than on the next poll '''
+        if self._wake is not None:
+            self._wake.set()
+
+    async def start(self):
+        ''' Start running the jobs on the running event loop '''
+        if self.running:
+            return
+        self._wake = asyncio.Event()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run(), name="job-queue")
+
+    async def stop(self):
+        ''' Finish the jobs being run, then stop. The others stay queued '''
+        if not self.running:
+            return
+        self._stopping = True
+        self._wake.set()
+        await self._task
+        self._task = None
+        self._wake = None
+
+    async def run_due(self):
+        ''' Claim and run one batch of due jobs, returns how many there were '''
+        claim = claim_statement(time.time(), self.batch_size, self.lease_seconds)
+        claimed = await commit_write(lambda conn: self._fetch(conn, claim))
+        self.running_jobs = len(claimed)
+        try:
+            await asyncio.gather(*(self._run_job(row) for row in claimed))
+        finally:
+            self.running_jobs = 0
+        async with engine.connect() as conn:
+            self.depth, self.failed_jobs = (await conn.execute(depth_statement())).one()
+        return len(claimed)
+
+    async def _fetch(self, conn, statement):
+        result = await conn.execute(statement)
+        return result.fetchall()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                ran = await self.run_due()
+            except Exception:
+                log.exception("running the jobs failed, retrying")
+                ran = 0
+            if ran >= self.batch_size or self._stopping:
+                continue
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    async def _run_job(self, row):
+        handler = HANDLERS.get(row.kind)
+        started = time.perf_counter()
+
+        async def work(conn):
+            if handler is None:
+                raise LookupError(f"No handler for jobs of kind {row.kind!r}")
+            await handler(conn, orjson.loads(row.payload))
+            await conn.execute(delete(job).where(job.c.id == row.id))
+
+        try:
+            await commit_write(work)
+        except Exception as error:
+            await self._failed(row, error)
+            return
+        self.done += 1
+        metrics.job_duration.observe(time.perf_counter() - started, row.kind)
+        metrics.job_latency.observe(time.time() - row.enqueued_at, row.kind)
+
+    async def _failed(self, row, error: Exception):
+        now = time.time()
+        message = f"{type(error).__name__}: {error}"[:MAX_ERROR_LENGTH]
+        retry = row.attempts < self.max_attempts
+        if retry:
+            values = {"run_after": now + self.retry_base_seconds * 2 ** (row.attempts - 1)}
+            self.retried += 1
+            log.warning("job %d (%s) failed on attempt %d, retrying: %s", row.id, row.kind, row.attempts, message)
+        else:
+            values = {"failed_at": now}
+            self.failed += 1
+            log.error("job %d (%s) failed %d times, giving up: %s", row.id, row.kind, row.attempts, message)
+        statement = update(job).where(job.c.id == row.id).values(last_error=message, **values)
+        try:
+            await commit_write(lambda conn: conn.execute(statement))
+        except Exception:
+            # it is run again once its lease is over
+            log.exception("recording the failure of job %d failed", row.id)
+
+    def stats(self):
+        return {
+            "depth": self.depth,
+            "failed_jobs": self.failed_jobs,
+            "running": self.running_jobs,
+            "done": self.done,
+            "retried": self.retried,
+            "failed": self.failed,
+        }
+
+
+job_queue = JobQueue(
+    JobConfig.poll_interval,
+    JobConfig.batch_size,
+    JobConfig.lease_seconds,
+    JobConfig.max_attempts,
+    JobConfig.retry_base_seconds,
+)
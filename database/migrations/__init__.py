@@ -0,0 +1,103 @@
+'''
+Versioned schema migrations.
+
+Every migration is a module `mNNNN_<name>.py` in this package with an `upgrade(conn)` function
+that gets a synchronous SQLAlchemy connection. The versions that were applied are recorded in
+the `schema_migrations` table. The schema is only ever changed by the explicit command
+```bash
+python manage.py migrate
+```
+the application itself just checks on startup that no migration is pending.
+
+On SQLite the engine emits `BEGIN` itself (see `database/engine.py`) so a failing migration
+rolls back with its DDL, other drivers may not do so. Write migrations so that running them
+again is harmless (` IF NOT EXISTS `, ` IF EXISTS `).
+
+A migration does what it did when it was released, on any database, however the application
+changed since: it carries its own copy of the DDL, trigger text and backfill logic it needs and
+imports nothing of the application (no models, no engines).
+'''
+
+import re
+import pkgutil
+import importlib
+from datetime import datetime, timezone
+
+from sqlalchemy import inspect, text
+
+MIGRATIONS_TABLE = "schema_migrations"
+
+_MODULE_NAME = re.compile(r"^m(\d{4})_(\w+)$")
+
+
+class Migration:
+    def __init__(self, version: int, name: str, module):
+        self.version = version
+        self.name = name
+        self.description = (module.__doc__ or "").strip().splitlines()[0] if module.__doc__ else ""
+        self.upgrade = module.upgrade
+
+    def __repr__(self) -> str:
+        return f"Migration(version={self.version!r}, name={self.name!r})"
+
+
+def load_migrations():
+    ''' All migrations of this package, ordered by version '''
+    migrations = []
+    for module_info in pkgutil.iter_modules(__path__):
+        match = _MODULE_NAME.match(module_info.name)
+        if not match:
+            continue
+        module = importlib.import_module(f"{__name__}.{module_info.name}")
+        migrations.append(Migration(int(match.group(1)), match.group(2), module))
+    migrations.sort(key=lambda migration: migration.version)
+    return migrations
+
+
+def ensure_migrations_table(conn):
+    conn.execute(text(f'''
+        CREATE TABLE IF NOT EXISTS {MIGRATIONS_TABLE} (
+            version INTEGER NOT NULL PRIMARY KEY,
+            name VARCHAR NOT NULL,
+            applied_at VARCHAR NOT NULL
+        )
+    '''))
+
+
+def applied_versions(conn):
+    ''' Versions already applied to the database, without creating anything '''
+    if not inspect(conn).has_table(MIGRATIONS_TABLE):
+        return set()
+    return set(conn.execute(text(f"SELECT version FROM {MIGRATIONS_TABLE}")).scalars())
+
+
+def pending_migrations(conn):
+    ''' Migrations not applied yet, in the order they have to run '''
+    applied = applied_versions(conn)
+    return [migration for migration in load_migrations() if migration.version not in applied]
+
+
+def upgrade(conn, target: int | None = None, on_applied=None):
+    '''
+    Apply the pending migrations up to `target` (all when None), each one committed together
+    with its `schema_migrations` row. `conn` must not be inside a transaction.
+    Returns the migrations that were applied.
+    '''
+    with conn.begin():
+        ensure_migrations_table(conn)
+        pending = pending_migrations(conn)
+
+    applied = []
+    for migration in pending:
+        if target is not None and migration.version > target:
+            break
+        with conn.begin():
+            migration.upgrade(conn)
+            conn.execute(
+                text(f"INSERT INTO {MIGRATIONS_TABLE} (version, name, applied_at) VALUES (:version, :name, :applied_at)"),
+                {"version": migration.version, "name": migration.name, "applied_at": str(datetime.now(timezone.utc))},
+            )
+        applied.append(migration)
+        if on_applied is not None:
+            on_applied(migration)
+    return applied
@@ -0,0 +1,33 @@
+'''
+Create the user_account and recipie tables
+
+Same DDL the models used to get from `create_all`, databases created that way are left untouched.
+'''
+
+from sqlalchemy import text
+
+
+def upgrade(conn):
+    conn.execute(text('''
+        CREATE TABLE IF NOT EXISTS user_account (
+            name VARCHAR NOT NULL,
+            email VARCHAR NOT NULL,
+            password VARCHAR NOT NULL,
+            created_at VARCHAR NOT NULL,
+            id VARCHAR NOT NULL,
+            PRIMARY KEY (id),
+            UNIQUE (email)
+        )
+    '''))
+    conn.execute(text('''
+        CREATE TABLE IF NOT EXISTS recipie (
+            name VARCHAR,
+            ingredients VARCHAR,
+            instructions VARCHAR,
+            owner_id VARCHAR NOT NULL,
+            created_at VARCHAR NOT NULL,
+            id VARCHAR NOT NULL,
+            PRIMARY KEY (id),
+            FOREIGN KEY(owner_id) REFERENCES user_account (id)
+        )
+    '''))
@@ -0,0 +1,44 @@
+'''
+Add the recipie_fts full-text index and its sync triggers, backfilled from the existing recipes
+
+The DDL is a copy of `database/search.py` as it was when this migration was released, later
+changes to the index get a migration of their own (`m0004` narrows the update trigger).
+'''
+
+from sqlalchemy import text
+
+FTS_DDL = [
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS recipie_fts USING fts5(
+        name, ingredients, instructions,
+        content='recipie', content_rowid='rowid',
+        tokenize='porter unicode61'
+    )
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS recipie_fts_ai AFTER INSERT ON recipie BEGIN
+        INSERT INTO recipie_fts(rowid, name, ingredients, instructions)
+        VALUES (new.rowid, new.name, new.ingredients, new.instructions);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS recipie_fts_ad AFTER DELETE ON recipie BEGIN
+        INSERT INTO recipie_fts(recipie_fts, rowid, name, ingredients, instructions)
+        VALUES ('delete', old.rowid, old.name, old.ingredients, old.instructions);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS recipie_fts_au AFTER UPDATE ON recipie BEGIN
+        INSERT INTO recipie_fts(recipie_fts, rowid, name, ingredients, instructions)
+        VALUES ('delete', old.rowid, old.name, old.ingredients, old.instructions);
+        INSERT INTO recipie_fts(rowid, name, ingredients, instructions)
+        VALUES (new.rowid, new.name, new.ingredients, new.instructions);
+    END
+    ''',
+]
+
+
+def upgrade(conn):
+    for statement in FTS_DDL:
+        conn.execute(text(statement))
+    conn.execute(text("INSERT INTO recipie_fts(recipie_fts) VALUES ('rebuild')"))
@@ -0,0 +1,14 @@
+'''
+Index recipie.owner_id and recipie(created_at, id)
+
+`owner_id` backs the owner filters and the ownership checked writes, `(created_at, id)` backs
+the ordering and the keyset pagination. The `UserFunction` lookups need nothing new: `id` is
+covered by the primary key index and `email` by the index of its unique constraint.
+'''
+
+from sqlalchemy import text
+
+
+def upgrade(conn):
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_recipie_owner_id ON recipie (owner_id)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_recipie_created_at_id ON recipie (created_at, id)"))
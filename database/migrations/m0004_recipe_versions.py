@@ -0,0 +1,37 @@
+'''
+Add recipie.updated_at and recipie.version for conditional requests
+
+Existing recipes start at version 1 with `updated_at = created_at`. The full-text update trigger
+is narrowed to the indexed columns first, so the backfill does not rewrite the search index.
+`ix_recipie_created_at_id` is replaced by `ix_recipie_created_at_id_version`, which serves the
+same seeks and also covers the page ETags, `ix_recipie_id_version` covers the ETag of one recipe.
+'''
+
+from sqlalchemy import text
+
+# only edits of the indexed columns touch the index, version bumps and backfills do not
+FTS_UPDATE_TRIGGER = '''
+    CREATE TRIGGER IF NOT EXISTS recipie_fts_au AFTER UPDATE OF name, ingredients, instructions ON recipie BEGIN
+        INSERT INTO recipie_fts(recipie_fts, rowid, name, ingredients, instructions)
+        VALUES ('delete', old.rowid, old.name, old.ingredients, old.instructions);
+        INSERT INTO recipie_fts(rowid, name, ingredients, instructions)
+        VALUES (new.rowid, new.name, new.ingredients, new.instructions);
+    END
+'''
+
+
+def upgrade(conn):
+    # ` ADD COLUMN ` has no ` IF NOT EXISTS `, a run that stopped after it must not fail the next one
+    columns = {row.name for row in conn.execute(text("PRAGMA table_info(recipie)"))}
+    if "updated_at" not in columns:
+        conn.execute(text("ALTER TABLE recipie ADD COLUMN updated_at VARCHAR"))
+    if "version" not in columns:
+        conn.execute(text("ALTER TABLE recipie ADD COLUMN version INTEGER NOT NULL DEFAULT 1"))
+
+    conn.execute(text("DROP TRIGGER IF EXISTS recipie_fts_au"))
+    conn.execute(text(FTS_UPDATE_TRIGGER))
+    conn.execute(text("UPDATE recipie SET updated_at = created_at WHERE updated_at IS NULL"))
+
+    conn.execute(text("DROP INDEX IF EXISTS ix_recipie_created_at_id"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_recipie_created_at_id_version ON recipie (created_at, id, version)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_recipie_id_version ON recipie (id, version, updated_at)"))
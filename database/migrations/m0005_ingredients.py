@@ -0,0 +1,114 @@
+'''
+Add the ingredient and recipe_ingredient tables, backfilled from the existing recipes
+
+`recipe_ingredient` is clustered on `(ingredient_id, recipe_id)`, the postings of an ingredient,
+and indexed the other way round for the ingredients of a recipe. See `database/ingredients.py`.
+
+The trigger and the ingredient parser of the backfill are copies of `database/ingredients.py`
+as it was when this migration was released, changing that module does not change this migration.
+'''
+
+import re
+
+from sqlalchemy import text
+
+MAX_INGREDIENTS = 200
+MAX_NAME_LENGTH = 100
+BACKFILL_BATCH_SIZE = 5000
+
+DELETE_TRIGGER = '''
+    CREATE TRIGGER IF NOT EXISTS recipe_ingredient_ad AFTER DELETE ON recipie BEGIN
+        DELETE FROM recipe_ingredient WHERE recipe_id = old.id;
+    END
+'''
+
+UNITS = frozenset((
+    "g", "gram", "grams", "kg", "kilogram", "kilograms", "mg", "oz", "ounce", "ounces",
+    "lb", "lbs", "pound", "pounds", "ml", "millilitre", "milliliter", "millilitres", "milliliters",
+    "l", "litre", "liter", "litres", "liters", "dl", "cl",
+    "tsp", "teaspoon", "teaspoons", "tbsp", "tbs", "tablespoon", "tablespoons", "cup", "cups",
+    "pinch", "pinches", "dash", "dashes", "handful", "handfuls", "clove", "cloves", "can", "cans",
+    "slice", "slices", "piece", "pieces", "bunch", "bunches", "sprig", "sprigs", "stick", "sticks",
+    "x", "of", "a", "an",
+))
+
+_SEPARATORS = re.compile(r"[,;\n\r]+")
+_PARENTHESES = re.compile(r"\([^)]*\)|\[[^\]]*\]")
+_WORD = re.compile(r"[^\W_]+(?:['./-][^\W_]+)*")
+_QUANTITY = re.compile(r"[\d½¼¾⅓⅔⅛][\d½¼¾⅓⅔⅛./-]*(?P<unit>[^\W\d_]*)")
+
+ADD_NAMES = text("INSERT INTO ingredient (name) VALUES (:name) ON CONFLICT (name) DO NOTHING")
+ADD_POSTING = text('''
+    INSERT INTO recipe_ingredient (ingredient_id, recipe_id)
+    SELECT ingredient.id, :recipe_id FROM ingredient WHERE ingredient.name = :name
+    ON CONFLICT DO NOTHING
+''')
+RECIPES_AFTER = text('''
+    SELECT id, ingredients FROM recipie WHERE id > :last_id ORDER BY id LIMIT :limit
+''')
+
+
+def _is_measure(word: str):
+    quantity = _QUANTITY.fullmatch(word)
+    if quantity is not None:
+        return not quantity.group("unit") or quantity.group("unit") in UNITS
+    return word in UNITS
+
+
+def normalize_ingredient(text: str):
+    words = _WORD.findall(_PARENTHESES.sub(" ", text.lower()))
+    start = 0
+    while start < len(words) and _is_measure(words[start]):
+        start += 1
+    name = " ".join(words[start:])[:MAX_NAME_LENGTH].strip()
+    return name or None
+
+
+def parse_ingredients(text: str | None):
+    names = dict.fromkeys(
+        name for name in map(normalize_ingredient, _SEPARATORS.split(text or "")) if name is not None
+    )
+    return list(names)[:MAX_INGREDIENTS]
+
+
+def backfill(conn):
+    ''' Index the ingredients of every recipe '''
+    last_id = ""
+    while True:
+        rows = conn.execute(RECIPES_AFTER, {"last_id": last_id, "limit": BACKFILL_BATCH_SIZE}).fetchall()
+        if not rows:
+            return
+        last_id = rows[-1].id
+        names, postings = {}, []
+        for recipe_id, ingredients in rows:
+            for name in parse_ingredients(ingredients):
+                names[name] = None
+                postings.append({"recipe_id": recipe_id, "name": name})
+        if postings:
+            conn.execute(ADD_NAMES, [{"name": name} for name in names])
+            conn.execute(ADD_POSTING, postings)
+
+
+def upgrade(conn):
+    conn.execute(text('''
+        CREATE TABLE IF NOT EXISTS ingredient (
+            id INTEGER NOT NULL,
+            name VARCHAR NOT NULL,
+            PRIMARY KEY (id),
+            UNIQUE (name)
+        )
+    '''))
+    conn.execute(text('''
+        CREATE TABLE IF NOT EXISTS recipe_ingredient (
+            ingredient_id INTEGER NOT NULL,
+            recipe_id VARCHAR NOT NULL,
+            PRIMARY KEY (ingredient_id, recipe_id),
+            FOREIGN KEY(ingredient_id) REFERENCES ingredient (id),
+            FOREIGN KEY(recipe_id) REFERENCES recipie (id)
+        ) WITHOUT ROWID
+    '''))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_recipe_ingredient_recipe_id ON recipe_ingredient (recipe_id, ingredient_id)"
+    ))
+    conn.execute(text(DELETE_TRIGGER))
+    backfill(conn)
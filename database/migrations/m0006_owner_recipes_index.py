@@ -0,0 +1,15 @@
+'''
+Replace ix_recipie_owner_id with ix_recipie_owner_id_created_at_id
+
+The composite index pages through one owner's recipes in `(created_at, id)` order without a
+sort, and answers every lookup the single column index did.
+'''
+
+from sqlalchemy import text
+
+
+def upgrade(conn):
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_recipie_owner_id_created_at_id ON recipie (owner_id, created_at, id, version)"
+    ))
+    conn.execute(text("DROP INDEX IF EXISTS ix_recipie_owner_id"))
@@ -0,0 +1,50 @@
+'''
+Add the recipe_change log and the triggers appending to it
+
+Every insert, update and delete of a recipe is recorded with a growing `seq`, clients follow
+the log through ` /recipes/changes `. See `database/changes.py`. The recipes that already exist
+are not logged, a client starts with a full read of ` /recipes `.
+The triggers are defined here, not in the application code, so this migration stays as released.
+'''
+
+from sqlalchemy import text
+
+# UTC in the format of the other timestamps
+_NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now') || '+00:00'"
+
+CHANGE_TRIGGERS = [
+    f'''
+    CREATE TRIGGER IF NOT EXISTS recipe_change_ai AFTER INSERT ON recipie BEGIN
+        INSERT INTO recipe_change (recipe_id, op, version, changed_at)
+        VALUES (new.id, 'create', new.version, coalesce(new.updated_at, {_NOW}));
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS recipe_change_au AFTER UPDATE ON recipie BEGIN
+        INSERT INTO recipe_change (recipe_id, op, version, changed_at)
+        VALUES (new.id, 'update', new.version, coalesce(new.updated_at, {_NOW}));
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS recipe_change_ad AFTER DELETE ON recipie BEGIN
+        INSERT INTO recipe_change (recipe_id, op, version, changed_at)
+        VALUES (old.id, 'delete', old.version, {_NOW});
+    END
+    ''',
+]
+
+
+def upgrade(conn):
+    conn.execute(text('''
+        CREATE TABLE IF NOT EXISTS recipe_change (
+            seq INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+            recipe_id VARCHAR NOT NULL,
+            op VARCHAR NOT NULL,
+            version INTEGER,
+            changed_at VARCHAR NOT NULL
+        )
+    '''))
+    # pruning by age
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_recipe_change_changed_at ON recipe_change (changed_at)"))
+    for trigger in CHANGE_TRIGGERS:
+        conn.execute(text(trigger))
@@ -0,0 +1,25 @@
+'''
+Add the job table of the background job queue
+
+Writes enqueue the work that follows them (the ingredient index of a recipe) as `job` rows in
+their own transaction, `JobQueue` runs them. See `database/jobs.py`.
+'''
+
+from sqlalchemy import text
+
+
+def upgrade(conn):
+    conn.execute(text('''
+        CREATE TABLE IF NOT EXISTS job (
+            id INTEGER NOT NULL PRIMARY KEY,
+            kind VARCHAR NOT NULL,
+            payload VARCHAR NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            run_after FLOAT NOT NULL,
+            enqueued_at FLOAT NOT NULL,
+            failed_at FLOAT,
+            last_error VARCHAR
+        )
+    '''))
+    # the jobs still to run, by when they are due
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_job_due ON job (run_after) WHERE failed_at IS NULL"))
@@ -0,0 +1,24 @@
+'''
+Add the idempotency_key table of the Idempotency-Key header
+
+The responses of the writes sent with an ` Idempotency-Key ` are kept there until they expire,
+retries get them back. See `idempotency.py`.
+'''
+
+from sqlalchemy import text
+
+
+def upgrade(conn):
+    conn.execute(text('''
+        CREATE TABLE IF NOT EXISTS idempotency_key (
+            "key" VARCHAR NOT NULL PRIMARY KEY,
+            fingerprint VARCHAR NOT NULL,
+            status INTEGER,
+            headers VARCHAR,
+            body BLOB,
+            locked_until FLOAT,
+            expires_at FLOAT NOT NULL
+        ) WITHOUT ROWID
+    '''))
+    # pruning the expired keys
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_idempotency_key_expires_at ON idempotency_key (expires_at)"))
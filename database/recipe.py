@@ -1,17 +1,105 @@
-from sqlalchemy import insert, select, update, delete
-from sqlalchemy.orm import Session
+'''
+Recipe data functions. Reads return SQLAlchemy rows (or a `{"message": ...}` dict when there is
+nothing to return), turning them into JSON is left to `controller/serializers.py`.
+'''
+
+from sqlalchemy import insert, select, update, delete, tuple_, text
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from pydantic import UUID4
 
-from database.engine import engine
-from database.utils import recipe_to_json, load_initial_data
+from datetime import datetime, timezone
+
+from database.utils import load_initial_data, encode_cursor, decode_cursor, to_db_timestamp
+from database.search import (
+    normalize_query, match_expression, search_statement, ranked_ids_statement, count_statement
+)
+from database.cache import recipe_cache, search_cache, LIST_TAG
+from database.writer import database_writer, execute_write, run_write
+from database.engine import read_router
+from database.ingredients import link_ingredients, normalize_ingredient, ingredient_ids_statement, by_ingredients_statement
+from database.jobs import job_queue, enqueue, INDEX_INGREDIENTS
+from database.changes import (
+    change_feed, changes_statement, oldest_seq_statement, prune_statement, ChangeLogTruncated
+)
 
 from modals import DBRecipeModal
 
+recipie = DBRecipeModal.__table__
+
+# stay well below SQLite's limit on bound parameters per statement
+MAX_PARAMETERS = 500
+
+# SQLite's planner prefers the primary key index, which would read the row as well
+SQLITE_VERSION_LOOKUP = text(
+    "SELECT version, updated_at FROM recipie INDEXED BY ix_recipie_id_version WHERE id = :recipe_id"
+).columns(recipie.c.version, recipie.c.updated_at)
+
+# read whatever fields are asked for: cursors need `(created_at, id)`, page ETags `(id, version)`
+KEY_COLUMNS = ("id", "created_at", "version")
+
+
+async def keyset_page(session: AsyncSession, query, cursor: str, limit: int):
+    '''
+        Fetch one page of `query` in `(created_at, id)` order starting after `cursor`.
+        Seeks straight to the cursor position through `ix_recipie_created_at_id_version`, so every
+        page costs the same no matter how deep it is. An empty cursor starts from the beginning.
+        One extra row is read to know whether there is a next page.
+    '''
+    if cursor:
+        created_at, recipe_id = decode_cursor(cursor)
+        query = query.where(
+            tuple_(recipie.c.created_at, recipie.c.id) > tuple_(created_at, recipe_id)
+        )
+    query = query.order_by(recipie.c.created_at, recipie.c.id).limit(limit + 1)
+
+    result = await session.execute(query)
+    rows = result.fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "items": rows,
+        "next_cursor": encode_cursor(rows[-1]) if has_more else None,
+        "has_more": has_more,
+    }
+
+
+def projection(fields: tuple[str, ...] | None):
+    '''
+    The `recipie` columns to select for `fields` (every column for None), in table order.
+    The `KEY_COLUMNS` are always selected, other columns only when asked for.
+    '''
+    if fields is None:
+        return list(recipie.c)
+    return [column for column in recipie.c if column.name in fields or column.name in KEY_COLUMNS]
+
+
+def page_key(page: int, limit: int, cursor: str | None, fields: tuple[str, ...] | None = None):
+    ''' `recipe_cache` key of a ` /recipes ` page (of the `fields` projection) '''
+    if cursor is None:
+        return ("recipes", page, limit, fields)
+    return ("recipes", "cursor", cursor, limit, fields)
+
+
+def cacheable(session: AsyncSession):
+    ''' Rows read from a replica may be behind the primary, they are returned but not cached '''
+    return not read_router.read_replica(session.info)
+
+
+def cache_page(session: AsyncSession, key, page, rows, generation: int):
+    '''
+    Cache a list page, tagged so that writes to any recipe on it invalidate it
+    `generation` is `recipe_cache.current()` from before the page was read
+    '''
+    if cacheable(session):
+        recipe_cache.set(key, page, tags=(LIST_TAG, *(row.id for row in rows)), generation=generation)
+
+
 class RecipiessFunction:
     
     @load_initial_data
-    def create_recipe(recipe: DBRecipeModal):
+    async def create_recipe(session: AsyncSession, recipe: DBRecipeModal):
         '''  
             Create new recipe 
             ```json
@@ -21,72 +109,451 @@ class RecipiessFunction:
                     "instructions": "Instructions",
                 }
             ```
+            Its ingredients are indexed by a job queued in the same transaction, see `database/jobs.py`
+            Returns the created row
         '''
-        with Session(engine) as session:
-            query = insert(DBRecipeModal).values(**recipe.dict())
-            result = session.execute(query)
-            session.commit()
-        return result
+        query = insert(DBRecipeModal).values(**recipe.dict(), updated_at=recipe.created_at).returning(*recipie.c)
+
+        async def write(conn):
+            result = await conn.execute(query)
+            created = result.one()
+            if recipe.ingredients:
+                await enqueue(conn, INDEX_INGREDIENTS, {"recipe_id": str(recipe.id)})
+            return created
+
+        created = await run_write(session, write)
+        recipe_cache.invalidate_tag(LIST_TAG)
+        search_cache.bump()
+        change_feed.notify()
+        job_queue.notify()
+        return created
+    
+    async def insert_recipe_batch(session: AsyncSession, rows: list[dict], given_ids: set[str]):
+        '''
+            Insert a batch of complete `recipie` rows with a single executemany, and their ingredient
+            postings with two more, committed like any other write (through the writer queue when it
+            runs). Rows whose id is in `given_ids` and already taken, in the table or earlier in the
+            batch, are skipped. The write lock is held while the batch is written, not while the
+            caller reads the next one. Returns the indexes in `rows` of the skipped rows.
+        '''
+        async def write(conn):
+            taken = await RecipiessFunction.existing_recipe_ids(conn, list(given_ids)) if given_ids else set()
+            fresh, skipped = [], []
+            for index, row in enumerate(rows):
+                if row["id"] in taken:
+                    skipped.append(index)
+                    continue
+                if row["id"] in given_ids:
+                    taken.add(row["id"])
+                fresh.append(row)
+            if fresh:
+                await conn.execute(insert(recipie), fresh)
+                await link_ingredients(conn, [(row["id"], row["ingredients"]) for row in fresh])
+            return skipped
+
+        if not database_writer.running:
+            # the id check and the insert in one write transaction, so no other writer commits in between
+            await session.rollback()
+            await session.connection(execution_options={"sqlite_begin": "IMMEDIATE"})
+        skipped = await run_write(session, write)
+        if len(skipped) < len(rows):
+            recipe_cache.invalidate_tag(LIST_TAG)
+            search_cache.bump()
+            change_feed.notify()
+        return skipped
+
+    async def existing_recipe_ids(session: AsyncSession, recipe_ids: list[str]):
+        ''' The subset of `recipe_ids` that is already taken '''
+        existing = set()
+        for start in range(0, len(recipe_ids), MAX_PARAMETERS):
+            chunk = recipe_ids[start:start + MAX_PARAMETERS]
+            result = await session.execute(select(recipie.c.id).where(recipie.c.id.in_(chunk)))
+            existing.update(result.scalars())
+        return existing
     
-    def get_all_recipes(page: int, limit: int):
+    async def get_all_recipes(
+        session: AsyncSession, page: int, limit: int, cursor: str | None = None, fields: tuple[str, ...] | None = None
+    ):
         '''
             Databse function to get all recipes and support pagination using 
             offset and limit functionality of sqlalchemy
+            When a `cursor` is given (empty string for the first page) the keyset
+            pagination is used instead, see `keyset_page`
+            With `fields` only those columns are read (see `projection`), not the whole rows
+            Pages are served from `recipe_cache` until a write touches them
         '''
-        
+        key = page_key(page, limit, cursor, fields)
+        cached = recipe_cache.get(key)
+        if cached is not None:
+            return cached
+        generation = recipe_cache.current()
+
+        if cursor is not None:
+            fetched_result = await keyset_page(session, select(*projection(fields)), cursor, limit)
+            cache_page(session, key, fetched_result, fetched_result["items"], generation)
+            return fetched_result
+
         offset = (page - 1) * limit
         
-        with engine.connect() as conn:
-            query = select(DBRecipeModal).limit(limit).offset(offset)
-            result = conn.execute(query)
-            rows = result.fetchall()
-            if not rows:
-                return {"message": "No recipes found"}
-            fetched_result = recipe_to_json(rows, many=True)
-        return fetched_result
+        query = (
+            select(*projection(fields))
+            .order_by(recipie.c.created_at, recipie.c.id)
+            .limit(limit).offset(offset)
+        )
+        result = await session.execute(query)
+        rows = result.fetchall()
+        if not rows:
+            fetched_result = {"message": "No recipes found"}
+            cache_page(session, key, fetched_result, [], generation)
+            return fetched_result
+        cache_page(session, key, rows, rows, generation)
+        return rows
     
-    def get_recipe_by_id(recipe_id: UUID4):
-        ''' Databse call to Get recipe by id '''
-        with engine.connect() as conn:
-            query = select(DBRecipeModal).where(DBRecipeModal.id == str(recipe_id))
-            result = conn.execute(query, {"id": recipe_id})
-            recpie = result.first()
-            if not recpie:
-                return {"message": "Recipe not found"}
-            fetched_result = recipe_to_json(recpie)
+    async def get_recipes_by_owner(session: AsyncSession, owner_id: UUID4, cursor: str, limit: int):
+        '''
+            Databse call to page through one owner's recipes, oldest first, with the keyset pagination
+            of `keyset_page` (an empty cursor starts from the beginning). The owner's part of
+            `ix_recipie_owner_id_created_at_id` is already in that order, so a page is a single seek.
+            Pages are served from `recipe_cache` until a write touches them, like ` /recipes ` pages
+        '''
+        key = ("owner_recipes", str(owner_id), cursor, limit)
+        cached = recipe_cache.get(key)
+        if cached is not None:
+            return cached
+        generation = recipe_cache.current()
+
+        query = select(recipie).where(recipie.c.owner_id == str(owner_id))
+        fetched_result = await keyset_page(session, query, cursor, limit)
+        cache_page(session, key, fetched_result, fetched_result["items"], generation)
         return fetched_result
+
+    async def get_page_versions(
+        session: AsyncSession, page: int, limit: int, cursor: str | None = None, fields: tuple[str, ...] | None = None
+    ):
+        '''
+            The same page as `get_all_recipes`, but only `(created_at, id, version)` of its recipes,
+            enough to work out the page's ETag. Read from `ix_recipie_created_at_id_version` alone,
+            or from `recipe_cache` when the page itself (of that `fields` projection) is cached.
+        '''
+        cached = recipe_cache.get(page_key(page, limit, cursor, fields))
+        if cached is not None:
+            return cached
+
+        query = select(recipie.c.created_at, recipie.c.id, recipie.c.version)
+        if cursor is not None:
+            return await keyset_page(session, query, cursor, limit)
+        query = query.order_by(recipie.c.created_at, recipie.c.id).limit(limit).offset((page - 1) * limit)
+        result = await session.execute(query)
+        rows = result.fetchall()
+        if not rows:
+            return {"message": "No recipes found"}
+        return rows
+
+    async def stream_recipes(
+        session: AsyncSession,
+        yield_per: int,
+        owner_id: UUID4 | None = None,
+        created_from: datetime | None = None,
+        created_to: datetime | None = None,
+    ):
+        '''
+            Databse call to walk the whole catalogue (or one owner's part of it / a `created_at` window)
+            through a server-side cursor, yields lists of at most `yield_per` rows in `(created_at, id)` order.
+            Only one partition is held in memory at a time.
+        '''
+        query = select(recipie).order_by(recipie.c.created_at, recipie.c.id)
+        if owner_id is not None:
+            query = query.where(recipie.c.owner_id == str(owner_id))
+        if created_from is not None:
+            query = query.where(recipie.c.created_at >= to_db_timestamp(created_from))
+        if created_to is not None:
+            query = query.where(recipie.c.created_at < to_db_timestamp(created_to))
+
+        result = await session.stream(query.execution_options(yield_per=yield_per))
+        async for rows in result.partitions():
+            yield rows
+
+    async def get_recipe_by_id(session: AsyncSession, recipe_id: UUID4):
+        ''' Databse call to Get recipe by id, served from `recipe_cache` when possible '''
+        key = ("recipe", str(recipe_id))
+        cached = recipe_cache.get(key)
+        if cached is not None:
+            return cached
+        # a write committing while this reads must not leave the row read before it cached
+        generation = recipe_cache.current()
+
+        query = select(recipie).where(recipie.c.id == str(recipe_id))
+        result = await session.execute(query)
+        recpie = result.first()
+        if not recpie:
+            return {"message": "Recipe not found"}
+        if cacheable(session):
+            recipe_cache.set(key, recpie, tags=(str(recipe_id),), generation=generation)
+        return recpie
+
+    async def get_recipes_by_ids(session: AsyncSession, recipe_ids: list[UUID4]):
+        '''
+            Databse call to Get many recipes by id, in the order asked for (repeated ids once).
+            Recipes in `recipe_cache` are taken from it, the others are read with
+            ` WHERE id IN (...) ` in chunks of `MAX_PARAMETERS` and cached like `get_recipe_by_id` does.
+            Returns `{"items": rows, "missing": ids that do not exist}`
+        '''
+        wanted = list(dict.fromkeys(str(recipe_id) for recipe_id in recipe_ids))
+        found = {}
+        for recipe_id in wanted:
+            cached = recipe_cache.get(("recipe", recipe_id))
+            if cached is not None:
+                found[recipe_id] = cached
+
+        to_read = [recipe_id for recipe_id in wanted if recipe_id not in found]
+        generation = recipe_cache.current()
+        for start in range(0, len(to_read), MAX_PARAMETERS):
+            chunk = to_read[start:start + MAX_PARAMETERS]
+            result = await session.execute(select(recipie).where(recipie.c.id.in_(chunk)))
+            for row in result:
+                found[row.id] = row
+                if cacheable(session):
+                    recipe_cache.set(("recipe", row.id), row, tags=(row.id,), generation=generation)
+
+        return {
+            "items": [found[recipe_id] for recipe_id in wanted if recipe_id in found],
+            "missing": [recipe_id for recipe_id in wanted if recipe_id not in found],
+        }
+
+    async def get_recipe_version(session: AsyncSession, recipe_id: UUID4):
+        '''
+            `(version, updated_at)` of a recipe, None when it does not exist. Taken from the cached
+            recipe when there is one, otherwise read from `ix_recipie_id_version` without touching the row.
+        '''
+        cached = recipe_cache.get(("recipe", str(recipe_id)))
+        if cached is not None:
+            return cached
+        if session.get_bind().dialect.name == "sqlite":
+            query = SQLITE_VERSION_LOOKUP.bindparams(recipe_id=str(recipe_id))
+        else:
+            query = select(recipie.c.version, recipie.c.updated_at).where(recipie.c.id == str(recipe_id))
+        result = await session.execute(query)
+        return result.first()
     
-    def update_recipe(recipe_id: UUID4, recipe: DBRecipeModal):
-        ''' Databse call to Update recipe by id '''
-        with Session(engine) as session:
-            recipe_dict = {key: value for key, value in recipe.dict().items() if value is not None}
-            query = update(DBRecipeModal).where(DBRecipeModal.id == str(recipe_id)).values(**recipe_dict)
-            result = session.execute(query)
-            session.commit()
-        return result
+    async def update_recipe(
+        session: AsyncSession,
+        recipe_id: UUID4,
+        recipe: DBRecipeModal,
+        owner_id: UUID4 | None = None,
+        expected_versions: list[int] | None = None,
+    ):
+        ''' 
+            Databse call to Update recipe by id, bumps its `version` and `updated_at`
+            With `owner_id` only a recipe of that owner is updated, with `expected_versions` only
+            a recipe currently at one of those versions (` If-Match `).
+            New `ingredients` queue a job replacing its ingredient postings, in the same transaction.
+            Returns the new `(version, updated_at)`, None when nothing was updated
+        '''
+        recipe_dict = {key: value for key, value in recipe.dict().items() if value is not None}
+        query = (
+            update(DBRecipeModal)
+            .where(DBRecipeModal.id == str(recipe_id))
+            .values(
+                **recipe_dict,
+                version=DBRecipeModal.version + 1,
+                updated_at=to_db_timestamp(datetime.now(timezone.utc)),
+            )
+            .returning(DBRecipeModal.version, DBRecipeModal.updated_at)
+        )
+        if owner_id is not None:
+            query = query.where(DBRecipeModal.owner_id == str(owner_id))
+        if expected_versions is not None:
+            query = query.where(DBRecipeModal.version.in_(expected_versions))
+
+        async def write(conn):
+            result = await conn.execute(query)
+            updated = result.first()
+            if updated is not None and recipe.ingredients is not None:
+                await enqueue(conn, INDEX_INGREDIENTS, {"recipe_id": str(recipe_id)})
+            return updated
+
+        updated = await run_write(session, write)
+        if updated is not None:
+            # the recipe itself and only the list pages it appears on
+            recipe_cache.invalidate_tag(str(recipe_id))
+            search_cache.bump()
+            change_feed.notify()
+            job_queue.notify()
+        return updated
     
     
-    def delete_recipe(recipe_id: UUID4):
-        ''' Databse call to Delete recipe by id '''
-        with Session(engine) as session:
-            query = delete(DBRecipeModal).where(DBRecipeModal.id == str(recipe_id))
-            session.execute(query)
-            session.commit()
+    async def delete_recipe(session: AsyncSession, recipe_id: UUID4, owner_id: UUID4 | None = None):
+        ''' 
+            Databse call to Delete recipe by id 
+            With `owner_id` only a recipe of that owner is deleted, `success` tells whether it was
+        '''
+        query = delete(DBRecipeModal).where(DBRecipeModal.id == str(recipe_id))
+        if owner_id is not None:
+            query = query.where(DBRecipeModal.owner_id == str(owner_id))
+        result = await execute_write(session, query)
+        if not result.rowcount:
+            return {"success": False}
+        # removing a row shifts every later page, so all list pages go
+        recipe_cache.invalidate_tag(str(recipe_id))
+        recipe_cache.invalidate_tag(LIST_TAG)
+        search_cache.bump()
+        change_feed.notify()
         return {"success": True}
     
-    def search_recipies(query: str, page: int, limit: int):
-        ''' Databse call to Search recipes in the database (name, ingredients, instructions) '''
+    async def search_recipies(
+        session: AsyncSession,
+        query: str,
+        page: int,
+        limit: int,
+        cursor: str | None = None,
+        fields: tuple[str, ...] | None = None,
+    ):
+        '''
+            Databse call to Search recipes in the database (name, ingredients, instructions)
+            Goes through the `recipie_fts` full-text index, every term of the normalized query is
+            matched as a prefix and results are ordered by BM25 rank (best match first).
+            Each result carries a `snippet` with the matched words wrapped in `<mark>` tags.
+            Pages within the first `search_cache.max_ids` matches are cut from the ranked ids of
+            `search_matches` and their rows read by id, deeper pages are ranked by the query itself.
+            With a `cursor` the matches are paged in `(created_at, id)` order instead of rank.
+            With `fields` only those columns are read, and the snippet is only built when
+            `snippet` is one of them.
+        '''
+        terms = normalize_query(query)
+        if not terms:
+            return await RecipiessFunction.get_all_recipes(session, page, limit, cursor, fields)
+
+        match_query = match_expression(terms)
+        columns = projection(fields)
+        snippet = fields is None or "snippet" in fields
+        statement = search_statement(match_query, columns, snippet=snippet)
+        if cursor is not None:
+            return await keyset_page(session, statement, cursor, limit)
+
         offset = (page - 1) * limit
-        
-        with engine.connect() as conn:
-            query = select(DBRecipeModal).where(
-                DBRecipeModal.name.ilike(f"%{query}%") |
-                DBRecipeModal.ingredients.ilike(f"%{query}%") |
-                DBRecipeModal.instructions.ilike(f"%{query}%")
-            ).limit(limit).offset(offset)
-            result = conn.execute(query)
-            rows = result.fetchall()
-            if not rows:
+        if search_cache.enabled and offset + limit <= search_cache.max_ids:
+            ids, _ = await RecipiessFunction.search_matches(session, terms)
+            page_ids = ids[offset:offset + limit]
+            if not page_ids:
                 return {"message": "No recipes found"}
-            fetched_result = recipe_to_json(rows, many=True)
-        return fetched_result
\ No newline at end of file
+            if snippet:
+                # the snippet needs the MATCH (the index seeks each id), it is neither ranked nor sorted though
+                rows = statement.where(recipie.c.id.in_(page_ids))
+            else:
+                rows = select(*columns).where(recipie.c.id.in_(page_ids))
+            result = await session.execute(rows)
+            found = {row.id: row for row in result}
+            return [found[recipe_id] for recipe_id in page_ids if recipe_id in found]
+
+        query = (
+            statement
+            .order_by("rank", recipie.c.created_at, recipie.c.id)
+            .limit(limit).offset(offset)
+        )
+        result = await session.execute(query)
+        rows = result.fetchall()
+        if not rows:
+            return {"message": "No recipes found"}
+        return rows
+
+    async def search_matches(session: AsyncSession, terms: tuple[str, ...]):
+        '''
+            `(ids, total)` of a normalized query: the ids of its first `search_cache.max_ids` matches
+            by rank and its number of matches, from `search_cache` while no recipe was written since.
+            The matches are only counted when there are more than the ids read.
+        '''
+        cached = search_cache.get(terms)
+        if cached is not None:
+            return cached
+
+        generation = search_cache.current()
+        match_query = match_expression(terms)
+        result = await session.execute(ranked_ids_statement(match_query, search_cache.max_ids))
+        ids = tuple(result.scalars())
+        total = len(ids)
+        if total >= search_cache.max_ids:
+            result = await session.execute(count_statement(match_query))
+            total = result.scalar_one()
+        if cacheable(session):
+            search_cache.set(terms, generation, ids, total)
+        return ids, total
+
+    async def count_search_matches(session: AsyncSession, query: str):
+        ''' The number of recipes a search finds, None for a query with nothing searchable in it '''
+        terms = normalize_query(query)
+        if not terms:
+            return None
+        if search_cache.enabled:
+            _, total = await RecipiessFunction.search_matches(session, terms)
+            return total
+        result = await session.execute(count_statement(match_expression(terms)))
+        return result.scalar_one()
+
+    async def get_recipes_by_ingredients(
+        session: AsyncSession,
+        include_all: list[str],
+        include_any: list[str],
+        exclude: list[str],
+        page: int,
+        limit: int,
+    ):
+        '''
+            Databse call to find recipes by their ingredients, see `database/ingredients.py`
+            The names are normalized like the recipes' are, then resolved to ingredient ids. A name
+            of `include_all` nobody uses means no recipe can match, unknown other names are ignored.
+            Returns `(recipe row, matches)` pairs, most asked-for ingredients first
+        '''
+        names = {
+            key: list(dict.fromkeys(filter(None, map(normalize_ingredient, values))))
+            for key, values in (("all", include_all), ("any", include_any), ("exclude", exclude))
+        }
+        if not names["all"] and not names["any"]:
+            raise ValueError("Give at least one ingredient to include")
+
+        known = [name for values in names.values() for name in values]
+        result = await session.execute(ingredient_ids_statement(known))
+        ids = dict(result.fetchall())
+        if any(name not in ids for name in names["all"]):
+            return {"message": "No recipes found"}
+        resolved = {key: [ids[name] for name in values if name in ids] for key, values in names.items()}
+        if not resolved["all"] and not resolved["any"]:
+            return {"message": "No recipes found"}
+
+        query = (
+            by_ingredients_statement(resolved["all"], resolved["any"], resolved["exclude"])
+            .limit(limit).offset((page - 1) * limit)
+        )
+        result = await session.execute(query)
+        ranked = result.fetchall()
+        if not ranked:
+            return {"message": "No recipes found"}
+
+        recipes = await RecipiessFunction.get_recipes_by_ids(session, [row.recipe_id for row in ranked])
+        found = {recipe.id: recipe for recipe in recipes["items"]}
+        return [(found[row.recipe_id], row.matches) for row in ranked if row.recipe_id in found]
+
+    async def get_changes(session: AsyncSession, since: int, limit: int):
+        '''
+            Databse call to read the change log after `since`, oldest first, see `database/changes.py`.
+            Each change comes with the current state of its recipe (the row's `recipe__` columns).
+            Returns `{"items": rows, "last_seq": seq to continue from, "has_more": ...}`,
+            raises `ChangeLogTruncated` when changes after `since` were already pruned
+        '''
+        result = await session.execute(changes_statement(since, limit + 1))
+        rows = result.fetchall()
+        if since and rows and rows[0].seq > since + 1:
+            # `seq` has no gaps of its own (a rolled back insert rolls the sequence back too)
+            oldest = (await session.execute(oldest_seq_statement())).scalar()
+            if oldest is not None and oldest > since + 1:
+                raise ChangeLogTruncated(
+                    f"Changes after {since} are no longer kept, resync from /recipes and continue from the latest seq"
+                )
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        return {"items": rows, "last_seq": rows[-1].seq if rows else since, "has_more": has_more}
+
+    async def prune_changes(session: AsyncSession, before: str):
+        ''' Databse call to drop the changes older than `before`, returns how many were dropped '''
+        result = await execute_write(session, prune_statement(before))
+        return result.rowcount
@@ -0,0 +1,178 @@
+'''
+Read replica routing with read-your-writes stickiness.
+
+With `DATABASE_REPLICA_URLS` set, the sessions of `database/engine.py` (`RoutingSession`) send
+their `SELECT`s to one of the replica engines and everything else to the primary. A replica may
+lag behind, so whoever just wrote reads from the primary for `ReplicaConfig.sticky_seconds`:
+- a session that wrote reads from the primary for the rest of its life
+- the request's client (its bearer token and its address, see `request_keys`) is pinned to the
+  primary for the window. Pins are kept per worker (`LocalPins`) or, with
+  `REPLICA_STICKY_BACKEND=shared`, in a memory-mapped table all the workers of the host share
+  (`SharedPins`), since the client's next request may land on another worker.
+
+Other clients may read a recipe from a lagging replica. What a session read from a replica is
+not put in the caches of `database/cache.py` (`ReadRouter.read_replica`): a lagging copy would
+be served from them to every client, after the invalidations of the writes it misses. Locally, replicas are copies of the SQLite file made with
+` python manage.py copy-database `.
+'''
+
+import os
+import time
+import fcntl
+import random
+import struct
+import hashlib
+from collections import OrderedDict
+
+from config import ReplicaConfig
+from clients import client_id
+from database.cache import open_shared_map
+
+
+def key_hash(key: str):
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little") or 1
+
+
+def request_keys(request):
+    ''' What a request's client is pinned by: its bearer token (hashed) and its address, see `clients.client_id` '''
+    keys = [f"client:{client_id(request)}"]
+    authorization = request.headers.get("authorization")
+    if authorization:
+        keys.append(f"token:{hashlib.blake2b(authorization.encode(), digest_size=16).hexdigest()}")
+    return tuple(keys)
+
+
+class LocalPins:
+    ''' Pin deadlines of this worker, the oldest beyond `max_keys` are dropped '''
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self._deadlines = OrderedDict()  # key -> deadline
+
+    def pin(self, keys, deadline: float):
+        for key in keys:
+            self._deadlines.pop(key, None)
+            self._deadlines[key] = deadline
+        while len(self._deadlines) > self.max_keys:
+            self._deadlines.popitem(last=False)
+
+    def pinned(self, keys, now: float):
+        return any(self._deadlines.get(key, 0.0) > now for key in keys)
+
+
+class SharedPins:
+    '''
+    Pin deadlines in a memory-mapped hash table shared by the workers of the host.
+    A slot holds a 64 bit hash of the key and its deadline (wall clock), a key is looked for in
+    `PROBES` slots from its hash and takes the one that expired first when it has none.
+    '''
+    SLOT = struct.Struct("<Qd")
+    PROBES = 8
+
+    def __init__(self, path: str, slots: int):
+        self.path = path
+        self.slots = slots
+        self._pid = None
+
+    def _open(self):
+        if self._pid != os.getpid():
+            self._fd, self._map = open_shared_map(self.path, self.slots * self.SLOT.size)
+            self._pid = os.getpid()
+
+    def _offsets(self, hashed: int):
+        return [((hashed + probe) % self.slots) * self.SLOT.size for probe in range(self.PROBES)]
+
+    def pin(self, keys, deadline: float):
+        self._open()
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            for key in keys:
+                hashed = key_hash(key)
+                target = None
+                for offset in self._offsets(hashed):
+                    slot_hash, slot_deadline = self.SLOT.unpack_from(self._map, offset)
+                    if slot_hash == hashed:
+                        target = offset
+                        break
+                    if target is None or slot_deadline < self.SLOT.unpack_from(self._map, target)[1]:
+                        target = offset
+                self.SLOT.pack_into(self._map, target, hashed, deadline)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def pinned(self, keys, now: float):
+        self._open()
+        # a torn read of a slot at worst misses a pin, the lock is only taken to write
+        for key in keys:
+            hashed = key_hash(key)
+            for offset in self._offsets(hashed):
+                slot_hash, deadline = self.SLOT.unpack_from(self._map, offset)
+                if slot_hash == hashed:
+                    if deadline > now:
+                        return True
+                    break
+        return False
+
+
+def pins_backend():
+    if ReplicaConfig.sticky_backend == "shared":
+        return SharedPins(ReplicaConfig.sticky_shared_path, ReplicaConfig.sticky_max_clients)
+    if ReplicaConfig.sticky_backend != "local":
+        raise ValueError(f"Unknown REPLICA_STICKY_BACKEND {ReplicaConfig.sticky_backend!r}, use local or shared")
+    return LocalPins(ReplicaConfig.sticky_max_clients)
+
+
+class ReadRouter:
+    '''
+    Picks the engine a session reads from. The state of a session is kept in its `info`:
+    `read_keys` of the request it serves, `primary` once it has to read from the primary,
+    `replica` the replica it reads from otherwise (one per session, its reads see one copy)
+    '''
+    def __init__(self, replicas: list, pins, sticky_seconds: float):
+        self.replicas = replicas
+        self.pins = pins
+        self.sticky_seconds = sticky_seconds
+        self.replica_reads = 0
+        self.primary_reads = 0
+        self.pinned_sessions = 0
+
+    @property
+    def enabled(self):
+        return bool(self.replicas)
+
+    def open_session(self, info: dict, keys):
+        ''' Start routing a request's session, pinned to the primary while its client is '''
+        info["read_keys"] = keys
+        if keys and self.pins.pinned(keys, time.time()):
+            info["primary"] = True
+            self.pinned_sessions += 1
+
+    def read_engine(self, info: dict):
+        ''' The replica to read from, None for the primary '''
+        if info.get("primary"):
+            self.primary_reads += 1
+            return None
+        self.replica_reads += 1
+        if "replica" not in info:
+            info["replica"] = random.choice(self.replicas)
+        return info["replica"]
+
+    def read_replica(self, info: dict):
+        ''' Whether the session read from a replica, what it read may be behind the primary '''
+        return "replica" in info
+
+    def wrote(self, info: dict):
+        ''' A write went through the session: it and its client read from the primary from now on '''
+        if not self.enabled:
+            return
+        info["primary"] = True
+        keys = info.get("read_keys")
+        if keys:
+            self.pins.pin(keys, time.time() + self.sticky_seconds)
+
+    def stats(self):
+        return {
+            "replicas": len(self.replicas),
+            "replica_reads": self.replica_reads,
+            "primary_reads": self.primary_reads,
+            "pinned_sessions": self.pinned_sessions,
+        }
@@ -0,0 +1,193 @@
+'''
+Full-text search index for recipes (SQLite FTS5).
+
+`recipie_fts` is an external-content FTS5 table over `recipie.name`, `recipie.ingredients`
+and `recipie.instructions`. Triggers on `recipie` keep it in sync on every insert, update
+and delete, so the data functions never have to touch the index directly.
+The table and triggers are created by the `m0002_search_index` migration (with a copy of the DDL
+as it was then, `m0004_recipe_versions` narrows the update trigger to `FTS_UPDATE_TRIGGER`).
+
+Queries are normalized (`normalize_query`) before they are matched, so every spelling of a query
+that finds the same recipes is one query to `search_cache` (see `database/cache.py`).
+
+The index is keyed on the implicit `rowid` of `recipie`, which a `VACUUM` (or `VACUUM INTO`) is
+free to renumber. ` python manage.py vacuum ` and ` python manage.py copy-database ` check the
+index against the table afterwards and rebuild it when the rowids moved (`repair_index`).
+After a `VACUUM` run by other means, rebuild it by hand:
+```bash
+python manage.py rebuild-search-index
+```
+'''
+
+import re
+import sqlite3
+
+from sqlalchemy import DDL, func, literal_column, select, table, column
+
+from modals import DBRecipeModal
+
+FTS_TABLE = "recipie_fts"
+
+# name matches weigh more than ingredients, which weigh more than instructions
+BM25_WEIGHTS = (10.0, 5.0, 1.0)
+SNIPPET_START = "<mark>"
+SNIPPET_END = "</mark>"
+SNIPPET_ELLIPSIS = "..."
+SNIPPET_TOKENS = 12
+
+# only edits of the indexed columns touch the index, version bumps and backfills do not
+FTS_UPDATE_TRIGGER = f'''
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF name, ingredients, instructions ON recipie BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, ingredients, instructions)
+        VALUES ('delete', old.rowid, old.name, old.ingredients, old.instructions);
+        INSERT INTO {FTS_TABLE}(rowid, name, ingredients, instructions)
+        VALUES (new.rowid, new.name, new.ingredients, new.instructions);
+    END
+'''
+
+REBUILD = f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"
+# fails with SQLITE_CORRUPT_VTAB when an indexed rowid is missing from `recipie` or holds other text
+INTEGRITY_CHECK = f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rank) VALUES ('integrity-check', 1)"
+
+FTS_DDL = [
+    f'''
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        name, ingredients, instructions,
+        content='recipie', content_rowid='rowid',
+        tokenize='porter unicode61'
+    )
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON recipie BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, ingredients, instructions)
+        VALUES (new.rowid, new.name, new.ingredients, new.instructions);
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON recipie BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, ingredients, instructions)
+        VALUES ('delete', old.rowid, old.name, old.ingredients, old.instructions);
+    END
+    ''',
+    FTS_UPDATE_TRIGGER,
+]
+
+recipie_fts = table(FTS_TABLE, column("rowid"))
+_fts = literal_column(FTS_TABLE)
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+_ASCII_WORD = re.compile(r"[a-z]+")
+
+# the porter tokenizer leaves shorter (and longer) tokens alone
+PORTER_MIN_LENGTH = 3
+PORTER_MAX_LENGTH = 64
+
+
+def fold_plural(term: str):
+    '''
+    The first step of the Porter stemmer (` sses ` -> ` ss `, ` ies ` -> ` i `, ` s ` -> nothing) on
+    an ASCII word. The porter tokenizer stems the query terms with the same step before any other,
+    so a folded term matches exactly what the term did: ` tomatoes ` -> ` tomatoe `, both find tomato
+    '''
+    if not PORTER_MIN_LENGTH <= len(term) <= PORTER_MAX_LENGTH or not _ASCII_WORD.fullmatch(term):
+        return term
+    if term.endswith("sses"):
+        return term[:-2]
+    if term.endswith("ies"):
+        return term[:-2]
+    if term.endswith("s") and not term.endswith("ss"):
+        return term[:-1]
+    return term
+
+
+def normalize_query(query: str):
+    '''
+    The terms of a free text query as the index sees them: lower case, plural endings folded,
+    each term once, sorted (all terms must match, their order does not change the matches or their rank)
+    ` Chicken  CURRIES chicken ` -> ` ("chicken", "curri") `
+    '''
+    terms = {fold_plural(term) for term in _TOKEN.findall((query or "").lower())}
+    return tuple(sorted(terms))
+
+
+def build_match_query(query: str):
+    '''
+    Turn free text from the user into an FTS5 MATCH expression.
+    Every term of the normalized query becomes a quoted prefix term, and all terms must match
+    ` chicken curr ` -> ` "chicken"* "curr"* `
+    Returns None when the query has nothing searchable in it.
+    '''
+    return match_expression(normalize_query(query))
+
+
+def match_expression(terms: tuple[str, ...]):
+    ''' The MATCH expression of `normalize_query` terms, None for no terms '''
+    if not terms:
+        return None
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+def search_statement(match_query: str, columns=None, snippet: bool = True):
+    '''
+    Select recipes matching the FTS query (all their columns, or only `columns`),
+    with a highlighted snippet (unless `snippet` is False) and their BM25 rank
+    '''
+    recipie = DBRecipeModal.__table__
+    rank = func.bm25(_fts, *BM25_WEIGHTS).label("rank")
+    selected = list(recipie.c if columns is None else columns)
+    if snippet:
+        selected.append(func.snippet(
+            _fts, -1, SNIPPET_START, SNIPPET_END, SNIPPET_ELLIPSIS, SNIPPET_TOKENS
+        ).label("snippet"))
+
+    return (
+        select(*selected, rank)
+        .select_from(recipie)
+        .join(recipie_fts, recipie_fts.c.rowid == literal_column("recipie.rowid"))
+        .where(_fts.op("MATCH")(match_query))
+    )
+
+
+def ranked_ids_statement(match_query: str, limit: int):
+    ''' The ids of the first `limit` recipes matching the FTS query, best match first '''
+    recipie = DBRecipeModal.__table__
+    return (
+        select(recipie.c.id)
+        .select_from(recipie)
+        .join(recipie_fts, recipie_fts.c.rowid == literal_column("recipie.rowid"))
+        .where(_fts.op("MATCH")(match_query))
+        .order_by(func.bm25(_fts, *BM25_WEIGHTS), recipie.c.created_at, recipie.c.id)
+        .limit(limit)
+    )
+
+
+def count_statement(match_query: str):
+    ''' The number of recipes matching the FTS query, counted on the index alone '''
+    return select(func.count()).select_from(recipie_fts).where(_fts.op("MATCH")(match_query))
+
+
+def create_index(conn):
+    ''' Create the FTS table and its sync triggers if they do not exist yet '''
+    for statement in FTS_DDL:
+        conn.execute(DDL(statement))
+
+
+def rebuild_index(conn):
+    ''' One-shot backfill: re-read every row of `recipie` into the index '''
+    create_index(conn)
+    conn.exec_driver_sql(REBUILD)
+
+
+def repair_index(conn: sqlite3.Connection):
+    '''
+    Rebuild the index of the `sqlite3` connection's database when it no longer matches the rowids
+    of `recipie`, returns whether it had to
+    '''
+    try:
+        conn.execute(INTEGRITY_CHECK)
+        return False
+    except sqlite3.DatabaseError:
+        conn.execute(REBUILD)
+        conn.commit()
+        return True
+
@@ -1,32 +1,36 @@
 from sqlalchemy import insert, select, update, delete, func
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from pydantic import UUID4
 
 from modals import DBUserModal
-from database.engine import engine
 from database.utils import load_initial_data
+from database.writer import execute_write
+
+user_account = DBUserModal.__table__
 
 class UserFunction:
-    def get_user_by_email(email: str):
+    async def get_user_by_email(session: AsyncSession, email: str):
         ''' Dababase call to Get user by email '''
-        with engine.connect() as conn:
-            query = select(DBUserModal).where(DBUserModal.email == email)
-            result = conn.execute(query, {"email": email})
+        query = select(user_account).where(user_account.c.email == email)
+        result = await session.execute(query)
         return result.first()
 
-    def get_user_by_id(user_id: UUID4):
+    async def get_user_by_id(session: AsyncSession, user_id: UUID4):
         ''' Database call to Get user by id '''
-        with engine.connect() as conn:
-            query = select(DBUserModal).where(DBUserModal.id == str(user_id))       
-            result = conn.execute(query, {"id": user_id})
+        query = select(user_account).where(user_account.c.id == str(user_id))
+        result = await session.execute(query)
         return result.first()
 
     @load_initial_data
-    def create_user(user: DBUserModal):
+    async def create_user(session: AsyncSession, user: DBUserModal):
         ''' Databse call to Create new user '''
-        with Session(engine) as session:
-            query = insert(DBUserModal).values(**user.dict())
-            result = session.execute(query)
-            session.commit()
-        return result
\ No newline at end of file
+        query = insert(DBUserModal).values(**user.dict())
+        result = await execute_write(session, query)
+        return result
+
+    async def update_password(session: AsyncSession, user_id: UUID4, password: str):
+        ''' Databse call to replace the password hash of a user '''
+        query = update(DBUserModal).where(DBUserModal.id == str(user_id)).values(password=password)
+        result = await execute_write(session, query)
+        return result
@@ -1,36 +1,51 @@
+import json
 import uuid
+import base64
+import binascii
 from datetime import datetime, timezone
 
-def recipe_to_json(recipes, many=False):
-    '''
-    Function to convert recipe object to json
-    '''
-    if not many:
-        return {
-            "id": recipes.id,
-            "name": recipes.name,
-            "ingredients": recipes.ingredients,
-            "instructions": recipes.instructions,
-            "owner_id": recipes.owner_id,
-            "created_at": recipes.created_at,
-        }    
-    return [{
-        "id": recipe.id,
-        "name": recipe.name,
-        "ingredients": recipe.ingredients,
-        "instructions": recipe.instructions,
-        "owner_id": recipe.owner_id,
-        "created_at": recipe.created_at,
-    } for recipe in recipes]
-    
+def to_db_timestamp(value: datetime):
+    '''
+    `created_at` as it is stored (UTC, ` YYYY-MM-DD HH:MM:SS.ffffff+00:00 `), so timestamps
+    can be compared with the column directly. Naive datetimes are taken as UTC.
+    '''
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return str(value.astimezone(timezone.utc))
+
+
+def encode_cursor(recipe):
+    '''
+    Opaque pagination cursor pointing just after `recipe`
+    (urlsafe base64 of its `created_at` and `id`)
+    '''
+    position = json.dumps([str(recipe.created_at), str(recipe.id)], separators=(",", ":"))
+    return base64.urlsafe_b64encode(position.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    '''
+    Reverse of `encode_cursor`, returns `(created_at, id)`
+    Raises ValueError when the cursor was not produced by `encode_cursor`
+    '''
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, recipe_id = json.loads(base64.urlsafe_b64decode(padded))
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(created_at, str) or not isinstance(recipe_id, str):
+        raise ValueError("Invalid cursor")
+    return created_at, recipe_id
+
 
 def load_initial_data(function):
     '''
     Decorator to load initial data
+    (the data functions take the session first and the model to create second)
     '''
-    def wrapper(*args, **kwargs):
-        args[0].id = str(uuid.uuid4())
-        args[0].created_at = datetime.now(timezone.utc)
-        return function(*args, **kwargs)
+    def wrapper(session, model, *args, **kwargs):
+        model.id = str(uuid.uuid4())
+        model.created_at = datetime.now(timezone.utc)
+        return function(session, model, *args, **kwargs)
         
     return wrapper
\ No newline at end of file
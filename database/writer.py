@@ -0,0 +1,229 @@
+'''
+Single-writer queue with group commit.
+
+SQLite allows one writer at a time. Instead of every request opening its own write transaction
+and fighting over the lock, writes are queued and a single task applies them: it takes every
+write that is waiting (up to `SQLiteConfig.writer_max_batch`), runs each in its own savepoint
+inside one `BEGIN IMMEDIATE` transaction and commits them all at once, so one commit (and one
+WAL sync) is paid per group instead of per write. A write that fails only rolls back its own
+savepoint, the others of the group still commit. A group ended by anything else (a write raising
+`CancelledError`) is rolled back and its writes fail with `WriteAborted`, the queue keeps going.
+
+The writer has an engine of its own holding a single connection. Requests waiting for their
+write to be committed keep their pooled connection, sharing the pool with them could leave the
+writer without one.
+
+The data functions go through `execute_write` (one statement) or `run_write` (a unit of work of
+several statements, applied in the same savepoint), which fall back to the request's session when
+the queue is not running (other databases, the CLI, or the queue switched off). Writes made for no
+request (background jobs, idempotency keys) go through `commit_write`.
+'''
+
+import asyncio
+import time
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import DatabaseConfig, SQLiteConfig
+from database.engine import engine, build_engine, read_router
+
+_STOP = object()
+
+
+class WriteAborted(RuntimeError):
+    ''' The group a write was part of was neither committed nor rolled back by an `Exception` '''
+
+
+class WriteJob:
+    def __init__(self, work):
+        self.work = work
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class DatabaseWriter:
+    def __init__(self, max_batch: int, max_delay: float):
+        self.engine = None
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.writes = 0
+        self.failed = 0
+        self.commits = 0
+        self.commit_seconds = 0.0
+        self._queue = None
+        self._task = None
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        ''' Start the writer task on the running event loop '''
+        if self.running:
+            return
+        if self.engine is None:
+            self.engine = build_engine(pool_size=1, max_overflow=0)
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run(), name="database-writer")
+
+    async def stop(self):
+        ''' Finish the writes already queued, then stop '''
+        if not self.running:
+            return
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+        await self.engine.dispose()
+
+    async def run(self, work):
+        '''
+        Queue a unit of work, `async def work(conn)` running its statements on `conn`,
+        and wait until the group it is part of has been committed. Returns what `work` returned.
+        '''
+        if not self.running:
+            raise WriteAborted("The database writer is not running")
+        job = WriteJob(work)
+        await self._queue.put(job)
+        return await job.future
+
+    async def execute(self, statement, params=None):
+        ''' Queue a single statement, see `run` '''
+        return await self.run(lambda conn: conn.execute(statement, params))
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "writes": self.writes,
+            "failed": self.failed,
+            "commits": self.commits,
+            "writes_per_commit": self.writes / self.commits if self.commits else 0.0,
+            "commit_seconds": self.commit_seconds,
+        }
+
+    async def _run(self):
+        try:
+            await self._loop()
+        finally:
+            # stopped by a cancellation: nothing still queued will be written
+            while not self._queue.empty():
+                job = self._queue.get_nowait()
+                if job is not _STOP and not job.future.done():
+                    self.failed += 1
+                    job.future.set_exception(WriteAborted("The database writer stopped"))
+
+    async def _loop(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            first = await self._queue.get()
+            if first is _STOP:
+                break
+            batch = [first]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                try:
+                    job = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        job = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if job is _STOP:
+                    stopping = True
+                    break
+                batch.append(job)
+            await self._commit(batch)
+
+    async def _commit(self, batch):
+        '''
+        Write and commit a group, then resolve the future of every write in it. Only the
+        cancellation of the writer itself (or the process exiting) is raised, once the futures are failed.
+        '''
+        started = time.perf_counter()
+        results = []
+        fatal = None
+        try:
+            async with self.engine.connect() as conn:
+                conn = await conn.execution_options(sqlite_begin="IMMEDIATE")
+                async with conn.begin():
+                    for job in batch:
+                        try:
+                            async with conn.begin_nested():
+                                results.append(await job.work(conn))
+                        except Exception as error:
+                            results.append(error)
+        except Exception as error:
+            # the commit itself failed, none of the group was written
+            results = [error] * len(batch)
+        except BaseException as error:
+            # e.g. a CancelledError out of a write: the transaction was rolled back
+            aborted = WriteAborted(f"The write group was aborted: {error!r}")
+            aborted.__cause__ = error
+            results = [aborted] * len(batch)
+            if not isinstance(error, asyncio.CancelledError) or asyncio.current_task().cancelling():
+                fatal = error
+        else:
+            self.commits += 1
+            self.commit_seconds += time.perf_counter() - started
+
+        for job, result in zip(batch, results):
+            if job.future.done():
+                continue
+            if isinstance(result, Exception):
+                self.failed += 1
+                job.future.set_exception(result)
+            else:
+                self.writes += 1
+                job.future.set_result(result)
+        if fatal is not None:
+            raise fatal
+
+
+database_writer = DatabaseWriter(SQLiteConfig.writer_max_batch, SQLiteConfig.writer_max_delay)
+
+
+def writer_enabled():
+    ''' The queue is for file SQLite databases, an in-memory one can not be shared with a second engine '''
+    return (
+        SQLiteConfig.writer_queue
+        and engine.dialect.name == "sqlite"
+        and ":memory:" not in DatabaseConfig.url
+    )
+
+
+async def run_write(session: AsyncSession, work):
+    '''
+    Run and commit a unit of work, `async def work(conn)` executing its statements on `conn`:
+    the writer's connection (inside a savepoint of its group) when the queue is running,
+    `session` otherwise. Returns what `work` returned.
+    '''
+    if database_writer.running:
+        # the queue writes on a connection of its own, the session would not see it
+        read_router.wrote(session.info)
+        return await database_writer.run(work)
+    result = await work(session)
+    await session.commit()
+    return result
+
+
+async def execute_write(session: AsyncSession, statement, params=None):
+    '''
+    Execute and commit one write statement, see `run_write`.
+    Returns the statement's result (e.g. for its `rowcount`).
+    '''
+    return await run_write(session, lambda conn: conn.execute(statement, params))
+
+
+async def commit_write(work):
+    '''
+    Run and commit a unit of work that belongs to no request, `async def work(conn)`: through the
+    queue when it is running, in a write transaction of its own otherwise. Returns what `work` returned.
+    '''
+    if database_writer.running:
+        return await database_writer.run(work)
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(sqlite_begin="IMMEDIATE")
+        async with conn.begin():
+            return await work(conn)
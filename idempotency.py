@@ -0,0 +1,377 @@
+'''
+Idempotent writes with the ` Idempotency-Key ` header.
+
+A client that timed out retries with the key it sent the first time. The first request with a
+key runs, and its response is kept in the `idempotency_key` table for
+`IdempotencyConfig.ttl_seconds`. The retries get that response back, with
+` Idempotent-Replayed: true `, without the route running again: a retried ` POST /recipe `
+creates one recipe, not two.
+
+- A key is scoped to the client (its bearer token, or its address without one), the method
+  and the path. Reusing it for another body gets a 422.
+- A duplicate that arrives while the first request still runs waits for its response, for up to
+  `IdempotencyConfig.wait_seconds`, then gets a 409 with `Retry-After`. Within a worker it waits
+  on the first request itself, across workers it looks in the table every `poll_interval`.
+- A key whose first request died with its worker is taken over after `lock_seconds`.
+- Failures worth retrying (5xx, 401, 408, 409, 425, 429) are not kept, the key is released
+  and the next retry runs.
+- Request bodies are read up front to be compared, above `max_body_size` the request gets a 413.
+  Responses above `max_response_size` are not kept. ` POST /recipes/import ` streams its body
+  and is left out by `IdempotencyConfig.excluded_paths`, like the routes answering with a token.
+
+The table is shared by the workers and outlives restarts. Expired keys are ignored, and deleted
+every `prune_interval` seconds by the next request that claims a key.
+`IdempotencyMiddleware` sits inside `CompressionMiddleware`: the body kept is the uncompressed
+one, a replay is compressed for the client it goes to.
+'''
+
+import time
+import asyncio
+import hashlib
+import logging
+
+import orjson
+from sqlalchemy import and_, delete, or_, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from starlette.requests import Request
+
+from config import IdempotencyConfig
+from modals import idempotency_key
+from database.engine import engine
+from database.writer import commit_write
+from clients import client_id
+
+log = logging.getLogger("recipe_api.idempotency")
+
+HEADER = "idempotency-key"
+REPLAYED_HEADER = (b"idempotent-replayed", b"true")
+MAX_KEY_LENGTH = 255
+# a retry may well succeed, these are not kept
+TRANSIENT_STATUSES = frozenset((401, 408, 409, 425, 429))
+
+
+def parse_list(spec: str, upper: bool = False):
+    ''' ` POST, patch ` -> ` {"POST", "PATCH"} ` '''
+    items = (item.strip() for item in spec.split(","))
+    return frozenset(item.upper() if upper else item for item in items if item)
+
+
+def scoped_key(request: Request, key: str):
+    ''' What a key is stored under: a hash of the client, the method, the path and the key '''
+    authorization = request.headers.get("authorization")
+    client = f"token:{authorization}" if authorization else f"client:{client_id(request)}"
+    scoped = f"{client}\n{request.method}\n{request.url.path}\n{key}"
+    return hashlib.blake2b(scoped.encode(), digest_size=16).hexdigest()
+
+
+def fingerprint(request: Request, body: bytes):
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(request.headers.get("content-type", "").encode("latin-1"))
+    digest.update(b"\n")
+    digest.update(body)
+    return digest.hexdigest()
+
+
+def storable(status: int):
+    return status < 500 and status not in TRANSIENT_STATUSES
+
+
+def claim_statement(key: str, fingerprint: str, now: float):
+    '''
+    Take `key` for a request: a new key, an expired one, or one whose first request stopped
+    holding it. Returns the key when it was taken, nothing when another request has it.
+    '''
+    statement = sqlite_insert(idempotency_key).values(
+        key=key,
+        fingerprint=fingerprint,
+        locked_until=now + IdempotencyConfig.lock_seconds,
+        expires_at=now + IdempotencyConfig.ttl_seconds,
+    )
+    return statement.on_conflict_do_update(
+        index_elements=["key"],
+        set_={
+            "fingerprint": statement.excluded.fingerprint,
+            "status": None,
+            "headers": None,
+            "body": None,
+            "locked_until": statement.excluded.locked_until,
+            "expires_at": statement.excluded.expires_at,
+        },
+        where=or_(
+            idempotency_key.c.expires_at <= now,
+            and_(idempotency_key.c.status.is_(None), idempotency_key.c.locked_until <= now),
+        ),
+    ).returning(idempotency_key.c.key)
+
+
+def store_statement(key: str, response):
+    status, headers, body = response
+    return (
+        update(idempotency_key)
+        .where(idempotency_key.c.key == key)
+        .values(
+            status=status,
+            headers=orjson.dumps(headers).decode(),
+            body=body,
+            locked_until=None,
+            expires_at=time.time() + IdempotencyConfig.ttl_seconds,
+        )
+    )
+
+
+def release_statement(key: str):
+    return delete(idempotency_key).where(idempotency_key.c.key == key)
+
+
+def prune_statement(now: float):
+    return delete(idempotency_key).where(idempotency_key.c.expires_at <= now)
+
+
+class IdempotencyStore:
+    '''
+    The keys of this worker's requests in flight and the table behind them.
+    A request in flight has a future here, resolved with `(fingerprint, response)` once its
+    response is stored, or None when its key was released.
+    '''
+    def __init__(self, wait_seconds: float, poll_interval: float, prune_interval: float):
+        self.wait_seconds = wait_seconds
+        self.poll_interval = poll_interval
+        self.prune_interval = prune_interval
+        self._in_flight = {}  # key -> future
+        self._next_prune = 0.0
+        self.executed = 0
+        self.replayed = 0
+        self.coalesced = 0
+        self.conflicts = 0
+        self.mismatches = 0
+        self.released = 0
+
+    async def claim(self, key: str, fingerprint: str):
+        '''
+        What to do with a request: `("run", None)` after taking its key (`finish` has to follow),
+        `("replay", response)`, `("mismatch", None)` when the key was used for another request,
+        `("busy", None)` when its first request did not finish in time
+        '''
+        deadline = time.monotonic() + self.wait_seconds
+        waited = False
+        while True:
+            in_flight = self._in_flight.get(key)
+            if in_flight is not None:
+                waited = True
+                try:
+                    done = await asyncio.wait_for(asyncio.shield(in_flight), deadline - time.monotonic())
+                except asyncio.TimeoutError:
+                    return self._busy()
+                if done is None:
+                    continue
+                stored_fingerprint, response = done
+                return self._stored(stored_fingerprint, fingerprint, response, waited)
+
+            # the duplicates of this worker wait on this request from now on
+            self._in_flight[key] = asyncio.get_running_loop().create_future()
+            try:
+                claimed = await commit_write(lambda conn: self._claim(conn, key, fingerprint))
+            except BaseException:
+                self._settle(key, None)
+                raise
+            if claimed:
+                self.executed += 1
+                return "run", None
+            self._settle(key, None)
+
+            row = await self._read(key)
+            if row is None:
+                # released or expired in the meantime
+                continue
+            if row.status is not None:
+                response = (row.status, orjson.loads(row.headers), row.body)
+                return self._stored(row.fingerprint, fingerprint, response, waited)
+            if row.fingerprint != fingerprint:
+                self.mismatches += 1
+                return "mismatch", None
+            # running on another worker
+            waited = True
+            if time.monotonic() + self.poll_interval > deadline:
+                return self._busy()
+            await asyncio.sleep(self.poll_interval)
+
+    async def finish(self, key: str, fingerprint: str, response):
+        ''' Keep the response of the request that took `key`, None releases the key instead '''
+        try:
+            if response is None:
+                self.released += 1
+                await commit_write(lambda conn: conn.execute(release_statement(key)))
+            else:
+                await commit_write(lambda conn: conn.execute(store_statement(key, response)))
+        except Exception:
+            # the key stays locked until `lock_seconds`, then it is free again
+            log.exception("storing the response of an idempotent request failed")
+            response = None
+        self._settle(key, None if response is None else (fingerprint, response))
+
+    async def _claim(self, conn, key: str, fingerprint: str):
+        now = time.time()
+        if time.monotonic() >= self._next_prune:
+            self._next_prune = time.monotonic() + self.prune_interval
+            await conn.execute(prune_statement(now))
+        result = await conn.execute(claim_statement(key, fingerprint, now))
+        return result.first() is not None
+
+    async def _read(self, key: str):
+        # the primary, a replica might not have the key yet
+        async with engine.connect() as conn:
+            result = await conn.execute(
+                select(idempotency_key).where(idempotency_key.c.key == key, idempotency_key.c.expires_at > time.time())
+            )
+            return result.first()
+
+    def _stored(self, stored_fingerprint: str, fingerprint: str, response, waited: bool):
+        if stored_fingerprint != fingerprint:
+            self.mismatches += 1
+            return "mismatch", None
+        if waited:
+            self.coalesced += 1
+        self.replayed += 1
+        return "replay", response
+
+    def _busy(self):
+        self.conflicts += 1
+        return "busy", None
+
+    def _settle(self, key: str, result):
+        future = self._in_flight.pop(key, None)
+        if future is not None and not future.done():
+            future.set_result(result)
+
+    def stats(self):
+        return {
+            "in_flight": len(self._in_flight),
+            "executed": self.executed,
+            "replayed": self.replayed,
+            "coalesced": self.coalesced,
+            "conflicts": self.conflicts,
+            "mismatches": self.mismatches,
+            "released": self.released,
+        }
+
+
+idempotency_store = IdempotencyStore(
+    IdempotencyConfig.wait_seconds, IdempotencyConfig.poll_interval, IdempotencyConfig.prune_interval
+)
+
+
+async def send_response(send, status: int, headers: list, body: bytes):
+    headers = [(name, value) for name, value in headers if name != b"content-length"]
+    headers.append((b"content-length", str(len(body)).encode("latin-1")))
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def send_error(send, status: int, detail: str, headers: list = ()):
+    body = orjson.dumps({"detail": detail})
+    await send_response(send, status, [(b"content-type", b"application/json"), *headers], body)
+
+
+class IdempotencyMiddleware:
+    ''' ASGI middleware running the requests with an ` Idempotency-Key ` once, see the module docstring '''
+    def __init__(self, app, store: IdempotencyStore = idempotency_store):
+        self.app = app
+        self.store = store
+        self.methods = parse_list(IdempotencyConfig.methods, upper=True)
+        self.excluded_paths = parse_list(IdempotencyConfig.excluded_paths)
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] not in self.methods
+            or scope["path"] in self.excluded_paths
+        ):
+            await self.app(scope, receive, send)
+            return
+        request = Request(scope)
+        key = request.headers.get(HEADER)
+        if key is None:
+            await self.app(scope, receive, send)
+            return
+        if not key or len(key) > MAX_KEY_LENGTH:
+            await send_error(send, 400, f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters long")
+            return
+
+        body = await self._read_body(receive)
+        if body is None:
+            await send_error(
+                send, 413, f"Requests with an Idempotency-Key are limited to {IdempotencyConfig.max_body_size} bytes"
+            )
+            return
+
+        scoped = scoped_key(request, key)
+        request_fingerprint = fingerprint(request, body)
+        outcome, response = await self.store.claim(scoped, request_fingerprint)
+        if outcome == "replay":
+            status, headers, stored_body = response
+            headers = [(name.encode("latin-1"), value.encode("latin-1")) for name, value in headers]
+            await send_response(send, status, [*headers, REPLAYED_HEADER], stored_body)
+            return
+        if outcome == "mismatch":
+            await send_error(send, 422, "This Idempotency-Key was already used for another request")
+            return
+        if outcome == "busy":
+            await send_error(
+                send, 409, "A request with this Idempotency-Key is still being processed", [(b"retry-after", b"1")]
+            )
+            return
+
+        await self._run(scope, receive, send, body, scoped, request_fingerprint)
+
+    async def _read_body(self, receive):
+        ''' The whole request body, None when it is larger than `max_body_size` '''
+        chunks, size = [], 0
+        while True:
+            message = await receive()
+            if message["type"] != "http.request":
+                return b"".join(chunks)
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if size > IdempotencyConfig.max_body_size:
+                return None
+            chunks.append(chunk)
+            if not message.get("more_body", False):
+                return b"".join(chunks)
+
+    async def _run(self, scope, receive, send, body: bytes, key: str, request_fingerprint: str):
+        ''' Run the request that took `key`, keep its response if it is worth replaying '''
+        body_sent = False
+        status, headers = None, []
+        chunks, size, overflowed = [], 0, False
+
+        async def receive_body():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        async def send_captured(message):
+            nonlocal status, headers, size, overflowed
+            if message["type"] == "http.response.start":
+                # a copy: the middlewares outside this one (compression) rewrite the headers they send
+                status, headers = message["status"], [*message.get("headers", [])]
+            elif message["type"] == "http.response.body" and not overflowed:
+                chunk = message.get("body", b"")
+                size += len(chunk)
+                if size <= IdempotencyConfig.max_response_size:
+                    chunks.append(chunk)
+                else:
+                    # too large to keep, the rest is not captured either
+                    overflowed = True
+                    chunks.clear()
+            await send(message)
+
+        response = None
+        try:
+            await self.app(scope, receive_body, send_captured)
+            if status is not None and storable(status) and not overflowed:
+                headers = [(name.decode("latin-1"), value.decode("latin-1")) for name, value in headers]
+                response = (status, headers, b"".join(chunks))
+        finally:
+            await self.store.finish(key, request_fingerprint, response)
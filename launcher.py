@@ -0,0 +1,168 @@
+'''
+Production entry point of the Recipe API
+```bash
+python manage.py serve --workers 4
+```
+
+`uvicorn app:app --workers N` starts every worker from scratch: each one imports the app and runs
+the whole startup on its own. The launcher preloads instead. The master process imports the app,
+binds the socket and does the startup work that only has to happen once (the schema check). Then
+it forks the workers, which inherit all of that and only open what is their own: connections
+(warmed up by the lifespan), the writer queue and the caches. A worker that dies is replaced,
+after a backoff when workers keep dying right after their start (`RestartPolicy`), and the
+server gives up once that happened `ServerConfig.max_rapid_failures` times in a row.
+
+Run with `RECIPE_CACHE_BACKEND=shared` so the workers' read caches invalidate each other.
+`--no-preload` hands over to plain `uvicorn.run` (Windows, or to debug one worker).
+'''
+
+import os
+import time
+import signal
+import asyncio
+import logging
+
+import uvicorn
+
+from config import ServerConfig
+
+log = logging.getLogger("recipe_api.launcher")
+
+
+def preload(app):
+    ''' Startup shared by all workers, done once in the master before they fork '''
+    from database.engine import check_schema, dispose_engines
+
+    async def startup():
+        await check_schema()
+        # no connection may be shared with the workers
+        await dispose_engines()
+
+    asyncio.run(startup())
+    app.state.schema_checked = True
+
+
+def run_worker(config: uvicorn.Config, sock):
+    ''' Body of a forked worker, serves on the master's socket until it is told to stop '''
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+class RestartPolicy:
+    '''
+    When to replace a worker that exited: right away after it ran for `min_uptime` seconds,
+    otherwise after `backoff` seconds doubled for every rapid failure in a row (up to `backoff_max`).
+    None once `max_rapid_failures` rapid failures happened in a row (0 never gives up).
+    '''
+    def __init__(
+        self,
+        min_uptime: float = ServerConfig.worker_min_uptime,
+        backoff: float = ServerConfig.restart_backoff,
+        backoff_max: float = ServerConfig.restart_backoff_max,
+        max_rapid_failures: int = ServerConfig.max_rapid_failures,
+    ):
+        self.min_uptime = min_uptime
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.max_rapid_failures = max_rapid_failures
+        self.rapid_failures = 0
+
+    def delay(self, uptime: float):
+        ''' Seconds to wait before replacing a worker that ran for `uptime` seconds, None to give up '''
+        if uptime >= self.min_uptime:
+            self.rapid_failures = 0
+            return 0.0
+        self.rapid_failures += 1
+        if self.max_rapid_failures and self.rapid_failures >= self.max_rapid_failures:
+            return None
+        return min(self.backoff * 2 ** (self.rapid_failures - 1), self.backoff_max)
+
+
+def supervise(config: uvicorn.Config, sock, workers: int, policy: RestartPolicy | None = None):
+    '''
+    Fork `workers` workers and keep that many running until SIGTERM / SIGINT.
+    Exits with status 1 when `policy` gives up on workers that keep dying.
+    '''
+    policy = policy or RestartPolicy()
+    children = {}  # pid -> start time
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                run_worker(config, sock)
+            except BaseException:
+                log.exception("worker %d failed", os.getpid())
+                status = 1
+            finally:
+                os._exit(status)
+        children[pid] = time.monotonic()
+        log.info("started worker %d", pid)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            os.kill(pid, signal.SIGTERM)
+
+    for _ in range(workers):
+        spawn()
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    gave_up = False
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        started = children.pop(pid, None)
+        if stopping or started is None:
+            continue
+        delay = policy.delay(time.monotonic() - started)
+        if delay is None:
+            log.error("worker %d exited (status %d), %d workers failed right after their start, giving up",
+                      pid, status, policy.rapid_failures)
+            gave_up = True
+            stop(None, None)
+            continue
+        log.warning("worker %d exited (status %d), starting a new one in %.1fs", pid, status, delay)
+        # in short steps, a SIGTERM during the backoff stops the server without waiting it out
+        deadline = time.monotonic() + delay
+        while not stopping and time.monotonic() < deadline:
+            time.sleep(max(0.0, min(0.1, deadline - time.monotonic())))
+        if not stopping:
+            spawn()
+    if gave_up:
+        raise SystemExit(1)
+
+
+def serve(
+    host: str = ServerConfig.host,
+    port: int = ServerConfig.port,
+    workers: int = ServerConfig.workers,
+    preload_app: bool = ServerConfig.preload,
+    log_level: str = ServerConfig.log_level,
+):
+    ''' Serve the app on `host:port` with `workers` processes '''
+    if not preload_app:
+        uvicorn.run(
+            "app:app", host=host, port=port, workers=workers, log_level=log_level, access_log=ServerConfig.access_log
+        )
+        return
+
+    from app import app
+
+    logging.basicConfig(level=log_level.upper())
+    preload(app)
+    config = uvicorn.Config(
+        app, host=host, port=port, log_level=log_level, access_log=ServerConfig.access_log, lifespan="on"
+    )
+    sock = config.bind_socket()
+    if workers <= 1:
+        uvicorn.Server(config).run(sockets=[sock])
+        return
+    supervise(config, sock, workers)
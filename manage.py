@@ -0,0 +1,222 @@
+'''
+Management commands for the Recipe API
+```bash
+python manage.py migrate
+python manage.py rebuild-search-index
+python manage.py vacuum
+python manage.py import-recipes recipes.ndjson --owner jhondoe@gmail.com
+python manage.py serve --workers 4
+python manage.py copy-database replica.db
+python manage.py prune-changes --days 30
+python manage.py worker
+```
+'''
+
+import os
+import sys
+import json
+import sqlite3
+import signal
+import asyncio
+import argparse
+from datetime import datetime, timedelta, timezone
+
+import launcher
+from config import ImportConfig, ServerConfig, ChangeFeedConfig
+from controller import importer
+from database.engine import engine, SessionLocal, dispose_engines, check_schema
+from database.writer import database_writer, writer_enabled, commit_write
+from database.jobs import job_queue, requeue_failed_statement
+from database.search import rebuild_index, repair_index, FTS_TABLE
+from database.migrations import upgrade, load_migrations, applied_versions
+from database.users import UserFunction
+from database.recipe import RecipiessFunction
+from database.utils import to_db_timestamp
+
+READ_CHUNK_SIZE = 1 << 20
+
+
+async def migrate(args):
+    ''' Apply the pending schema migrations (up to --target), or list them with --list '''
+    async with engine.connect() as conn:
+        if args.list:
+            applied = await conn.run_sync(applied_versions)
+            for migration in load_migrations():
+                state = "applied" if migration.version in applied else "pending"
+                print(f"{migration.version:04d}_{migration.name:<30} {state:<8} {migration.description}")
+        else:
+            report = lambda migration: print(f"applied {migration.version:04d}_{migration.name}")
+            migrations = await conn.run_sync(upgrade, args.target, report)
+            if not migrations:
+                print("schema is up to date")
+    await engine.dispose()
+
+
+async def rebuild_search_index(args):
+    ''' Backfill the full-text search index from the recipes already in the database '''
+    async with engine.begin() as conn:
+        await conn.run_sync(rebuild_index)
+    await engine.dispose()
+    print(f"{FTS_TABLE} rebuilt")
+
+
+async def read_chunks(file):
+    ''' Async stream of byte chunks of a file, the importer consumes the same shape as a request body '''
+    while chunk := file.read(READ_CHUNK_SIZE):
+        yield chunk
+
+
+async def import_recipes(args):
+    ''' Bulk import recipes from an NDJSON or CSV file (`-` reads stdin) '''
+    format = args.format
+    if format is None:
+        format = "csv" if args.path.endswith(".csv") else "ndjson"
+
+    async with SessionLocal() as session:
+        owner = await UserFunction.get_user_by_email(session, args.owner)
+        if owner is None:
+            raise SystemExit(f"No user with the email {args.owner}")
+
+        file = sys.stdin.buffer if args.path == "-" else open(args.path, "rb")
+        with file:
+            report = await importer.import_recipes(
+                session, read_chunks(file), format, owner.id, args.batch_size
+            )
+    await dispose_engines()
+    print(json.dumps(report, indent=2))
+
+
+async def prune_changes(args):
+    ''' Drop the recipe changes older than --days from the change log, clients further behind get a 410 '''
+    before = to_db_timestamp(datetime.now(timezone.utc) - timedelta(days=args.days))
+    async with SessionLocal() as session:
+        pruned = await RecipiessFunction.prune_changes(session, before)
+    await dispose_engines()
+    print(f"pruned {pruned} changes older than {before}")
+
+
+async def worker(args):
+    '''
+    Run the background jobs until SIGTERM / SIGINT, for API workers started with
+    `JOBS_RUN_IN_PROCESS=false` (any number of these can run, each job is run by one)
+    '''
+    await check_schema()
+    if args.retry_failed:
+        result = await commit_write(lambda conn: conn.execute(requeue_failed_statement()))
+        print(f"requeued {result.rowcount} failed jobs")
+    if writer_enabled():
+        await database_writer.start()
+    await job_queue.start()
+    stopped = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stopped.set)
+    print("running jobs, stop with Ctrl+C")
+    await stopped.wait()
+    await job_queue.stop()
+    await database_writer.stop()
+    await dispose_engines()
+    print(f"stopped: {job_queue.stats()}")
+
+
+def sqlite_path(command: str):
+    if engine.dialect.name != "sqlite" or not engine.url.database or ":memory:" in engine.url.database:
+        raise SystemExit(f"{command} needs a file SQLite DATABASE_URL")
+    return engine.url.database
+
+
+def vacuum(args):
+    '''
+    VACUUM the SQLite database, then rebuild the search index if that renumbered the recipes' rowids.
+    It takes the write lock for as long as it runs, and needs as much free disk as the database.
+    '''
+    path = sqlite_path("vacuum")
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("VACUUM")
+        rebuilt = repair_index(conn)
+    finally:
+        conn.close()
+    print(f"vacuumed {path}" + (f", {FTS_TABLE} rebuilt" if rebuilt else ""))
+
+
+def copy_database(args):
+    '''
+    Copy the SQLite database to `path`, e.g. a local read replica (see `DATABASE_REPLICA_URLS`).
+    The copy is consistent and replaces `path` atomically, run it again to refresh the replica.
+    Its search index is rebuilt when the copy renumbered the recipes' rowids.
+    '''
+    database = sqlite_path("copy-database")
+    partial = f"{args.path}.partial"
+    if os.path.exists(partial):
+        os.remove(partial)
+    source = sqlite3.connect(database)
+    source.execute("VACUUM INTO ?", (partial,))
+    source.close()
+    copy = sqlite3.connect(partial)
+    rebuilt = repair_index(copy)
+    # readers of the copy must not pair it with the write-ahead log of an earlier one
+    copy.execute("PRAGMA journal_mode = DELETE")
+    copy.close()
+    os.replace(partial, args.path)
+    print(f"copied {database} to {args.path}" + (f", {FTS_TABLE} rebuilt" if rebuilt else ""))
+
+
+def serve(args):
+    ''' Run the API with a preloading master process and forked workers, see `launcher.py` '''
+    launcher.serve(args.host, args.port, args.workers, args.preload, args.log_level)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recipe API management commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    schema = commands.add_parser("migrate", help=migrate.__doc__)
+    schema.add_argument("--target", type=int, help="stop after this migration version")
+    schema.add_argument("--list", action="store_true", help="show every migration and whether it is applied")
+    schema.set_defaults(handler=migrate)
+
+    rebuild = commands.add_parser("rebuild-search-index", help=rebuild_search_index.__doc__)
+    rebuild.set_defaults(handler=rebuild_search_index)
+
+    compact = commands.add_parser("vacuum", help=vacuum.__doc__)
+    compact.set_defaults(handler=vacuum)
+
+    load = commands.add_parser("import-recipes", help=import_recipes.__doc__)
+    load.add_argument("path", help="NDJSON or CSV file, - for stdin")
+    load.add_argument("--owner", required=True, help="email of the user owning the imported recipes")
+    load.add_argument("--format", choices=importer.FORMATS, help="defaults to csv for .csv files, ndjson otherwise")
+    load.add_argument("--batch-size", type=int, default=ImportConfig.batch_size)
+    load.set_defaults(handler=import_recipes)
+
+    prune = commands.add_parser("prune-changes", help=prune_changes.__doc__)
+    prune.add_argument("--days", type=float, default=ChangeFeedConfig.retention_days)
+    prune.set_defaults(handler=prune_changes)
+
+    jobs = commands.add_parser("worker", help=worker.__doc__)
+    jobs.add_argument("--retry-failed", action="store_true", help="run the jobs that failed for good again")
+    jobs.set_defaults(handler=worker)
+
+    copy = commands.add_parser("copy-database", help=copy_database.__doc__)
+    copy.add_argument("path", help="file to write the copy to")
+    copy.set_defaults(handler=copy_database)
+
+    server = commands.add_parser("serve", help=serve.__doc__)
+    server.add_argument("--host", default=ServerConfig.host)
+    server.add_argument("--port", type=int, default=ServerConfig.port)
+    server.add_argument("--workers", type=int, default=ServerConfig.workers)
+    server.add_argument(
+        "--no-preload", dest="preload", action="store_false", default=ServerConfig.preload,
+        help="let uvicorn start every worker on its own",
+    )
+    server.add_argument("--log-level", default=ServerConfig.log_level)
+    server.set_defaults(handler=serve)
+
+    args = parser.parse_args()
+    result = args.handler(args)
+    if asyncio.iscoroutine(result):
+        asyncio.run(result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+'''
+In-process metrics, exported on ` GET /metrics ` in the Prometheus text format.
+
+- `app.py` times every request in a middleware, labelled with the route template
+  (` /recipe/{recipe_id} `, never the raw path) so the number of series stays fixed.
+- `database/engine.py` hooks the SQLAlchemy cursor events of every engine: each statement is
+  counted and timed, globally and against the request it ran for (`RequestStats`, carried in a
+  context variable), and logged when it is slower than `MetricsConfig.slow_query_seconds`.
+- A request that runs the same statement `MetricsConfig.repeated_query_threshold` times or more
+  is flagged as a likely N+1 pattern.
+- Requests the rate limiter or the load shedder turned away are counted by reason (`ratelimit.py`).
+- Background jobs are timed by kind: from enqueueing to completion, and the run itself (`database/jobs.py`).
+- The counters the caches, the writer queue and the hashing pool already keep are read when
+  `/metrics` is scraped, see `register_stats`.
+
+Statements the writer queue commits run on its own task and are not counted against a request.
+'''
+
+import logging
+from contextvars import ContextVar
+from collections import Counter as StatementCounter
+
+from config import MetricsConfig
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 4, 5, 10, 20, 50, 100)
+# transaction control repeats by design, it is not what the N+1 check looks for
+TRANSACTION_OPERATIONS = frozenset(("BEGIN", "COMMIT", "ROLLBACK", "SAVEPOINT", "RELEASE", "PRAGMA"))
+
+slow_query_log = logging.getLogger("recipe_api.sql.slow")
+repeated_query_log = logging.getLogger("recipe_api.sql.repeated")
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.values = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in self.values.items():
+            yield f"{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}"
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets) + (float("inf"),)
+        # labels -> [count per bucket..., sum]
+        self.values = {}
+
+    def observe(self, value: float, *labels):
+        series = self.values.get(labels)
+        if series is None:
+            series = self.values[labels] = [0] * len(self.buckets) + [0.0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[index] += 1
+                break
+        series[-1] += value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        names = self.labelnames + ("le",)
+        for labels, series in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                yield f"{self.name}_bucket{format_labels(names, labels + (format_value(bound),))} {cumulative}"
+            yield f"{self.name}_sum{format_labels(self.labelnames, labels)} {format_value(series[-1])}"
+            yield f"{self.name}_count{format_labels(self.labelnames, labels)} {cumulative}"
+
+
+class StatsGauges:
+    ''' Exposes the numeric fields of a `stats()` dict as gauges named `<prefix>_<field>` '''
+    def __init__(self, prefix: str, stats):
+        self.prefix = prefix
+        self.stats = stats
+
+    def render(self):
+        for field, value in self.stats().items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            name = f"{self.prefix}_{field}"
+            yield f"# TYPE {name} gauge"
+            yield f"{name} {format_value(value)}"
+
+
+class Registry:
+    def __init__(self):
+        self.collectors = []
+
+    def register(self, collector):
+        self.collectors.append(collector)
+        return collector
+
+    def render(self) -> str:
+        return "\n".join(line for collector in self.collectors for line in collector.render()) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.register(Counter(
+    "http_requests_total", "Requests handled, by route and status code", ("method", "route", "status"),
+))
+http_request_duration = registry.register(Histogram(
+    "http_request_duration_seconds", "Time to the response headers, by route", ("method", "route"),
+))
+http_request_queries = registry.register(Histogram(
+    "http_request_db_queries", "SQL statements executed per request, by route", ("method", "route"),
+    buckets=QUERY_COUNT_BUCKETS,
+))
+http_request_query_duration = registry.register(Histogram(
+    "http_request_db_seconds", "Time spent in SQL per request, by route", ("method", "route"),
+))
+http_repeated_queries = registry.register(Counter(
+    "http_request_repeated_queries_total",
+    "Requests that ran one statement at least the repeated query threshold times (N+1 suspects)",
+    ("method", "route"),
+))
+http_requests_shed = registry.register(Counter(
+    "http_requests_shed_total",
+    "Requests turned away before running, by route and reason (rate_limited: 429, overloaded: 503)",
+    ("method", "route", "reason"),
+))
+db_queries = registry.register(Counter(
+    "db_queries_total", "SQL statements executed, by operation", ("operation",),
+))
+db_query_duration = registry.register(Histogram(
+    "db_query_duration_seconds", "SQL statement execution time, by operation", ("operation",),
+))
+db_slow_queries = registry.register(Counter(
+    "db_slow_queries_total", "SQL statements slower than the slow query threshold", ("operation",),
+))
+
+job_latency = registry.register(Histogram(
+    "job_latency_seconds", "Time from enqueueing a background job to its completion, by kind", ("kind",),
+))
+job_duration = registry.register(Histogram(
+    "job_duration_seconds", "Run time of the successful background jobs, by kind", ("kind",),
+))
+
+
+def register_stats(prefix: str, stats):
+    ''' Publish a component's `stats()` counters, read at scrape time '''
+    registry.register(StatsGauges(prefix, stats))
+
+
+class RequestStats:
+    ''' SQL executed on behalf of one request '''
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.statements = StatementCounter()
+
+
+current_request = ContextVar("current_request", default=None)
+
+
+def statement_operation(statement: str):
+    ''' First keyword of the statement (SELECT, INSERT, ...), the label of the query metrics '''
+    keyword = statement.lstrip().split(None, 1)[:1]
+    return keyword[0].upper() if keyword else "UNKNOWN"
+
+
+def record_query(statement: str, elapsed: float):
+    ''' Called after every statement by the engine hooks '''
+    operation = statement_operation(statement)
+    db_queries.inc(operation)
+    db_query_duration.observe(elapsed, operation)
+
+    request = current_request.get()
+    if request is not None:
+        request.queries += 1
+        request.query_seconds += elapsed
+        if operation not in TRANSACTION_OPERATIONS:
+            request.statements[statement] += 1
+
+    threshold = MetricsConfig.slow_query_seconds
+    if threshold and elapsed >= threshold:
+        db_slow_queries.inc(operation)
+        slow_query_log.warning("slow query (%.3fs): %s", elapsed, " ".join(statement.split()))
+
+
+def record_request(method: str, route: str, status: int, elapsed: float, request: RequestStats):
+    ''' Called by the middleware once the response has started '''
+    http_requests.inc(method, route, status)
+    http_request_duration.observe(elapsed, method, route)
+    http_request_queries.observe(request.queries, method, route)
+    http_request_query_duration.observe(request.query_seconds, method, route)
+
+    if not request.statements:
+        return
+    statement, count = request.statements.most_common(1)[0]
+    if count >= MetricsConfig.repeated_query_threshold:
+        http_repeated_queries.inc(method, route)
+        repeated_query_log.warning(
+            "%s %s ran the same statement %d times (%d statements in total): %s",
+            method, route, count, request.queries, " ".join(statement.split()),
+        )
@@ -1,12 +1,15 @@
 from pydantic import BaseModel as PydanticBaseModel
 from datetime import datetime
 
-from pydantic import UUID4
+from pydantic import UUID4, Field
+from typing import Annotated
 
-from sqlalchemy import ForeignKey
+from sqlalchemy import Column, Float, ForeignKey, Index, Integer, LargeBinary, String, Table
 from sqlalchemy.orm import DeclarativeBase, mapped_column, relationship, Mapped
 import uuid
 
+from config import BatchConfig
+
 class DBBaseModel(DeclarativeBase):
     created_at: Mapped[str] = mapped_column(default=datetime.now)
     id: Mapped[str] = mapped_column(primary_key=True, default=uuid.uuid4)
@@ -47,7 +50,8 @@ class DBUserModal(DBBaseModel):
     email: Mapped[str] = mapped_column(unique=True)
     password: Mapped[str] = mapped_column()
     
-    recipies: Mapped[list["DBRecipeModal"]] = relationship("DBRecipeModal", back_populates="owner")
+    # never loaded implicitly (one query per user), ask for `selectinload(DBUserModal.recipies)` instead
+    recipies: Mapped[list["DBRecipeModal"]] = relationship("DBRecipeModal", back_populates="owner", lazy="raise")
 
     def __repr__(self) -> str:
         return f"User(id={self.id!r}, name={self.name!r})"
@@ -73,16 +77,170 @@ class UpdateRecipie(PydanticBaseModel):
     name: str | None = None
     ingredients: str | None = None
     instructions: str | None = None
+
+
+# Response shapes of the recipe endpoints. The routes encode rows directly (controller/serializers.py),
+# these models only document that output, they are not run over it.
+class RecipeResponse(PydanticBaseModel):
+    id: str
+    name: str | None = None
+    ingredients: str | None = None
+    instructions: str | None = None
+    owner_id: str
+    created_at: str
+    updated_at: str | None = None
+    version: int
+
+class SearchResultResponse(RecipeResponse):
+    snippet: str
+
+class IngredientMatchResponse(RecipeResponse):
+    # how many of the asked-for ingredients (all and any) the recipe has
+    matches: int
+
+class RecipePage(PydanticBaseModel):
+    items: list[RecipeResponse]
+    next_cursor: str | None = None
+    has_more: bool
+
+class OwnerResponse(PydanticBaseModel):
+    id: str
+    name: str
+
+class UserRecipePage(RecipePage):
+    owner: OwnerResponse
+
+class SearchResultPage(PydanticBaseModel):
+    items: list[SearchResultResponse]
+    next_cursor: str | None = None
+    has_more: bool
+
+class Message(PydanticBaseModel):
+    message: str
+
+class RecipeBatchRequest(PydanticBaseModel):
+    ids: Annotated[list[UUID4], Field(min_length=1, max_length=BatchConfig.max_ids)]
+
+    model_config = {
+        "json_schema_extra": {
+            "example": {
+                "ids": ["3fa85f64-5717-4562-b3fc-2c963f66afa6", "9c1e5a2e-7d3b-4f7e-9a55-0b8f2d6c4e11"],
+            }
+        }
+    }
+
+class RecipeBatchResponse(PydanticBaseModel):
+    items: list[RecipeResponse]
+    missing: list[str]
+
+class RecipeChangeResponse(PydanticBaseModel):
+    seq: int
+    op: str
+    recipe_id: str
+    version: int | None = None
+    changed_at: str
+    # the recipe as it is now, null once it is deleted
+    recipe: RecipeResponse | None = None
+
+class RecipeChangePage(PydanticBaseModel):
+    items: list[RecipeChangeResponse]
+    # pass it back as `since` for the next changes
+    last_seq: int
+    has_more: bool
       
 class DBRecipeModal(DBBaseModel):
     __tablename__ = "recipie"
+    # the schema itself is created by database/migrations, keep the two in step
+    __table_args__ = (
+        # keyset pagination seeks and orders on (created_at, id), `version` makes it cover page ETags
+        Index("ix_recipie_created_at_id_version", "created_at", "id", "version"),
+        # answers conditional requests for one recipe without reading the row
+        Index("ix_recipie_id_version", "id", "version", "updated_at"),
+        # an owner's recipes in keyset order, also serves the ownership filters
+        Index("ix_recipie_owner_id_created_at_id", "owner_id", "created_at", "id", "version"),
+    )
 
     name: Mapped[str]= mapped_column(nullable=True)
     ingredients: Mapped[str]= mapped_column(nullable=True)
     instructions: Mapped[str]= mapped_column(nullable=True)
     owner_id: Mapped[str]= mapped_column(ForeignKey("user_account.id"))
+    # maintained by `update_recipe`, the ETag and Last-Modified of the recipe derive from them
+    updated_at: Mapped[str]= mapped_column(nullable=True)
+    version: Mapped[int]= mapped_column(default=1, server_default="1")
 
-    owner: Mapped[DBUserModal] = relationship("DBUserModal", back_populates="recipies")
+    # never loaded implicitly (one query per recipe), ask for `joinedload(DBRecipeModal.owner)` instead
+    owner: Mapped[DBUserModal] = relationship("DBUserModal", back_populates="recipies", lazy="raise")
     
     def __repr__(self) -> str:
-        return f"Recipie(id={self.id!r}, title={self.name!r})"
\ No newline at end of file
+        return f"Recipie(id={self.id!r}, title={self.name!r})"
+
+
+# Normalized ingredient names and which recipes use them, see database/ingredients.py.
+# Plain tables, the rows are only ever written and read in bulk by the data functions.
+ingredient = Table(
+    "ingredient",
+    DBBaseModel.metadata,
+    Column("id", Integer, primary_key=True),
+    Column("name", String, nullable=False, unique=True),
+)
+
+recipe_ingredient = Table(
+    "recipe_ingredient",
+    DBBaseModel.metadata,
+    # the primary key is the posting list of each ingredient, in recipe id order
+    Column("ingredient_id", ForeignKey("ingredient.id"), primary_key=True),
+    Column("recipe_id", ForeignKey("recipie.id"), primary_key=True),
+    # and this one the ingredients of each recipe, to replace them when the recipe changes
+    Index("ix_recipe_ingredient_recipe_id", "recipe_id", "ingredient_id"),
+    sqlite_with_rowid=False,
+)
+
+# Append-only log of the recipe writes, filled by triggers on `recipie`, see database/changes.py.
+recipe_change = Table(
+    "recipe_change",
+    DBBaseModel.metadata,
+    Column("seq", Integer, primary_key=True),
+    Column("recipe_id", String, nullable=False),
+    Column("op", String, nullable=False),
+    Column("version", Integer),
+    Column("changed_at", String, nullable=False),
+    Index("ix_recipe_change_changed_at", "changed_at"),
+    # a seq is never handed out twice, even after the latest change is pruned
+    sqlite_autoincrement=True,
+)
+
+# Work queued by the writes to run after them, see database/jobs.py. Times are epoch seconds.
+job = Table(
+    "job",
+    DBBaseModel.metadata,
+    Column("id", Integer, primary_key=True),
+    Column("kind", String, nullable=False),
+    Column("payload", String, nullable=False),
+    Column("attempts", Integer, nullable=False, default=0),
+    # when it may run next, pushed back while a runner holds it and after a failed attempt
+    Column("run_after", Float, nullable=False),
+    Column("enqueued_at", Float, nullable=False),
+    # set once it failed `JobConfig.max_attempts` times, it is kept but not run again
+    Column("failed_at", Float),
+    Column("last_error", String),
+    Index("ix_job_due", "run_after", sqlite_where=Column("failed_at").is_(None)),
+)
+
+# Responses of the requests sent with an ` Idempotency-Key `, see idempotency.py. Times are epoch seconds.
+idempotency_key = Table(
+    "idempotency_key",
+    DBBaseModel.metadata,
+    # hash of the client, the method, the path and the key it sent
+    Column("key", String, primary_key=True),
+    # hash of the request body, a key may not be reused for another request
+    Column("fingerprint", String, nullable=False),
+    # null while the first request with the key runs
+    Column("status", Integer),
+    Column("headers", String),
+    Column("body", LargeBinary),
+    # until when the first request holds the key, another one takes over after that
+    Column("locked_until", Float),
+    Column("expires_at", Float, nullable=False),
+    Index("ix_idempotency_key_expires_at", "expires_at"),
+    sqlite_with_rowid=False,
+)
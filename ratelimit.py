@@ -0,0 +1,240 @@
+'''
+Rate limiting and load shedding for the expensive routes.
+
+Logins and registrations run bcrypt, searches run the full-text index, and a few clients hammering
+either could keep every worker busy. Two guards run before the route, as one app-wide dependency
+(`guard`). Both are keyed by the route template (` POST /token `, ` GET /recipie/search `):
+
+- `RateLimiter`: one token bucket per route and client (`RateLimitConfig.rules`). A client
+  (`clients.client_id`) that emptied its bucket gets a 429 with the `Retry-After` seconds until its next token.
+  The buckets live in the worker (`MemoryBuckets`) or, with `RATE_LIMIT_BACKEND=shared`, in a
+  memory-mapped table all the workers of the host share (`SharedBuckets`).
+- `ConcurrencyLimiter`: once `LoadShedConfig.max_in_flight` requests to the expensive routes are
+  running in a worker, the next ones get a 503 with a `Retry-After` instead of queueing up.
+
+What was turned away is counted in `metrics.http_requests_shed` and in the limiters' `stats()`.
+'''
+
+import os
+import math
+import time
+import struct
+import fcntl
+import hashlib
+from collections import OrderedDict
+
+from fastapi import HTTPException, Request, status
+
+import metrics
+from config import RateLimitConfig, LoadShedConfig
+from clients import client_id
+from database.cache import open_shared_map
+
+
+def parse_rules(spec: str):
+    '''
+    ` POST /token=30/60, GET /recipie/search=120/60 ` -> `{"POST /token": (30.0, 60.0), ...}`,
+    `(burst, seconds)`: `burst` requests at once, refilled over `seconds`
+    '''
+    rules = {}
+    for rule in filter(None, (part.strip() for part in spec.split(","))):
+        route, _, rate = rule.rpartition("=")
+        requests, _, seconds = rate.partition("/")
+        try:
+            burst, period = float(requests), float(seconds)
+        except ValueError:
+            raise ValueError(f"Invalid rate limit rule {rule!r}, expected `METHOD /route=REQUESTS/SECONDS`")
+        if not route.strip() or burst < 1 or period <= 0:
+            raise ValueError(f"Invalid rate limit rule {rule!r}, expected `METHOD /route=REQUESTS/SECONDS`")
+        rules[" ".join(route.split())] = (burst, period)
+    return rules
+
+
+def parse_routes(spec: str):
+    return {" ".join(route.split()) for route in spec.split(",") if route.strip()}
+
+
+def take_token(tokens: float, updated: float, burst: float, rate: float, now: float):
+    '''
+    Refill a bucket for the time since `updated` and take one token from it.
+    Returns the new token count and the seconds to wait, 0 when the token was granted
+    '''
+    tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0.0
+    return tokens, (1 - tokens) / rate
+
+
+class MemoryBuckets:
+    ''' Token buckets of this worker, the least recently used beyond `max_keys` are dropped '''
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, updated)
+
+    def take(self, key: str, burst: float, rate: float):
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(key, (burst, now))
+        tokens, wait = take_token(tokens, updated, burst, rate, now)
+        self._buckets[key] = (tokens, now)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+    def stats(self):
+        return {"clients": len(self._buckets)}
+
+
+class SharedBuckets:
+    '''
+    Token buckets in a memory-mapped hash table shared by the workers of the host.
+    A slot holds a 64 bit hash of the key, the tokens left and when they were counted (wall clock).
+    A key is looked for in `PROBES` slots from its hash, when none is free the least recently
+    updated of them is taken over. The table is locked with `flock` for each take.
+    '''
+    SLOT = struct.Struct("<Qdd")
+    PROBES = 8
+
+    def __init__(self, path: str, slots: int):
+        self.path = path
+        self.slots = slots
+        self._pid = None
+
+    def _open(self):
+        if self._pid != os.getpid():
+            self._fd, self._map = open_shared_map(self.path, self.slots * self.SLOT.size)
+            self._pid = os.getpid()
+
+    def _hash(self, key: str):
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little") or 1
+
+    def take(self, key: str, burst: float, rate: float):
+        self._open()
+        key_hash = self._hash(key)
+        now = time.time()
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            offset, tokens, updated = self._find(key_hash, burst, now)
+            tokens, wait = take_token(tokens, updated, burst, rate, now)
+            self.SLOT.pack_into(self._map, offset, key_hash, tokens, now)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return wait
+
+    def _find(self, key_hash: int, burst: float, now: float):
+        ''' `(offset, tokens, updated)` of the key's slot, a full bucket in a free or reclaimed slot if it has none '''
+        oldest = None
+        for probe in range(self.PROBES):
+            offset = ((key_hash + probe) % self.slots) * self.SLOT.size
+            slot_hash, tokens, updated = self.SLOT.unpack_from(self._map, offset)
+            if slot_hash == key_hash:
+                return offset, tokens, updated
+            if slot_hash == 0:
+                return offset, burst, now
+            if oldest is None or updated < oldest[1]:
+                oldest = (offset, updated)
+        return oldest[0], burst, now
+
+    def stats(self):
+        return {}
+
+
+def buckets_backend():
+    if RateLimitConfig.backend == "shared":
+        return SharedBuckets(RateLimitConfig.shared_path, RateLimitConfig.max_clients)
+    if RateLimitConfig.backend != "local":
+        raise ValueError(f"Unknown RATE_LIMIT_BACKEND {RateLimitConfig.backend!r}, use local or shared")
+    return MemoryBuckets(RateLimitConfig.max_clients)
+
+
+class RateLimiter:
+    def __init__(self, rules: dict, buckets):
+        self.rules = rules
+        self.buckets = buckets
+        self.allowed = 0
+        self.limited = 0
+
+    def check(self, route: str, client: str):
+        ''' Take a token of `client`'s bucket for `route`, 429 when it is empty. Routes without a rule pass '''
+        rule = self.rules.get(route)
+        if rule is None:
+            return
+        burst, period = rule
+        wait = self.buckets.take(f"{route}|{client}", burst, burst / period)
+        if not wait:
+            self.allowed += 1
+            return
+        self.limited += 1
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many requests, please retry later",
+            headers={"Retry-After": str(math.ceil(wait))},
+        )
+
+    def stats(self):
+        return {"rules": len(self.rules), "allowed": self.allowed, "limited": self.limited, **self.buckets.stats()}
+
+
+class ConcurrencyLimiter:
+    def __init__(self, routes: set, max_in_flight: int, retry_after: int):
+        self.routes = routes if max_in_flight > 0 else set()
+        self.max_in_flight = max_in_flight
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.shed = 0
+
+    def acquire(self):
+        ''' Count one more expensive request in flight, 503 when there are already too many '''
+        if self.in_flight >= self.max_in_flight:
+            self.shed += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="The server is busy, please retry shortly",
+                headers={"Retry-After": str(self.retry_after)},
+            )
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def release(self):
+        self.in_flight -= 1
+
+    def stats(self):
+        return {
+            "max_in_flight": self.max_in_flight,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "shed": self.shed,
+        }
+
+
+rate_limiter = RateLimiter(parse_rules(RateLimitConfig.rules), buckets_backend())
+concurrency_limiter = ConcurrencyLimiter(
+    parse_routes(LoadShedConfig.routes), LoadShedConfig.max_in_flight, LoadShedConfig.retry_after
+)
+
+
+async def guard(request: Request):
+    '''
+    App-wide dependency, runs once the route is matched: rate limit, then count the request
+    against the concurrency limit until the route is done with it
+    '''
+    route = request.scope.get("route")
+    path = route.path if route else "unmatched"
+    name = f"{request.method} {path}"
+    try:
+        rate_limiter.check(name, client_id(request))
+    except HTTPException:
+        metrics.http_requests_shed.inc(request.method, path, "rate_limited")
+        raise
+    if name not in concurrency_limiter.routes:
+        yield
+        return
+    try:
+        concurrency_limiter.acquire()
+    except HTTPException:
+        metrics.http_requests_shed.inc(request.method, path, "overloaded")
+        raise
+    try:
+        yield
+    finally:
+        concurrency_limiter.release()
@@ -0,0 +1,35 @@
+'''
+The tests run the app against a database of their own, migrated like a deployment would be:
+the environment is set before anything of the app is imported.
+'''
+
+import os
+import sys
+import tempfile
+import subprocess
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATABASE_DIR = tempfile.mkdtemp(prefix="recipe-api-tests-")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(DATABASE_DIR, 'recipes.db')}"
+os.environ["RATE_LIMITS"] = ""
+sys.path.insert(0, ROOT)
+
+subprocess.run([sys.executable, os.path.join(ROOT, "manage.py"), "migrate"], check=True, stdout=subprocess.DEVNULL)
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+    from app import app
+
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture(scope="session")
+def auth_headers(client):
+    client.post("/register", json={"name": "Test", "email": "test@example.com", "password": "password"})
+    token = client.post("/token", data={"username": "test@example.com", "password": "password"}).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
@@ -0,0 +1,54 @@
+import jwt
+
+from database.engine import SessionLocal
+from controller.auth import SECRET_KEY, ALGORITHM, Auth, principal_cache
+
+
+def test_token_without_expiry_is_cached_without_the_password_hash(client, auth_headers):
+    token = jwt.encode({"sub": "test@example.com"}, SECRET_KEY, algorithm=ALGORITHM)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    assert client.get("/me/recipes", headers=headers).status_code == 200
+    principal = principal_cache.get(token)
+    assert principal.email == "test@example.com"
+    assert not hasattr(principal, "password")
+    assert client.get("/me/recipes", headers=headers).status_code == 200
+
+
+def test_password_change_evicts_the_cached_principals(client, auth_headers):
+    token = auth_headers["Authorization"].removeprefix("Bearer ")
+    assert client.get("/me/recipes", headers=auth_headers).status_code == 200
+    principal = principal_cache.get(token)
+    assert principal is not None
+
+    async def change_password():
+        async with SessionLocal() as session:
+            await Auth.update_password(session, principal.id, await Auth.hash_password("password"))
+
+    client.portal.call(change_password)
+    assert principal_cache.get(token) is None
+    assert client.get("/me/recipes", headers=auth_headers).status_code == 200
+
+
+def test_verified_token_is_answered_from_the_cache(client, auth_headers):
+    client.get("/me/recipes", headers=auth_headers)
+    hits = principal_cache.stats()["hits"]
+    assert client.get("/me/recipes", headers=auth_headers).status_code == 200
+    assert principal_cache.stats()["hits"] == hits + 1
+
+    expired = jwt.encode({"sub": "test@example.com", "exp": 1}, SECRET_KEY, algorithm=ALGORITHM)
+    assert client.get("/me/recipes", headers={"Authorization": f"Bearer {expired}"}).status_code == 401
+    assert principal_cache.get(expired) is None
+
+
+def test_only_the_owner_writes_a_recipe(client, auth_headers):
+    created = client.post("/recipe", json={"name": "Owned pie"}, headers=auth_headers).json()
+    client.post("/register", json={"name": "Other", "email": "other@example.com", "password": "password"})
+    token = client.post("/token", data={"username": "other@example.com", "password": "password"}).json()["access_token"]
+    other = {"Authorization": f"Bearer {token}"}
+
+    assert client.patch(f"/recipe/{created['id']}", json={"name": "Taken pie"}, headers=other).status_code == 401
+    assert client.delete(f"/recipe/{created['id']}", headers=other).status_code == 401
+    assert client.get(f"/recipe/{created['id']}").json()["name"] == "Owned pie"
+    missing = "00000000-0000-4000-8000-000000000000"
+    assert client.delete(f"/recipe/{missing}", headers=auth_headers).status_code == 404
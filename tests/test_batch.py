@@ -0,0 +1,29 @@
+import uuid
+
+from config import BatchConfig
+from database import recipe as recipe_module
+from database.cache import recipe_cache
+
+
+def test_batch_keeps_the_order_asked_for_and_lists_the_missing(client, auth_headers, monkeypatch):
+    ids = [client.post("/recipe", json={"name": f"Batched {number}"}, headers=auth_headers).json()["id"] for number in range(4)]
+    missing = str(uuid.uuid4())
+    # one recipe comes from the cache, the others are read in chunks of two ids
+    monkeypatch.setattr(recipe_module, "MAX_PARAMETERS", 2)
+    client.get(f"/recipe/{ids[2]}")
+    assert recipe_cache.get(("recipe", ids[2])) is not None
+
+    asked = [ids[3], missing, ids[0], ids[2], ids[0], ids[1]]
+    response = client.post("/recipes/batch", json={"ids": asked})
+    assert response.status_code == 200
+    body = response.json()
+    assert [item["id"] for item in body["items"]] == [ids[3], ids[0], ids[2], ids[1]]
+    assert body["items"][0]["name"] == "Batched 3"
+    assert body["missing"] == [missing]
+
+
+def test_batch_size_is_bounded(client):
+    assert client.post("/recipes/batch", json={"ids": []}).status_code == 422
+    too_many = [str(uuid.uuid4()) for _ in range(BatchConfig.max_ids + 1)]
+    assert client.post("/recipes/batch", json={"ids": too_many}).status_code == 422
+    assert client.post("/recipes/batch", json={"ids": ["not-an-id"]}).status_code == 422
@@ -0,0 +1,73 @@
+from database import cache as cache_module
+from database.cache import SharedInvalidations, TTLCache, recipe_cache
+
+
+def test_value_read_across_an_invalidation_is_not_cached():
+    cache = TTLCache(max_entries=10, ttl=30)
+
+    generation = cache.current()
+    # a write commits and invalidates while the read runs on its older snapshot
+    cache.invalidate_tag("recipe-1")
+    cache.set(("recipe", "recipe-1"), "before the write", tags=("recipe-1",), generation=generation)
+
+    assert cache.get(("recipe", "recipe-1")) is None
+    assert cache.stats()["stale_fills"] == 1
+
+    generation = cache.current()
+    cache.set(("recipe", "recipe-1"), "after the write", tags=("recipe-1",), generation=generation)
+    assert cache.get(("recipe", "recipe-1")) == "after the write"
+
+
+def test_invalidation_of_another_worker_counts(tmp_path):
+    path = str(tmp_path / "invalidations")
+    reader = TTLCache(max_entries=10, ttl=30, shared=SharedInvalidations(path, 16))
+    writer = TTLCache(max_entries=10, ttl=30, shared=SharedInvalidations(path, 16))
+    writer.current()
+
+    generation = reader.current()
+    writer.invalidate_tag("recipes")
+    reader.set(("recipes", 1, 10, None), ["stale page"], tags=("recipes",), generation=generation)
+
+    assert reader.get(("recipes", 1, 10, None)) is None
+
+
+def test_least_recently_used_entries_are_evicted_first():
+    cache = TTLCache(max_entries=2, ttl=30)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert cache.stats()["evictions"] == 1
+
+
+def test_entries_expire_and_tags_drop_every_entry_carrying_them(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache_module.time, "monotonic", lambda: now[0])
+    cache = TTLCache(max_entries=10, ttl=30)
+    cache.set(("recipes", 1), ["page"], tags=("recipes", "recipe-1"))
+    cache.set(("recipe", "recipe-1"), "row", tags=("recipe-1",))
+    cache.set(("recipe", "recipe-2"), "row", tags=("recipe-2",), ttl=5)
+
+    now[0] += 6
+    assert cache.get(("recipe", "recipe-2")) is None
+    assert cache.stats()["expirations"] == 1
+
+    cache.invalidate_tag("recipe-1")
+    assert cache.get(("recipes", 1)) is None
+    assert cache.get(("recipe", "recipe-1")) is None
+
+
+def test_writes_invalidate_the_cached_recipe(client, auth_headers):
+    created = client.post("/recipe", json={"name": "Cached stew"}, headers=auth_headers).json()
+    path = f"/recipe/{created['id']}"
+    assert client.get(path).json()["name"] == "Cached stew"
+    assert recipe_cache.get(("recipe", created["id"])) is not None
+
+    client.patch(path, json={"name": "Renamed stew"}, headers=auth_headers)
+    assert client.get(path).json()["name"] == "Renamed stew"
+
+    client.delete(path, headers=auth_headers)
+    assert client.get(path).json() == {"message": "Recipe not found"}
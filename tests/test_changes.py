@@ -0,0 +1,70 @@
+import orjson
+
+from config import ChangeFeedConfig
+from database.changes import latest_seq_statement
+from database.engine import SessionLocal
+from database.recipe import RecipiessFunction
+
+
+def latest_seq(client):
+    async def read():
+        async with SessionLocal() as session:
+            return (await session.execute(latest_seq_statement())).scalar()
+    return client.portal.call(read)
+
+
+def test_changes_page_through_every_write_in_order(client, auth_headers):
+    since = latest_seq(client)
+    created = client.post("/recipe", json={"name": "Logged stew"}, headers=auth_headers).json()
+    client.patch(f"/recipe/{created['id']}", json={"name": "Logged stew, edited"}, headers=auth_headers)
+    kept = client.post("/recipe", json={"name": "Logged pie"}, headers=auth_headers).json()
+    client.delete(f"/recipe/{created['id']}", headers=auth_headers)
+
+    changes, cursor, has_more = [], since, True
+    while has_more:
+        page = client.get("/recipes/changes", params={"since": cursor, "limit": 1}).json()
+        changes += page["items"]
+        cursor, has_more = page["last_seq"], page["has_more"]
+
+    assert [(change["op"], change["recipe_id"]) for change in changes] == [
+        ("create", created["id"]), ("update", created["id"]), ("create", kept["id"]), ("delete", created["id"]),
+    ]
+    assert [change["seq"] for change in changes] == list(range(since + 1, since + 5))
+    # every change carries the recipe as it is now
+    assert changes[0]["recipe"] is None
+    assert changes[2]["recipe"]["name"] == "Logged pie"
+    assert client.get("/recipes/changes", params={"since": cursor}).json() == {"items": [], "last_seq": cursor, "has_more": False}
+
+
+def test_the_stream_replays_the_backlog_as_events(client, auth_headers, monkeypatch):
+    monkeypatch.setattr(ChangeFeedConfig, "stream_seconds", 0.2)
+    since = latest_seq(client)
+    created = client.post("/recipe", json={"name": "Streamed broth"}, headers=auth_headers).json()
+
+    response = client.get("/recipes/changes/stream", headers={"Last-Event-ID": str(since)})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert "content-encoding" not in response.headers
+    events = [block for block in response.text.split("\n\n") if block.startswith("id: ")]
+    lines = events[0].split("\n")
+    assert lines[:2] == [f"id: {since + 1}", "event: change"]
+    data = orjson.loads(lines[2].removeprefix("data: "))
+    assert (data["op"], data["recipe_id"], data["recipe"]["name"]) == ("create", created["id"], "Streamed broth")
+
+    assert client.get("/recipes/changes/stream", headers={"Last-Event-ID": "latest"}).status_code == 400
+
+
+def test_clients_behind_a_pruned_log_get_410(client, auth_headers):
+    client.post("/recipe", json={"name": "Pruned soup"}, headers=auth_headers)
+    client.post("/recipe", json={"name": "Pruned salad"}, headers=auth_headers)
+    latest = latest_seq(client)
+
+    async def prune():
+        async with SessionLocal() as session:
+            return await RecipiessFunction.prune_changes(session, "9999-12-31")
+
+    assert client.portal.call(prune) > 0
+    # the latest change is always kept, clients that saw it carry on
+    assert client.get("/recipes/changes", params={"since": latest - 1}).json()["items"][0]["seq"] == latest
+    assert client.get("/recipes/changes", params={"since": latest - 2}).status_code == 410
+    assert client.get("/recipes/changes/stream", params={"since": latest - 2}).status_code == 410
@@ -0,0 +1,33 @@
+def test_recipe_reads_are_conditional(client, auth_headers):
+    created = client.post("/recipe", json={"name": "Tagged bun"}, headers=auth_headers)
+    path = f"/recipe/{created.json()['id']}"
+
+    first = client.get(path)
+    etag, modified = first.headers["etag"], first.headers["last-modified"]
+    assert etag == created.headers["etag"]
+
+    cached = client.get(path, headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.content == b""
+    assert cached.headers["etag"] == etag
+    assert client.get(path, headers={"If-Modified-Since": modified}).status_code == 304
+    assert client.get(path, headers={"If-None-Match": '"other"'}).status_code == 200
+
+    page = client.get("/recipes", params={"limit": 5})
+    assert client.get("/recipes", params={"limit": 5}, headers={"If-None-Match": page.headers["etag"]}).status_code == 304
+
+
+def test_update_with_a_stale_etag_is_refused(client, auth_headers):
+    created = client.post("/recipe", json={"name": "Contested bun"}, headers=auth_headers)
+    path = f"/recipe/{created.json()['id']}"
+    etag = created.headers["etag"]
+
+    updated = client.patch(path, json={"name": "First edit"}, headers={**auth_headers, "If-Match": etag})
+    assert updated.status_code == 200
+    assert updated.headers["etag"] != etag
+
+    stale = client.patch(path, json={"name": "Second edit"}, headers={**auth_headers, "If-Match": etag})
+    assert stale.status_code == 412
+    assert stale.headers["etag"] == updated.headers["etag"]
+    assert client.get(path).json()["name"] == "First edit"
+    assert client.get(path, headers={"If-None-Match": etag}).status_code == 200
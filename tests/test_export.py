@@ -0,0 +1,24 @@
+import orjson
+
+from config import ExportConfig
+
+
+def test_export_streams_one_owner_oldest_first(client, monkeypatch):
+    monkeypatch.setattr(ExportConfig, "yield_per", 2)
+    client.post("/register", json={"name": "Exporter", "email": "exporter@example.com", "password": "password"})
+    token = client.post("/token", data={"username": "exporter@example.com", "password": "password"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    created = [
+        client.post("/recipe", json={"name": f"Exported {number}"}, headers=headers).json() for number in range(3)
+    ]
+    owner_id = created[0]["owner_id"]
+
+    response = client.get("/recipes/export", params={"owner_id": owner_id})
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = response.content.splitlines()
+    assert [orjson.loads(line) for line in lines] == created
+
+    window = client.get("/recipes/export", params={"owner_id": owner_id, "created_from": created[1]["created_at"]})
+    assert [orjson.loads(line)["id"] for line in window.content.splitlines()] == [created[1]["id"], created[2]["id"]]
+    none = client.get("/recipes/export", params={"owner_id": owner_id, "created_to": created[0]["created_at"]})
+    assert none.content == b""
@@ -0,0 +1,88 @@
+import asyncio
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+from passlib.hash import bcrypt
+
+from config import AuthConfig
+from controller.auth import Auth, password_pool
+from controller.hashing import HashingPool
+from database.engine import SessionLocal
+from database.users import UserFunction
+
+
+def test_cancelled_caller_keeps_the_slot_until_the_hash_is_done():
+    pool = HashingPool(workers=1, queue_size=0, retry_after=1)
+    started, release = threading.Event(), threading.Event()
+
+    def slow_hash():
+        started.set()
+        release.wait(5)
+        return "hash"
+
+    async def run():
+        caller = asyncio.create_task(pool.run(slow_hash))
+        await asyncio.to_thread(started.wait, 5)
+        caller.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await caller
+
+        assert pool.in_flight == 1
+        with pytest.raises(HTTPException) as rejected:
+            await pool.run(slow_hash)
+        assert rejected.value.status_code == 503
+
+        release.set()
+        for _ in range(100):
+            if pool.in_flight == 0:
+                break
+            await asyncio.sleep(0.01)
+        assert await pool.run(lambda: "next") == "next"
+
+    try:
+        asyncio.run(run())
+    finally:
+        release.set()
+        pool.shutdown()
+    assert pool.stats() == {
+        "workers": 1, "limit": 1, "in_flight": 0, "completed": 2, "failed": 0, "rejected": 1,
+    }
+
+
+def test_failures_are_not_counted_as_completed():
+    pool = HashingPool(workers=1, queue_size=0, retry_after=1)
+
+    def broken():
+        raise ValueError("bad hash")
+
+    async def run():
+        with pytest.raises(ValueError):
+            await pool.run(broken)
+
+    asyncio.run(run())
+    pool.shutdown()
+    assert (pool.in_flight, pool.completed, pool.failed) == (0, 0, 1)
+
+
+def test_saturated_pool_turns_logins_away(client, auth_headers, monkeypatch):
+    monkeypatch.setattr(password_pool, "limit", 0)
+    response = client.post("/token", data={"username": "test@example.com", "password": "password"})
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == str(AuthConfig.password_hash_retry_after)
+
+
+def test_hash_of_another_cost_is_replaced_on_login(client):
+    client.post("/register", json={"name": "Cost", "email": "cost@example.com", "password": "password"})
+
+    async def stored_hash(new_hash=None):
+        async with SessionLocal() as session:
+            user = await UserFunction.get_user_by_email(session, "cost@example.com")
+            if new_hash is not None:
+                await Auth.update_password(session, user.id, new_hash)
+            return user.password
+
+    client.portal.call(stored_hash, bcrypt.using(rounds=4).hash("password"))
+    assert client.post("/token", data={"username": "cost@example.com", "password": "password"}).status_code == 200
+    assert bcrypt.from_string(client.portal.call(stored_hash)).rounds == AuthConfig.bcrypt_rounds
@@ -0,0 +1,115 @@
+import asyncio
+
+from config import IdempotencyConfig
+from idempotency import IdempotencyMiddleware
+
+
+def test_replay_of_a_compressed_response(client, auth_headers):
+    ids = []
+    for number in range(3):
+        recipe = {"name": f"Soup {number}", "ingredients": "water, salt", "instructions": "Boil the water. " * 40}
+        ids.append(client.post("/recipe", json=recipe, headers=auth_headers).json()["id"])
+    headers = {**auth_headers, "Idempotency-Key": "batch-gzip", "Accept-Encoding": "gzip"}
+
+    first = client.post("/recipes/batch", json={"ids": ids}, headers=headers)
+    replay = client.post("/recipes/batch", json={"ids": ids}, headers=headers)
+
+    assert first.headers["content-encoding"] == "gzip"
+    assert "idempotent-replayed" not in first.headers
+    assert replay.headers["idempotent-replayed"] == "true"
+    assert replay.headers["content-encoding"] == "gzip"
+    assert replay.headers["vary"] == "Accept-Encoding"
+    assert replay.headers.get("etag") == first.headers.get("etag")
+    assert replay.json() == first.json()
+
+    plain = client.post("/recipes/batch", json={"ids": ids}, headers={**headers, "Accept-Encoding": "identity"})
+    assert plain.headers["idempotent-replayed"] == "true"
+    assert "content-encoding" not in plain.headers
+    assert plain.json() == first.json()
+
+
+def test_retried_create_returns_the_created_recipe(client, auth_headers):
+    headers = {**auth_headers, "Idempotency-Key": "create-once"}
+    recipe = {"name": "Bread", "ingredients": "flour, water", "instructions": "Bake"}
+
+    created = client.post("/recipe", json=recipe, headers=headers)
+    retried = client.post("/recipe", json=recipe, headers=headers)
+
+    assert created.status_code == 200
+    assert created.json()["name"] == "Bread"
+    assert created.json()["version"] == 1
+    assert retried.headers["idempotent-replayed"] == "true"
+    assert retried.json() == created.json()
+    assert retried.headers["etag"] == created.headers["etag"]
+    stored = client.get(f"/recipe/{created.json()['id']}")
+    assert stored.json() == created.json()
+    assert stored.headers["etag"] == created.headers["etag"]
+
+
+class RecordingStore:
+    async def claim(self, key, fingerprint):
+        return "run", None
+
+    async def finish(self, key, fingerprint, response):
+        self.response = response
+
+
+def test_response_over_the_limit_is_not_kept(monkeypatch):
+    monkeypatch.setattr(IdempotencyConfig, "max_response_size", 10)
+
+    async def streamed(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"text/plain")]})
+        for chunk in (b"0123456789", b"abcdef", b"x"):
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    store = RecordingStore()
+    scope = {
+        "type": "http", "method": "POST", "path": "/recipes/batch", "query_string": b"",
+        "headers": [(b"idempotency-key", b"stream")], "client": ("127.0.0.1", 1),
+    }
+    asyncio.run(IdempotencyMiddleware(streamed, store)(scope, receive, send))
+
+    assert store.response is None
+    assert b"".join(message.get("body", b"") for message in sent[1:]) == b"0123456789abcdefx"
+
+
+def test_import_body_streams_past_the_middleware(monkeypatch):
+    monkeypatch.setattr(IdempotencyConfig, "max_body_size", 10)
+    chunks = [b"0123456789", b"abcdef", b""]
+    received = []
+
+    async def importer(scope, receive, send):
+        while True:
+            message = await receive()
+            received.append(message["body"])
+            if not message["more_body"]:
+                break
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    async def receive():
+        body = chunks.pop(0)
+        return {"type": "http.request", "body": body, "more_body": bool(chunks)}
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        "type": "http", "method": "POST", "path": "/recipes/import", "query_string": b"",
+        "headers": [(b"idempotency-key", b"import")], "client": ("127.0.0.1", 1),
+    }
+    asyncio.run(IdempotencyMiddleware(importer, RecordingStore())(scope, receive, send))
+
+    assert sent[0]["status"] == 200
+    assert received == [b"0123456789", b"abcdef", b""]
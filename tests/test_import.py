@@ -0,0 +1,62 @@
+import asyncio
+
+import orjson
+
+from controller import importer
+from database.engine import SessionLocal
+from database.users import UserFunction
+from modals import Recipie
+from database.recipe import RecipiessFunction
+
+
+def test_stalled_upload_does_not_hold_the_write_lock(client, auth_headers):
+    async def run():
+        async with SessionLocal() as session:
+            owner = await UserFunction.get_user_by_email(session, "test@example.com")
+
+        async def chunks():
+            yield orjson.dumps({"name": "Imported 1"}) + b"\n"
+            # the client stalls after the first batch, the other writes go on meanwhile
+            recipe = Recipie(name="Written during the import")
+            recipe.owner_id = owner.id
+            async with SessionLocal() as session:
+                await asyncio.wait_for(RecipiessFunction.create_recipe(session, recipe), 2)
+            yield orjson.dumps({"name": "Imported 2"}) + b"\n"
+
+        async with SessionLocal() as session:
+            return await importer.import_recipes(session, chunks(), "ndjson", owner.id, batch_size=1)
+
+    report = client.portal.call(run)
+
+    assert report["errors"] == []
+    assert report["imported"] == 2
+    assert report["failed"] == 0
+    names = {recipe["name"] for recipe in client.get("/recipes", params={"limit": 100}).json()}
+    assert {"Imported 1", "Imported 2", "Written during the import"} <= names
+
+
+def test_duplicate_ids_are_reported(client, auth_headers):
+    recipe_id = "0b8f2d6c-4e11-4f7e-9a55-3fa85f64a6a6"
+    body = b"\n".join(orjson.dumps({"id": recipe_id, "name": name}) for name in ("First", "Again"))
+
+    report = client.post("/recipes/import", content=body, headers=auth_headers).json()
+
+    assert report["imported"] == 1
+    assert report["errors"] == [{"line": 2, "error": f"Recipe {recipe_id} already exists"}]
+
+
+def test_created_at_is_stored_in_utc(client, auth_headers):
+    records = [
+        {"id": "5d0b3c9e-1f44-4c51-9d2e-6a1f0c7b8e01", "name": "Offset", "created_at": "2020-01-01T05:30:00+05:30"},
+        {"id": "5d0b3c9e-1f44-4c51-9d2e-6a1f0c7b8e02", "name": "Naive", "created_at": "2020-01-01T00:00:01"},
+    ]
+    body = b"\n".join(orjson.dumps(record) for record in records)
+    assert client.post("/recipes/import", content=body, headers=auth_headers).json()["imported"] == 2
+
+    offset = client.get(f"/recipe/{records[0]['id']}").json()
+    naive = client.get(f"/recipe/{records[1]['id']}").json()
+    assert offset["created_at"] == "2020-01-01 00:00:00+00:00"
+    assert naive["created_at"] == "2020-01-01 00:00:01+00:00"
+
+    first = client.get("/recipes", params={"cursor": "", "limit": 2}).json()["items"]
+    assert [recipe["name"] for recipe in first] == ["Offset", "Naive"]
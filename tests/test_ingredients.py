@@ -0,0 +1,59 @@
+import asyncio
+
+from sqlalchemy import func, select
+
+from modals import job
+from database.engine import engine
+from database.ingredients import normalize_ingredient, parse_ingredients
+
+
+def test_ingredient_names_are_normalized():
+    assert normalize_ingredient("2 cloves Garlic") == "garlic"
+    assert normalize_ingredient("1½ cups (heaped) plain flour") == "plain flour"
+    assert normalize_ingredient("200g") is None
+    assert parse_ingredients("Salt; 2 tbsp olive oil,\nsalt , pepper [ground]") == ["salt", "olive oil", "pepper"]
+
+
+async def jobs_done():
+    ''' Wait for the app's job queue to run the queued jobs (the ingredient index is written by one) '''
+    for _ in range(500):
+        async with engine.connect() as conn:
+            if not (await conn.execute(select(func.count()).select_from(job))).scalar():
+                return
+        await asyncio.sleep(0.01)
+    raise AssertionError("the jobs were not run")
+
+
+def names(response):
+    return [(item["name"], item["matches"]) for item in response.json()]
+
+
+def test_recipes_are_found_by_ingredient_sets(client, auth_headers):
+    recipes = {
+        "Moon soup": "moonbean, 2 cups sunroot, starleaf",
+        "Fire soup": "Moonbean, sunroot, 1 tsp firepepper",
+        "Star salad": "3 Starleaf, cloudherb",
+    }
+    created = {
+        name: client.post("/recipe", json={"name": name, "ingredients": ingredients}, headers=auth_headers).json()
+        for name, ingredients in recipes.items()
+    }
+    client.portal.call(jobs_done)
+
+    search = lambda **params: client.get("/recipes/by-ingredients", params=params)
+    assert sorted(names(search(include_all=["moonbean", "sunroot"]))) == [("Fire soup", 2), ("Moon soup", 2)]
+    assert names(search(include_all=["moonbean", "sunroot"], exclude=["firepepper"])) == [("Moon soup", 2)]
+    assert names(search(include_any=["starleaf", "cloudherb"])) == [("Star salad", 2), ("Moon soup", 1)]
+    assert names(search(include_all=["moonbean"], include_any=["starleaf", "cloudherb"])) == [("Moon soup", 2)]
+    assert search(include_all=["moonbean", "unknownroot"]).json() == {"message": "No recipes found"}
+    assert search(exclude=["moonbean"]).status_code == 400
+
+    client.patch(
+        f"/recipe/{created['Fire soup']['id']}", json={"ingredients": "moonbean, cloudherb"}, headers=auth_headers
+    )
+    client.portal.call(jobs_done)
+    assert names(search(include_all=["sunroot"])) == [("Moon soup", 1)]
+    assert sorted(names(search(include_any=["cloudherb"]))) == [("Fire soup", 1), ("Star salad", 1)]
+
+    client.delete(f"/recipe/{created['Star salad']['id']}", headers=auth_headers)
+    assert names(search(include_any=["cloudherb"])) == [("Fire soup", 1)]
@@ -0,0 +1,102 @@
+import time
+
+import pytest
+from sqlalchemy import select
+
+from modals import job
+from database import jobs
+from database.engine import engine
+from database.jobs import JobQueue, enqueue, claim_statement, requeue_failed_statement
+from database.writer import commit_write
+
+
+@pytest.fixture
+def failures(monkeypatch):
+    ''' How many more times the ` flaky ` jobs fail '''
+    failures = {"left": 0}
+
+    async def flaky(conn, payload):
+        if failures["left"]:
+            failures["left"] -= 1
+            raise RuntimeError("not yet")
+
+    monkeypatch.setitem(jobs.HANDLERS, "flaky", flaky)
+    return failures
+
+
+@pytest.fixture
+def queue(client, failures):
+    ''' A queue of the test's own to run the jobs with, the app's is stopped meanwhile '''
+    client.portal.call(jobs.job_queue.stop)
+    yield JobQueue(1.0, 50, lease_seconds=60, max_attempts=3, retry_base_seconds=0.2)
+    client.portal.call(jobs.job_queue.start)
+
+
+def run(client, fn, *args):
+    return client.portal.call(fn, *args)
+
+
+async def flaky_job():
+    async with engine.connect() as conn:
+        return (await conn.execute(select(job).where(job.c.kind == "flaky"))).first()
+
+
+async def enqueue_flaky():
+    await commit_write(lambda conn: enqueue(conn, "flaky", {}))
+
+
+def test_a_failing_job_is_retried_with_backoff(client, queue, failures):
+    failures["left"] = 2
+    run(client, enqueue_flaky)
+
+    started = time.time()
+    run(client, queue.run_due)
+    row = run(client, flaky_job)
+    assert (row.attempts, row.last_error, row.failed_at) == (1, "RuntimeError: not yet", None)
+    assert started + 0.2 <= row.run_after <= time.time() + 0.2
+    # not due before its backoff is over
+    run(client, queue.run_due)
+    assert run(client, flaky_job).attempts == 1
+
+    time.sleep(0.21)
+    started = time.time()
+    run(client, queue.run_due)
+    row = run(client, flaky_job)
+    assert row.attempts == 2
+    assert started + 0.4 <= row.run_after <= time.time() + 0.4
+
+    time.sleep(0.41)
+    run(client, queue.run_due)
+    assert run(client, flaky_job) is None
+    assert (queue.retried, queue.failed) == (2, 0)
+
+
+def test_a_job_failing_every_attempt_is_kept_until_requeued(client, queue, failures):
+    failures["left"] = 3
+    queue.retry_base_seconds = 0
+    run(client, enqueue_flaky)
+    for _ in range(3):
+        run(client, queue.run_due)
+    row = run(client, flaky_job)
+    assert row.attempts == 3 and row.failed_at is not None
+    assert queue.failed == 1 and queue.stats()["failed_jobs"] == 1
+
+    run(client, queue.run_due)
+    assert run(client, flaky_job).attempts == 3
+
+    run(client, commit_write, lambda conn: conn.execute(requeue_failed_statement()))
+    run(client, queue.run_due)
+    assert run(client, flaky_job) is None
+
+
+def test_a_job_whose_runner_died_is_run_once_its_lease_is_over(client, queue):
+    run(client, enqueue_flaky)
+    # what a runner that claimed the job and then died leaves behind
+    run(client, commit_write, lambda conn: conn.execute(claim_statement(time.time(), 50, 0.2)))
+
+    run(client, queue.run_due)
+    assert run(client, flaky_job).attempts == 1
+    time.sleep(0.21)
+    run(client, queue.run_due)
+    assert run(client, flaky_job) is None
+    assert queue.done >= 1
@@ -0,0 +1,30 @@
+import signal
+
+import pytest
+
+import launcher
+from launcher import RestartPolicy
+
+
+def test_restart_backoff_doubles_and_resets():
+    policy = RestartPolicy(min_uptime=10, backoff=1, backoff_max=3, max_rapid_failures=0)
+    assert [policy.delay(0.5) for _ in range(4)] == [1, 2, 3, 3]
+    assert policy.delay(60) == 0
+    assert policy.delay(0.5) == 1
+
+
+def test_supervisor_gives_up_on_a_crash_loop(monkeypatch):
+    def broken_worker(config, sock):
+        raise RuntimeError("can not start")
+
+    monkeypatch.setattr(launcher, "run_worker", broken_worker)
+    handlers = signal.getsignal(signal.SIGTERM), signal.getsignal(signal.SIGINT)
+    policy = RestartPolicy(min_uptime=10, backoff=0.01, backoff_max=0.05, max_rapid_failures=3)
+    try:
+        with pytest.raises(SystemExit) as exited:
+            launcher.supervise(None, None, workers=2, policy=policy)
+    finally:
+        signal.signal(signal.SIGTERM, handlers[0])
+        signal.signal(signal.SIGINT, handlers[1])
+    assert exited.value.code == 1
+    assert policy.rapid_failures == 3
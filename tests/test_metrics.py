@@ -0,0 +1,42 @@
+import re
+
+import metrics
+from config import MetricsConfig
+
+
+def sample(body: str, name: str, labels: str = ""):
+    match = re.search(rf"^{re.escape(name + labels)} (\S+)$", body, re.MULTILINE)
+    return float(match.group(1)) if match else 0.0
+
+
+def test_requests_are_counted_by_route_template(client, auth_headers):
+    created = client.post("/recipe", json={"name": "Measured soup"}, headers=auth_headers).json()
+    series = 'http_requests_total{method="GET",route="/recipe/{recipe_id}",status="200"}'
+    before = client.get("/metrics").text
+
+    client.get(f"/recipe/{created['id']}")
+    client.get(f"/recipe/{created['id']}")
+    body = client.get("/metrics")
+
+    assert body.headers["content-type"] == metrics.CONTENT_TYPE
+    assert sample(body.text, series) == sample(before, series) + 2
+    assert created["id"] not in body.text
+    assert sample(body.text, 'db_queries_total{operation="SELECT"}') > 0
+    assert "recipe_cache_hits" in body.text
+
+
+def test_a_request_repeating_a_statement_is_flagged(monkeypatch):
+    monkeypatch.setattr(MetricsConfig, "repeated_query_threshold", 3)
+    series = ("GET", "/test/n-plus-one")
+    request = metrics.RequestStats()
+    token = metrics.current_request.set(request)
+    try:
+        for _ in range(3):
+            metrics.record_query("SELECT * FROM recipie WHERE id = ?", 0.001)
+        metrics.record_query("COMMIT", 0.0)
+    finally:
+        metrics.current_request.reset(token)
+
+    assert request.queries == 4
+    metrics.record_request(*series, 200, 0.01, request)
+    assert sample(metrics.registry.render(), 'http_request_repeated_queries_total{method="GET",route="/test/n-plus-one"}') == 1
@@ -0,0 +1,55 @@
+from sqlalchemy import create_engine, text
+
+from database.migrations import upgrade, load_migrations, pending_migrations, applied_versions
+
+
+def test_migrations_apply_in_order_once_and_keep_the_data(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.connect() as conn:
+        assert [migration.version for migration in upgrade(conn, target=1)] == [1]
+        with conn.begin():
+            conn.execute(text(
+                "INSERT INTO recipie (name, ingredients, instructions, owner_id, created_at, id) "
+                "VALUES ('Old paella', 'rice, saffron', 'Cook', 'owner', '2020-01-01 00:00:00', 'recipe-1')"
+            ))
+        with conn.begin():
+            assert [migration.version for migration in pending_migrations(conn)][0] == 2
+
+        applied = upgrade(conn)
+        assert [migration.version for migration in applied] == [migration.version for migration in load_migrations()][1:]
+        assert upgrade(conn) == []
+        assert applied_versions(conn) == {migration.version for migration in load_migrations()}
+
+        assert conn.execute(text("SELECT version FROM recipie WHERE id = 'recipe-1'")).scalar() == 1
+        found = conn.execute(text("SELECT recipie.id FROM recipie_fts JOIN recipie ON recipie.rowid = recipie_fts.rowid "
+                                  "WHERE recipie_fts MATCH 'saffron'")).scalars().all()
+        assert found == ["recipe-1"]
+        ingredients = conn.execute(text(
+            "SELECT name FROM ingredient JOIN recipe_ingredient ON ingredient.id = ingredient_id ORDER BY name"
+        )).scalars().all()
+        assert ingredients == ["rice", "saffron"]
+    engine.dispose()
+
+
+def test_migrations_run_again_harmlessly(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'new.db'}")
+    with engine.connect() as conn:
+        upgrade(conn)
+        for migration in load_migrations():
+            with conn.begin():
+                migration.upgrade(conn)
+    engine.dispose()
+
+
+def test_owner_listing_is_one_index_seek(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'plan.db'}")
+    with engine.connect() as conn:
+        upgrade(conn)
+        plan = conn.execute(text(
+            "EXPLAIN QUERY PLAN SELECT * FROM recipie WHERE owner_id = 'owner' "
+            "AND (created_at, id) > ('2020', 'x') ORDER BY created_at, id LIMIT 10"
+        )).fetchall()
+    engine.dispose()
+    details = " ".join(row[-1] for row in plan)
+    assert "ix_recipie_owner_id_created_at_id" in details
+    assert "TEMP B-TREE" not in details
@@ -0,0 +1,46 @@
+import uuid
+
+import metrics
+from database.cache import recipe_cache
+from database.engine import SessionLocal
+from database.recipe import RecipiessFunction
+
+
+def test_owner_pages_hold_only_their_recipes_and_the_owner_once(client):
+    client.post("/register", json={"name": "Owner", "email": "owner@example.com", "password": "password"})
+    token = client.post("/token", data={"username": "owner@example.com", "password": "password"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    ids = [client.post("/recipe", json={"name": f"Owned {number}"}, headers=headers).json()["id"] for number in range(3)]
+    owner_id = client.get(f"/recipe/{ids[0]}").json()["owner_id"]
+
+    first = client.get(f"/users/{owner_id}/recipes", params={"limit": 2}).json()
+    assert first["owner"] == {"id": owner_id, "name": "Owner"}
+    assert [item["id"] for item in first["items"]] == ids[:2]
+    assert first["has_more"]
+    second = client.get(f"/users/{owner_id}/recipes", params={"limit": 2, "cursor": first["next_cursor"]}).json()
+    assert [item["id"] for item in second["items"]] == ids[2:]
+    assert not second["has_more"]
+
+    mine = client.get("/me/recipes", params={"limit": 10}, headers=headers).json()
+    assert [item["id"] for item in mine["items"]] == ids
+    assert client.get(f"/users/{uuid.uuid4()}/recipes").status_code == 404
+    assert client.get("/me/recipes").status_code == 401
+
+
+def test_a_page_is_one_query_whatever_its_size(client, auth_headers):
+    created = [client.post("/recipe", json={"name": f"Counted {number}"}, headers=auth_headers).json() for number in range(5)]
+
+    async def statements():
+        recipe_cache.clear()
+        async with SessionLocal() as session:
+            stats = metrics.RequestStats()
+            token = metrics.current_request.set(stats)
+            try:
+                page = await RecipiessFunction.get_recipes_by_owner(session, created[0]["owner_id"], "", 50)
+            finally:
+                metrics.current_request.reset(token)
+        return len(page["items"]), sum(stats.statements.values())
+
+    rows, count = client.portal.call(statements)
+    assert rows >= 5
+    assert count == 1
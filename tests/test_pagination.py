@@ -0,0 +1,35 @@
+from database.utils import encode_cursor, decode_cursor
+
+
+def walk(client, path, params, limit=2):
+    ids, cursor = [], ""
+    while True:
+        page = client.get(path, params={**params, "cursor": cursor, "limit": limit}).json()
+        ids += [item["id"] for item in page["items"]]
+        if not page["has_more"]:
+            assert page["next_cursor"] is None
+            return ids
+        cursor = page["next_cursor"]
+
+
+def test_cursor_pages_walk_every_recipe_once_in_order(client, auth_headers):
+    for number in range(5):
+        client.post("/recipe", json={"name": f"Walnut loaf {number}", "ingredients": "walnutty flour"}, headers=auth_headers)
+
+    walked = walk(client, "/recipes", {})
+    listed = [recipe["id"] for recipe in client.get("/recipes", params={"limit": 100}).json()]
+    assert walked == listed
+    assert len(set(walked)) == len(walked)
+
+    found = walk(client, "/recipie/search", {"query": "walnutty"})
+    assert len(found) == 5
+    assert found == [recipe_id for recipe_id in listed if recipe_id in found]
+
+
+def test_cursor_round_trip_and_invalid_cursors(client):
+    class Position:
+        created_at, id = "2024-01-01 00:00:00+00:00", "a-id"
+
+    assert decode_cursor(encode_cursor(Position)) == (Position.created_at, Position.id)
+    assert client.get("/recipes", params={"cursor": "not-a-cursor"}).status_code == 400
+    assert client.get("/recipie/search", params={"query": "walnutty", "cursor": "e30"}).status_code == 400
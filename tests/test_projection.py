@@ -0,0 +1,51 @@
+import gzip
+
+import brotli
+import orjson
+
+from compression import negotiate
+
+
+def test_fields_projects_pages_and_search_results(client, auth_headers):
+    client.post("/recipe", json={"name": "Projected parsnip soup", "ingredients": "parsnip, stock"}, headers=auth_headers)
+
+    page = client.get("/recipes", params={"limit": 3, "fields": "name,id"})
+    assert page.status_code == 200
+    assert all(set(item) == {"id", "name"} for item in page.json())
+    assert page.headers["etag"] != client.get("/recipes", params={"limit": 3}).headers["etag"]
+
+    found = client.get("/recipie/search", params={"query": "parsnip", "fields": "name,snippet"})
+    assert found.status_code == 200
+    items = found.json()
+    assert items and all(set(item) == {"name", "snippet"} for item in items)
+
+    assert client.get("/recipes", params={"fields": "name,password"}).status_code == 400
+
+
+def test_accept_encoding_is_negotiated():
+    assert negotiate("gzip;q=0.8, br") == "br"
+    assert negotiate("gzip, br;q=0") == "gzip"
+    assert negotiate("*;q=0.5, br;q=0") == "gzip"
+    assert negotiate("identity") is None
+    assert negotiate("") is None
+
+
+def test_large_responses_are_compressed_and_small_ones_are_not(client, auth_headers):
+    for number in range(10):
+        client.post("/recipe", json={"name": f"Compressed {number}", "instructions": "Stir well. " * 20}, headers=auth_headers)
+
+    for encoding, decompress in (("br", brotli.decompress), ("gzip", gzip.decompress)):
+        with client.stream("GET", "/recipes", params={"limit": 10}, headers={"Accept-Encoding": encoding}) as response:
+            raw = b"".join(response.iter_raw())
+        assert response.headers["content-encoding"] == encoding
+        assert response.headers["vary"] == "Accept-Encoding"
+        assert response.headers["etag"].endswith(f'-{encoding}"')
+        assert len(orjson.loads(decompress(raw))) == 10
+        assert client.get(
+            "/recipes", params={"limit": 10}, headers={"Accept-Encoding": encoding, "If-None-Match": response.headers["etag"]}
+        ).status_code == 304
+
+    plain = client.get("/recipes", params={"limit": 10}, headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers
+    small = client.get("/recipes", params={"limit": 1, "fields": "id"}, headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in small.headers
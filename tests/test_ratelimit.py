@@ -0,0 +1,53 @@
+import pytest
+
+import ratelimit
+from config import ClientConfig
+from ratelimit import MemoryBuckets, SharedBuckets, parse_rules
+
+
+def test_rules_are_parsed_and_checked():
+    assert parse_rules(" POST  /token=30/60, GET /recipie/search=2/1 ") == {
+        "POST /token": (30.0, 60.0), "GET /recipie/search": (2.0, 1.0),
+    }
+    for rule in ("POST /token=0/60", "POST /token=ten/60", "=3/60"):
+        with pytest.raises(ValueError):
+            parse_rules(rule)
+
+
+def test_a_client_over_its_limit_gets_429(client, monkeypatch):
+    monkeypatch.setattr(ratelimit.rate_limiter, "rules", {"GET /recipie/search": (2.0, 60.0)})
+    monkeypatch.setattr(ratelimit.rate_limiter, "buckets", MemoryBuckets(16))
+    monkeypatch.setattr(ClientConfig, "trust_forwarded", True)
+    search = lambda address: client.get("/recipie/search", params={"query": "soup"}, headers={"X-Forwarded-For": address})
+
+    assert [search("10.0.0.1").status_code for _ in range(2)] == [200, 200]
+    limited = search("10.0.0.1")
+    assert limited.status_code == 429
+    assert 0 < int(limited.headers["retry-after"]) <= 30
+    assert search("10.0.0.2").status_code == 200
+    assert client.get("/recipes", headers={"X-Forwarded-For": "10.0.0.1"}).status_code == 200
+    assert 'http_requests_shed_total{method="GET",route="/recipie/search",reason="rate_limited"}' in client.get("/metrics").text
+
+
+def test_requests_beyond_the_concurrency_limit_get_503(client, monkeypatch):
+    limiter = ratelimit.concurrency_limiter
+    monkeypatch.setattr(limiter, "routes", {"GET /recipie/search"})
+    monkeypatch.setattr(limiter, "in_flight", limiter.max_in_flight)
+
+    shed = client.get("/recipie/search", params={"query": "soup"})
+    assert shed.status_code == 503
+    assert shed.headers["retry-after"] == str(limiter.retry_after)
+    assert client.get("/recipes").status_code == 200
+
+    monkeypatch.setattr(limiter, "in_flight", 0)
+    assert client.get("/recipie/search", params={"query": "soup"}).status_code == 200
+    assert limiter.in_flight == 0
+
+
+def test_shared_buckets_are_one_bucket_across_workers(tmp_path):
+    path = str(tmp_path / "buckets")
+    first, second = SharedBuckets(path, 64), SharedBuckets(path, 64)
+    assert first.take("GET /x|client", 2, 0.001) == 0
+    assert second.take("GET /x|client", 2, 0.001) == 0
+    assert first.take("GET /x|client", 2, 0.001) > 0
+    assert second.take("GET /x|other", 2, 0.001) == 0
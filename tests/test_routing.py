@@ -0,0 +1,83 @@
+import time
+
+from starlette.requests import Request
+
+from clients import client_id
+from database.cache import recipe_cache
+from database.engine import SessionLocal
+from database.recipe import RecipiessFunction
+from database.routing import ReadRouter, LocalPins, SharedPins, request_keys
+
+
+def test_replica_reads_do_not_fill_the_recipe_cache(client, auth_headers):
+    created = client.post("/recipe", json={"name": "Lagging soup"}, headers=auth_headers).json()
+    key = ("recipe", created["id"])
+
+    async def read(from_replica):
+        recipe_cache.invalidate_tag(created["id"])
+        async with SessionLocal() as session:
+            if from_replica:
+                # what `ReadRouter.read_engine` leaves in the info of a session it sent to a replica
+                session.info["replica"] = "replica"
+            row = await RecipiessFunction.get_recipe_by_id(session, created["id"])
+        return row.name, recipe_cache.get(key)
+
+    assert client.portal.call(read, True) == ("Lagging soup", None)
+    name, cached = client.portal.call(read, False)
+    assert cached.name == name == "Lagging soup"
+
+
+def test_router_remembers_replica_reads_and_pins_writers():
+    router = ReadRouter(["replica"], LocalPins(16), sticky_seconds=60)
+    reader, writer, follower = {}, {}, {}
+    router.open_session(reader, ("client:a",))
+    router.open_session(writer, ("client:b",))
+
+    assert router.read_engine(reader) == "replica"
+    assert router.read_replica(reader)
+    router.wrote(writer)
+    assert router.read_engine(writer) is None
+    assert not router.read_replica(writer)
+
+    router.open_session(follower, ("client:b",))
+    assert router.read_engine(follower) is None
+    assert router.stats()["pinned_sessions"] == 1
+
+
+def test_client_id_is_the_peer_address():
+    scope = {"type": "http", "headers": [(b"authorization", b"Bearer x")], "client": ("10.0.0.1", 1234)}
+    request = Request(scope)
+    assert client_id(request) == "10.0.0.1"
+    assert request_keys(request)[0] == "client:10.0.0.1"
+
+
+def test_a_session_reads_one_replica_and_pins_expire():
+    router = ReadRouter(["first", "second", "third"], LocalPins(16), sticky_seconds=0.05)
+    info = {}
+    router.open_session(info, ("client:c",))
+    assert len({router.read_engine(info) for _ in range(20)}) == 1
+
+    router.wrote(info)
+    pinned = {}
+    router.open_session(pinned, ("client:c",))
+    assert router.read_engine(pinned) is None
+    time.sleep(0.1)
+    released = {}
+    router.open_session(released, ("client:c",))
+    assert router.read_engine(released) is not None
+
+
+def test_shared_pins_follow_a_client_across_workers(tmp_path):
+    path = str(tmp_path / "pins")
+    writer = ReadRouter(["replica"], SharedPins(path, 64), sticky_seconds=60)
+    reader = ReadRouter(["replica"], SharedPins(path, 64), sticky_seconds=60)
+    session = {}
+    writer.open_session(session, ("client:10.0.0.1", "token:abc"))
+    writer.wrote(session)
+
+    # the same token from another address, in another worker, still reads its writes
+    follower, stranger = {}, {}
+    reader.open_session(follower, ("client:10.0.0.2", "token:abc"))
+    reader.open_session(stranger, ("client:10.0.0.3",))
+    assert reader.read_engine(follower) is None
+    assert reader.read_engine(stranger) == "replica"
@@ -0,0 +1,89 @@
+import os
+import sys
+import sqlite3
+import subprocess
+
+from database.engine import engine
+from database.cache import search_cache
+from database.search import normalize_query, repair_index
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def matching_rowids(conn, word):
+    return conn.execute("SELECT rowid FROM recipie_fts WHERE recipie_fts MATCH ?", (word,)).fetchall()
+
+
+def test_vacuum_rebuilds_an_index_whose_rowids_moved(client, auth_headers, tmp_path):
+    client.post("/recipe", json={"name": "Saffron risotto", "ingredients": "rice, saffron"}, headers=auth_headers)
+    path = str(tmp_path / "copy.db")
+    source = sqlite3.connect(engine.url.database)
+    source.execute("VACUUM INTO ?", (path,))
+    source.close()
+
+    copy = sqlite3.connect(path)
+    assert not repair_index(copy)
+    # what a VACUUM renumbering the table looks like to the index
+    copy.execute("UPDATE recipie SET rowid = rowid + 1000000")
+    copy.commit()
+    (rowid,) = copy.execute("SELECT rowid FROM recipie WHERE name = 'Saffron risotto'").fetchone()
+    assert matching_rowids(copy, "saffron") != [(rowid,)]
+    copy.close()
+
+    env = {**os.environ, "DATABASE_URL": f"sqlite+aiosqlite:///{path}"}
+    vacuumed = subprocess.run(
+        [sys.executable, os.path.join(ROOT, "manage.py"), "vacuum"], env=env, capture_output=True, text=True, check=True
+    )
+    assert "recipie_fts rebuilt" in vacuumed.stdout
+
+    copy = sqlite3.connect(path)
+    (rowid,) = copy.execute("SELECT rowid FROM recipie WHERE name = 'Saffron risotto'").fetchone()
+    assert matching_rowids(copy, "saffron") == [(rowid,)]
+    assert not repair_index(copy)
+    copy.close()
+
+
+def test_matches_are_ranked_by_where_the_words_are(client, auth_headers):
+    recipes = [
+        {"name": "Plain rice", "ingredients": "rice", "instructions": "Serve with a quokkaberry on top"},
+        {"name": "Tart", "ingredients": "flour, quokkaberries", "instructions": "Bake"},
+        {"name": "Quokkaberry jam", "ingredients": "sugar", "instructions": "Boil"},
+    ]
+    for recipe in recipes:
+        client.post("/recipe", json=recipe, headers=auth_headers)
+
+    response = client.get("/recipie/search", params={"query": "QUOKKABERRIES"})
+    assert response.status_code == 200
+    assert response.headers["x-total-count"] == "3"
+    results = response.json()
+    assert [result["name"] for result in results] == ["Quokkaberry jam", "Tart", "Plain rice"]
+    assert "<mark>Quokkaberry</mark>" in results[0]["snippet"]
+
+    prefix = client.get("/recipie/search", params={"query": "quokkab jam"}).json()
+    assert [result["name"] for result in prefix] == ["Quokkaberry jam"]
+    assert client.get("/recipie/search", params={"query": "quokkaberry -- \"*"}).headers["x-total-count"] == "3"
+
+
+def test_queries_are_normalized_to_one_cache_key():
+    assert normalize_query(" Chicken  CURRIES chicken ") == ("chicken", "curri")
+    assert normalize_query("curry chickens") == normalize_query("Chicken Curry")
+    assert normalize_query("-- \"*") == ()
+
+
+def test_cached_searches_are_shared_and_dropped_on_write(client, auth_headers):
+    client.post("/recipe", json={"name": "Wombatfruit crumble", "ingredients": "wombatfruit"}, headers=auth_headers)
+    first = client.get("/recipie/search", params={"query": "wombatfruit crumble"})
+    assert first.headers["x-total-count"] == "1"
+
+    hits = search_cache.hits
+    respelled = client.get("/recipie/search", params={"query": "CRUMBLES  Wombatfruits"})
+    assert search_cache.hits > hits
+    assert respelled.json() == first.json()
+
+    # a write makes every cached result stale
+    generation, stale = search_cache.current(), search_cache.stale
+    client.post("/recipe", json={"name": "Wombatfruit crumble bars"}, headers=auth_headers)
+    assert search_cache.current() > generation
+    after = client.get("/recipie/search", params={"query": "wombatfruit crumble"})
+    assert after.headers["x-total-count"] == "2"
+    assert search_cache.stale > stale
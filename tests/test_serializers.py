@@ -0,0 +1,43 @@
+from collections import namedtuple
+
+import orjson
+from sqlalchemy import create_engine, literal, select, text
+
+from controller.serializers import dumps_recipes, ranked_response, ndjson_lines
+
+
+def read(statement):
+    engine = create_engine("sqlite://")
+    with engine.connect() as conn:
+        rows = conn.execute(statement).fetchall()
+    engine.dispose()
+    return rows
+
+
+def test_rows_are_encoded_by_name_whatever_their_column_order():
+    rows = read(text("SELECT 'b' AS name, 2 AS version, 'id-2' AS id UNION ALL SELECT 'a', 1, 'id-1'"))
+    swapped = read(text("SELECT 'id-3' AS id, 3 AS version, 'c' AS name"))
+
+    assert orjson.loads(dumps_recipes(rows, ("id", "name", "version"))) == [
+        {"id": "id-2", "name": "b", "version": 2}, {"id": "id-1", "name": "a", "version": 1},
+    ]
+    assert orjson.loads(dumps_recipes(swapped[0], ("id", "name"))) == {"id": "id-3", "name": "c"}
+    assert orjson.loads(dumps_recipes({"items": swapped, "has_more": False}, ("name",))) == {
+        "items": [{"name": "c"}], "has_more": False,
+    }
+    assert ndjson_lines(swapped, ("version", "id")) == b'{"version":3,"id":"id-3"}\n'
+    assert dumps_recipes([], ("id",)) == b"[]"
+
+
+def test_ranked_rows_and_plain_objects():
+    rows = read(select(literal("id-1").label("id"), literal("Soup").label("name")))
+    ranked = ranked_response([(rows[0], 3)], "matches", ("id", "name"))
+    assert orjson.loads(ranked.body) == [{"id": "id-1", "name": "Soup", "matches": 3}]
+
+    Recipe = namedtuple("Recipe", "name id")
+    assert orjson.loads(dumps_recipes([Recipe("Stew", "id-2")], ("id", "name"))) == [{"id": "id-2", "name": "Stew"}]
+
+    class Created:
+        id, name = "id-3", "Bread"
+
+    assert orjson.loads(dumps_recipes(Created(), ("id", "name"))) == {"id": "id-3", "name": "Bread"}
@@ -0,0 +1,53 @@
+import asyncio
+
+import pytest
+from sqlalchemy import text
+
+from database.writer import DatabaseWriter, WriteAborted
+
+
+def test_cancelled_write_fails_its_group_and_the_writer_keeps_going():
+    async def run():
+        writer = DatabaseWriter(max_batch=8, max_delay=0)
+        await writer.start()
+        try:
+            async def cancelled(conn):
+                raise asyncio.CancelledError()
+
+            with pytest.raises(WriteAborted):
+                await asyncio.wait_for(writer.run(cancelled), 2)
+            assert writer.running
+
+            result = await asyncio.wait_for(writer.run(lambda conn: conn.execute(text("SELECT 1"))), 2)
+            assert result.scalar() == 1
+        finally:
+            await writer.stop()
+
+        with pytest.raises(WriteAborted):
+            await writer.run(lambda conn: conn.execute(text("SELECT 1")))
+
+    asyncio.run(run())
+
+
+def test_writes_still_queued_fail_when_the_writer_is_cancelled():
+    async def run():
+        writer = DatabaseWriter(max_batch=1, max_delay=0)
+        await writer.start()
+        started = asyncio.Event()
+
+        async def slow(conn):
+            started.set()
+            await asyncio.sleep(10)
+
+        first = asyncio.ensure_future(writer.run(slow))
+        await started.wait()
+        queued = asyncio.ensure_future(writer.run(lambda conn: conn.execute(text("SELECT 1"))))
+        await asyncio.sleep(0)
+        writer._task.cancel()
+
+        for write in (first, queued):
+            with pytest.raises(WriteAborted):
+                await asyncio.wait_for(write, 2)
+        await writer.engine.dispose()
+
+    asyncio.run(run())